@@ -6,11 +6,62 @@ class Settings(BaseSettings):
     broker_url: str = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
     result_backend: str = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
     storage_path: str = os.getenv("STORAGE_PATH", "/app/storage")
+    dataset_root: str = os.getenv("DATASET_ROOT", "dataset")
     minio_endpoint: str = os.getenv("MINIO_ENDPOINT")
     minio_access_key: str = os.getenv("MINIO_ACCESS_KEY")
     minio_secret_key: str = os.getenv("MINIO_SECRET_KEY")
     minio_bucket: str = os.getenv("MINIO_BUCKET", "sign-dataset")
+    # blob storage for raw videos / sample files: "local" (shared dataset dir) or "s3" (minio_* settings).
+    # Either way the catalog CSVs, versions and flock locks live under dataset_root, so every
+    # API / worker node must mount the same dataset directory; s3 only moves the blobs.
+    storage_backend: str = os.getenv("STORAGE_BACKEND", "local")
+    storage_cache_dir: str = os.getenv("STORAGE_CACHE_DIR", "/tmp/signbridge-cache")
+    storage_cache_bytes: int = int(os.getenv("STORAGE_CACHE_BYTES", str(10 * 1024 ** 3)))
+    s3_multipart_threshold: int = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+    s3_multipart_chunksize: int = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+    s3_max_concurrency: int = int(os.getenv("S3_MAX_CONCURRENCY", "8"))
     access_token_secret: str = os.getenv("ACCESS_TOKEN_SECRET", "your-access-token-secret")
     refresh_token_secret: str = os.getenv("REFRESH_TOKEN_SECRET", "your-refresh-token-secret")
+    auth_cache_ttl: float = float(os.getenv("AUTH_CACHE_TTL", "60"))
+    auth_cache_size: int = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+    # Celery routing: short and long videos go to separate queues / worker pools
+    celery_short_queue: str = os.getenv("CELERY_SHORT_QUEUE", "video_short")
+    celery_long_queue: str = os.getenv("CELERY_LONG_QUEUE", "video_long")
+    long_video_bytes: int = int(os.getenv("LONG_VIDEO_BYTES", str(20 * 1024 * 1024)))
+    short_soft_time_limit: int = int(os.getenv("SHORT_SOFT_TIME_LIMIT", "120"))
+    long_soft_time_limit: int = int(os.getenv("LONG_SOFT_TIME_LIMIT", "1800"))
+    hard_time_limit_grace: int = int(os.getenv("HARD_TIME_LIMIT_GRACE", "60"))
+    # Redis broker: 0 is the highest priority, 9 the lowest (short jobs go first)
+    short_priority: int = int(os.getenv("SHORT_PRIORITY", "3"))
+    long_priority: int = int(os.getenv("LONG_PRIORITY", "7"))
+    worker_prefetch_multiplier: int = int(os.getenv("WORKER_PREFETCH_MULTIPLIER", "1"))
+    worker_max_tasks_per_child: int = int(os.getenv("WORKER_MAX_TASKS_PER_CHILD", "50"))
+    worker_max_memory_per_child_kb: int = int(os.getenv("WORKER_MAX_MEMORY_PER_CHILD_KB", str(1536 * 1024)))
+    # admission control for uploads (429 + Retry-After when exceeded)
+    max_queue_depth: int = int(os.getenv("MAX_QUEUE_DEPTH", "500"))
+    min_free_disk_bytes: int = int(os.getenv("MIN_FREE_DISK_BYTES", str(2 * 1024 ** 3)))
+    max_user_active_jobs: int = int(os.getenv("MAX_USER_ACTIVE_JOBS", "20"))
+    admission_retry_after: int = int(os.getenv("ADMISSION_RETRY_AFTER", "30"))
+    admission_cache_seconds: float = float(os.getenv("ADMISSION_CACHE_SECONDS", "1"))
+    batch_max_files: int = int(os.getenv("BATCH_MAX_FILES", "200"))
+    # tổng dung lượng (chưa nén) của các video trong một zip batch
+    batch_max_bytes: int = int(os.getenv("BATCH_MAX_BYTES", str(5 * 1024 ** 3)))
+    # tracing (opt-in): Zipkin v2 JSON lines, one span per line; the file is rotated to <file>.1
+    # once it exceeds trace_max_bytes. Empty trace_file = <dataset_root>/traces/spans.jsonl
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "0") == "1"
+    trace_file: str = os.getenv("TRACE_FILE", "")
+    trace_max_bytes: int = int(os.getenv("TRACE_MAX_BYTES", str(100 * 1024 * 1024)))
+    # profiling: fraction of jobs run under cProfile (0 = only jobs enqueued with profile=True)
+    # empty profile_dir = <dataset_root>/profiles
+    profile_sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    profile_dir: str = os.getenv("PROFILE_DIR", "")
+    # similarity index: ingest flags a sample whose nearest indexed sample has cosine >= duplicate_threshold
+    similarity_enabled: bool = os.getenv("SIMILARITY_ENABLED", "1") == "1"
+    duplicate_threshold: float = float(os.getenv("DUPLICATE_THRESHOLD", "0.97"))
+    # dataset GC: files younger than the grace period are never orphans (their catalog row may be in flight)
+    gc_grace_seconds: int = int(os.getenv("GC_GRACE_SECONDS", "3600"))
+    gc_raw_video_days: float = float(os.getenv("GC_RAW_VIDEO_DAYS", "7"))
+    gc_quarantine_days: float = float(os.getenv("GC_QUARANTINE_DAYS", "7"))
+    camera_ws_max_frames: int = int(os.getenv("CAMERA_WS_MAX_FRAMES", "900"))
 
 settings = Settings()
@@ -0,0 +1,100 @@
+# app/core/admission.py
+"""
+Admission control for upload endpoints.
+
+Before accepting work we check broker backlog, free disk under the dataset root and the
+caller's number of unfinished jobs. Overload is answered with 429 + Retry-After instead
+of letting the queue and raw_videos grow without bound. Queue depth is cached briefly
+so the check costs at most one Redis round trip per second per process.
+"""
+import time
+import shutil
+import threading
+
+import redis
+from fastapi import HTTPException, status
+
+from sqlalchemy import or_
+
+from app.config import settings
+from app.db import Job
+from app.job_tracking import stale_before
+
+PRIORITY_STEPS = range(1, 10)  # kombu redis priority sub-queues: "<queue>:<n>"
+
+_depth_cache = {"at": 0.0, "value": None}
+_depth_lock = threading.Lock()
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.broker_url, socket_timeout=1)
+    return _client
+
+
+def queue_lengths() -> dict:
+    """Waiting messages per video queue (all priority levels summed). Raises redis.RedisError."""
+    queues = (settings.celery_short_queue, settings.celery_long_queue)
+    pipe = _redis().pipeline()
+    for queue in queues:
+        pipe.llen(queue)
+        for step in PRIORITY_STEPS:
+            pipe.llen(f"{queue}:{step}")
+    counts = pipe.execute()
+    per_queue = len(PRIORITY_STEPS) + 1
+    return {queue: sum(counts[i * per_queue:(i + 1) * per_queue]) for i, queue in enumerate(queues)}
+
+
+def queue_depth() -> int:
+    """Messages waiting in the video queues (all priority levels). None if the broker is unreachable."""
+    now = time.monotonic()
+    with _depth_lock:
+        if now - _depth_cache["at"] < settings.admission_cache_seconds:
+            return _depth_cache["value"]
+    try:
+        depth = sum(queue_lengths().values())
+    except redis.RedisError:
+        depth = None
+    with _depth_lock:
+        _depth_cache["at"], _depth_cache["value"] = now, depth
+    return depth
+
+
+def free_disk_bytes(path: str = settings.dataset_root) -> int:
+    return shutil.disk_usage(path).free
+
+
+def active_jobs(db, owner: str) -> int:
+    """QUEUED and STARTED jobs of owner; STARTED rows past the hard time limit are dead workers, not load."""
+    return db.query(Job).filter(
+        Job.owner == owner,
+        or_(Job.state == "QUEUED",
+            (Job.state == "STARTED") & (or_(Job.started_at.is_(None), Job.started_at >= stale_before()))),
+    ).count()
+
+
+def _reject(detail: str):
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(settings.admission_retry_after)},
+    )
+
+
+def check_disk(path: str = settings.dataset_root):
+    if free_disk_bytes(path) < settings.min_free_disk_bytes:
+        _reject("Storage almost full, try again later")
+
+
+def check_video_admission(db, owner: str, n_jobs: int = 1, path: str = settings.dataset_root):
+    """Raise 429 if accepting n_jobs more videos would exceed queue, disk or per-user limits."""
+    depth = queue_depth()
+    if depth is not None and depth + n_jobs > settings.max_queue_depth:
+        _reject(f"Processing queue is full ({depth} waiting), try again later")
+    check_disk(path)
+    if settings.max_user_active_jobs > 0:
+        running = active_jobs(db, owner)
+        if running + n_jobs > settings.max_user_active_jobs:
+            _reject(f"You already have {running} videos in progress (limit {settings.max_user_active_jobs})")
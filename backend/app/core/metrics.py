@@ -0,0 +1,279 @@
+# app/core/metrics.py
+"""
+Prometheus text-format metrics.
+
+API metrics (per-route latency histogram, request counter, in-flight gauge) live in
+process memory and are recorded by MetricsMiddleware. Pipeline metrics are recorded by
+Celery worker children, which are separate processes, so they are accumulated in Redis
+hashes (HINCRBYFLOAT) and read back by the API when /metrics is scraped; every child of
+every worker container therefore contributes to the same series. Queue depth is read
+from the broker at scrape time.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+from app.config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+FPS_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 100, 200)
+REDIS_PREFIX = "metrics:"
+_LE_INF = 'le="+Inf"'
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value: float):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labelvalues, value: float):
+        with self._lock:
+            series = self._values.setdefault(labelvalues, [[0] * len(self.buckets), 0.0, 0])
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """labelvalues -> (non-cumulative bucket counts, sum, count)."""
+        with self._lock:
+            return {k: (list(counts), total, count) for k, (counts, total, count) in self._values.items()}
+
+    def render_series(self, series):
+        lines = self.header()
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for le, n in zip(self.buckets, counts):
+                cumulative += n
+                le_label = 'le="%s"' % _fmt(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le_label)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, _LE_INF)} {int(count)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {int(count)}")
+        return lines
+
+    def render(self):
+        return self.render_series(self.snapshot())
+
+
+# ---- API (in-process) ----
+HTTP_LATENCY = Histogram("signbridge_http_request_duration_seconds", "HTTP request latency by route.",
+                         ("method", "route"))
+HTTP_REQUESTS = Counter("signbridge_http_requests_total", "HTTP requests by route and status.",
+                        ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("signbridge_http_requests_in_flight", "HTTP requests currently being served.",
+                       ("method", "route"))
+API_METRICS = (HTTP_LATENCY, HTTP_REQUESTS, HTTP_IN_FLIGHT)
+
+
+def _route_template(scope) -> str:
+    from starlette.routing import Match
+
+    app = scope.get("app")
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"  # 404s must not create one series per path
+
+
+class MetricsMiddleware:
+    """ASGI middleware; latency is measured until the last body chunk, so streamed exports count in full."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, route = scope["method"], _route_template(scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(method, route)
+            HTTP_LATENCY.observe(method, route, value=time.perf_counter() - start)
+            HTTP_REQUESTS.inc(method, route, str(status["code"]))
+
+
+# ---- Pipeline (recorded by worker children, aggregated in Redis) ----
+STAGE_SECONDS = Histogram("signbridge_pipeline_stage_seconds",
+                          "Wall time per pipeline stage (decode, extract = inference, augment, save = write).",
+                          ("stage",), STAGE_BUCKETS)
+PIPELINE_FPS = Histogram("signbridge_pipeline_frames_per_second",
+                         "Sampled frames per second of decode + extract, per job.", (), FPS_BUCKETS)
+PIPELINE_JOBS = Counter("signbridge_pipeline_jobs_total", "Processed videos by outcome.", ("status",))
+PIPELINE_FRAMES = Counter("signbridge_pipeline_frames_total", "Sampled video frames run through extraction.")
+PIPELINE_BYTES = Counter("signbridge_pipeline_bytes_written_total", "Bytes of sample files written by the pipeline.")
+QUEUE_DEPTH = Gauge("signbridge_celery_queue_depth", "Messages waiting per Celery queue.", ("queue",))
+
+_redis_client = None
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.broker_url, socket_timeout=1)
+    return _redis_client
+
+
+def _key(labelvalues) -> str:
+    return "|".join(str(v) for v in labelvalues)
+
+
+def _hist_incr(pipe, hist: Histogram, labelvalues, value: float):
+    key = REDIS_PREFIX + hist.name
+    field = _key(labelvalues)
+    i = bisect_left(hist.buckets, value)
+    if i < len(hist.buckets):
+        pipe.hincrbyfloat(key, f"{field}#b{i}", 1)
+    pipe.hincrbyfloat(key, f"{field}#sum", value)
+    pipe.hincrbyfloat(key, f"{field}#count", 1)
+
+
+def record_pipeline(timings: dict, status: str, frames: int = 0, bytes_written: int = 0):
+    """Called once per job by the worker. Best effort: metrics must never fail the job."""
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        for stage, seconds in (timings or {}).items():
+            _hist_incr(pipe, STAGE_SECONDS, (stage,), float(seconds))
+        busy = (timings or {}).get("decode", 0) + (timings or {}).get("extract", 0)
+        if frames and busy > 0:
+            _hist_incr(pipe, PIPELINE_FPS, (), frames / busy)
+        pipe.hincrbyfloat(REDIS_PREFIX + PIPELINE_JOBS.name, status, 1)
+        if frames:
+            pipe.hincrbyfloat(REDIS_PREFIX + PIPELINE_FRAMES.name, "", frames)
+        if bytes_written:
+            pipe.hincrbyfloat(REDIS_PREFIX + PIPELINE_BYTES.name, "", bytes_written)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def _hist_from_redis(hist: Histogram, raw: dict):
+    series = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        name, _, part = field.rpartition("#")
+        labelvalues = tuple(name.split("|")) if hist.labelnames else ()
+        counts, total, count = series.setdefault(labelvalues, ([0] * len(hist.buckets), 0.0, 0))
+        value = float(value)
+        if part == "sum":
+            total = value
+        elif part == "count":
+            count = int(value)
+        else:
+            counts[int(part[1:])] = int(value)
+        series[labelvalues] = (counts, total, count)
+    return hist.render_series(series)
+
+
+def _counter_from_redis(counter: Counter, raw: dict):
+    lines = counter.header()
+    for field, value in sorted(raw.items()):
+        field = field.decode() if isinstance(field, bytes) else field
+        labelvalues = (field,) if counter.labelnames else ()
+        lines.append(f"{counter.name}{_labels(counter.labelnames, labelvalues)} {_fmt(float(value))}")
+    return lines
+
+
+def _worker_lines():
+    pipe = _redis().pipeline(transaction=False)
+    for metric in (STAGE_SECONDS, PIPELINE_FPS, PIPELINE_JOBS, PIPELINE_FRAMES, PIPELINE_BYTES):
+        pipe.hgetall(REDIS_PREFIX + metric.name)
+    stages, fps, jobs, frames, written = pipe.execute()
+    return (_hist_from_redis(STAGE_SECONDS, stages) + _hist_from_redis(PIPELINE_FPS, fps)
+            + _counter_from_redis(PIPELINE_JOBS, jobs) + _counter_from_redis(PIPELINE_FRAMES, frames)
+            + _counter_from_redis(PIPELINE_BYTES, written))
+
+
+def render() -> str:
+    """Full exposition: API metrics of this process, broker queue depth, aggregated worker metrics."""
+    from app.core import admission
+
+    lines = []
+    for metric in API_METRICS:
+        lines += metric.render()
+    try:
+        for queue, depth in admission.queue_lengths().items():
+            QUEUE_DEPTH.set(queue, value=depth)
+        lines += QUEUE_DEPTH.render()
+    except Exception:
+        pass  # broker down: omit the series rather than report 0
+    try:
+        lines += _worker_lines()
+    except Exception:
+        pass
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,9 @@
 # app/core/oauth2.py
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -12,9 +16,11 @@ from app.core.security import (
     REFRESH_TOKEN_EXPIRE_DAYS,
 )
 from ..db import get_db, User
+from ..config import settings
 
 # Khai báo OAuth2 scheme để lấy token từ header Authorization: Bearer <token>
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,17 +38,20 @@ def create_refresh_token(data: dict):
     data.update({"exp": expire})
     return jwt.encode(data, REFRESH_TOKEN_SECRET, algorithm=ALGORITHM)
 
-def verify_access_token(token: str):
+def access_token_claims(token: str) -> dict:
+    """Decoded, verified access token payload (always has "sub")."""
     if not token:
         raise HTTPException(status_code=401, detail="Missing access token")
     try:
         payload = jwt.decode(token, ACCESS_TOKEN_SECRET, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        return username
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
+
+def verify_access_token(token: str):
+    return access_token_claims(token)["sub"]
 
 def verify_refresh_token(token: str):
     if not token:
@@ -56,13 +65,112 @@ def verify_refresh_token(token: str):
     except JWTError:
         raise credentials_exception
 
+# Thế hệ auth dùng chung qua Redis: invalidate_user() tăng số này, mọi process thấy ngay
+AUTH_GEN_KEY = "auth:gen:{}"
+_redis_client = None
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.broker_url, socket_timeout=1)
+    return _redis_client
+
+def _generation(username: str):
+    """(global, per-user) invalidation counters, or None when Redis is unreachable (then nothing is cached)."""
+    try:
+        values = _redis().mget(AUTH_GEN_KEY.format("*"), AUTH_GEN_KEY.format(username))
+    except Exception:
+        return None
+    return tuple(int(v or 0) for v in values)
+
+class _UserCache:
+    """
+    Bounded TTL cache: verified access token -> detached User.
+    Entries never outlive the token's own exp and are only served while the user's shared
+    generation (see invalidate_user) still matches the one seen when the entry was stored.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires, user, generation = entry
+            if expires <= time.time():
+                del self._entries[token]
+                return None
+        current = _generation(user.username)
+        with self._lock:
+            if current != generation:
+                self._entries.pop(token, None)
+                return None
+            if token in self._entries:
+                self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: User, token_exp: float, generation):
+        if self.ttl <= 0 or generation is None:
+            return
+        with self._lock:
+            self._entries[token] = (min(time.time() + self.ttl, token_exp), user, generation)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str = None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                return
+            for token in [t for t, (_, u, _g) in self._entries.items() if u.username == username]:
+                del self._entries[token]
+
+user_cache = _UserCache(settings.auth_cache_ttl, settings.auth_cache_size)
+
+def invalidate_user(username: str = None):
+    """
+    Call after a user's role/profile changes (or with None to flush everything).
+    Bumps the shared generation so cached entries in every API process stop matching.
+    """
+    user_cache.invalidate(username)
+    try:
+        _redis().incr(AUTH_GEN_KEY.format("*" if username is None else username))
+    except Exception:
+        # Redis down: other processes can't use their cache either (_generation is None)
+        pass
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    username = verify_access_token(token)
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+    payload = access_token_claims(token)
+    username = payload["sub"]
+    # đọc generation trước khi query DB: invalidate xen giữa sẽ làm entry này lệch ngay
+    generation = _generation(username) if user_cache.ttl > 0 else None
     user = db.query(User).filter(User.username == username).first()
     if user is None:
         raise credentials_exception
+    # detach so later commits in this session can't expire the cached instance
+    db.expunge(user)
+    user_cache.put(token, user, float(payload.get("exp", 0)), generation)
     return user
 
+def get_current_user_stream(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Like get_current_user, but also accepts ?access_token= (EventSource/WebSocket can't send headers)."""
+    return get_current_user(token or access_token, db)
+
 def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     user = get_current_user(token, db)
     if user.role != "admin":
@@ -0,0 +1,246 @@
+# app/core/tracing.py
+"""
+Lightweight request -> queue -> pipeline tracing.
+
+Spans are kept in a contextvar (so nested `with span(...)` blocks become children) and
+exported on close as Zipkin v2 JSON, one span per line, to TRACE_FILE. The
+trace context crosses the Celery boundary as a W3C `traceparent` message header plus an
+`enqueued_at` timestamp, from which the worker emits a `queue.wait` span.
+
+Off unless TRACING_ENABLED=1. Once the file exceeds TRACE_MAX_BYTES it is renamed to
+<file>.1 (replacing the previous one), so at most twice that is kept on disk.
+
+Inspect one job offline:
+    python -m app.core.tracing <job_id | trace_id> [--file spans.jsonl]
+Send to a Zipkin-compatible collector:
+    jq -s . spans.jsonl | curl -X POST -H 'Content-Type: application/json' -d @- http://zipkin:9411/api/v2/spans
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import secrets
+import argparse
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from app.config import settings
+
+SERVICE = {"name": "signbridge-api"}
+TRACE_FILE = settings.trace_file or os.path.join(settings.dataset_root, "traces", "spans.jsonl")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("signbridge_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "duration", "kind", "tags")
+
+    def __init__(self, name: str, trace_id: str = None, parent_id: str = None, start: float = None,
+                 kind: str = None, tags: dict = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time() if start is None else start
+        self.duration = None
+        self.kind = kind
+        self.tags = {k: str(v) for k, v in (tags or {}).items()}
+
+    def tag(self, **tags):
+        self.tags.update({k: str(v) for k, v in tags.items()})
+
+    def finish(self, end: float = None):
+        self.duration = (time.time() if end is None else end) - self.start
+        export(self)
+
+    def to_zipkin(self) -> dict:
+        out = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1e6),
+            "duration": max(1, int((self.duration or 0) * 1e6)),
+            "localEndpoint": {"serviceName": SERVICE["name"]},
+            "tags": self.tags,
+        }
+        if self.parent_id:
+            out["parentId"] = self.parent_id
+        if self.kind:
+            out["kind"] = self.kind
+        return out
+
+
+def set_service(name: str):
+    SERVICE["name"] = name
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def export(span: Span):
+    """Append one JSON line. Best effort: tracing must never fail a request or a job."""
+    if not settings.tracing_enabled:
+        return
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        line = (json.dumps(span.to_zipkin(), ensure_ascii=False) + "\n").encode("utf-8")
+        fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)  # single O_APPEND write: lines from concurrent processes do not interleave
+            st = os.fstat(fd)
+            if st.st_size > settings.trace_max_bytes and os.stat(TRACE_FILE).st_ino == st.st_ino:
+                os.replace(TRACE_FILE, TRACE_FILE + ".1")  # inode check: another process may have rotated it
+        finally:
+            os.close(fd)
+    except Exception:
+        pass
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, kind: str = None, **tags):
+    """Child of `parent` (default: the current span); a new trace is started if there is none."""
+    parent = parent if parent is not None else _current.get()
+    s = Span(name, trace_id=parent.trace_id if parent else None, parent_id=parent.span_id if parent else None,
+             kind=kind, tags=tags)
+    token = _current.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.tag(error=str(e)[:500])
+        raise
+    finally:
+        _current.reset(token)
+        s.finish()
+
+
+def traced(name: str, kind: str = None):
+    """Decorator form of span() for sync and async functions (signature is kept for FastAPI)."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind=kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind=kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ---- propagation ----
+def format_traceparent(s: Span) -> str:
+    return f"00-{s.trace_id}-{s.span_id}-01"
+
+
+def parse_traceparent(value: str) -> Optional[Span]:
+    """Remote parent reconstructed from a traceparent header (not exported itself)."""
+    try:
+        _, trace_id, span_id, _ = value.split("-")
+    except (AttributeError, ValueError):
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16:
+        return None
+    remote = Span("remote", trace_id=trace_id)
+    remote.span_id = span_id
+    return remote
+
+
+def celery_headers() -> dict:
+    """Headers for apply_async / signature.set so the task continues the current trace."""
+    s = _current.get()
+    headers = {"enqueued_at": time.time()}
+    if s is not None:
+        headers["traceparent"] = format_traceparent(s)
+    return headers
+
+
+def _request_header(request, name):
+    value = getattr(request, name, None)
+    if value is None:
+        value = (getattr(request, "headers", None) or {}).get(name)
+    return value
+
+
+@contextmanager
+def task_span(name: str, request, **tags):
+    """
+    Span for a Celery task, parented on the producer's traceparent header. If the message
+    carries enqueued_at, a queue.wait span covering enqueue -> task start is emitted first.
+    """
+    parent = parse_traceparent(_request_header(request, "traceparent"))
+    enqueued_at = _request_header(request, "enqueued_at")
+    if enqueued_at is not None:
+        try:
+            wait = Span("queue.wait", trace_id=parent.trace_id if parent else None,
+                        parent_id=parent.span_id if parent else None, start=float(enqueued_at),
+                        tags={"queue": (getattr(request, "delivery_info", None) or {}).get("routing_key") or "", **tags})
+            wait.finish()
+            parent = parent or Span("remote", trace_id=wait.trace_id)
+        except (TypeError, ValueError):
+            pass
+    with span(name, parent=parent, kind="CONSUMER", **tags) as s:
+        yield s
+
+
+# ---- offline inspection ----
+def load_trace(key: str, path: str = None):
+    """All spans of the trace identified by trace id or by a span tagged job_id=key."""
+    path = path or TRACE_FILE
+    spans = []
+    for part in (path + ".1", path):  # rotated file first: a trace may straddle the rotation
+        if not os.path.exists(part):
+            continue
+        with open(part, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    trace_ids = {s["traceId"] for s in spans if s["traceId"] == key or s.get("tags", {}).get("job_id") == key}
+    return [s for s in spans if s["traceId"] in trace_ids]
+
+
+def format_tree(spans) -> str:
+    """Indented span tree with offsets from trace start and durations in ms."""
+    if not spans:
+        return "no spans"
+    children = {}
+    ids = {s["id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["timestamp"]):
+        parent = s.get("parentId") if s.get("parentId") in ids else None
+        children.setdefault(parent, []).append(s)
+    t0 = min(s["timestamp"] for s in spans)
+    lines = []
+
+    def walk(parent, depth):
+        for s in children.get(parent, []):
+            tags = " ".join(f"{k}={v}" for k, v in s.get("tags", {}).items() if k != "error")
+            err = "  ERROR: " + s["tags"]["error"] if "error" in s.get("tags", {}) else ""
+            lines.append(f"{(s['timestamp'] - t0) / 1000:10.1f}ms {s['duration'] / 1000:10.1f}ms  "
+                         f"{'  ' * depth}{s['name']} [{s['localEndpoint']['serviceName']}] {tags}{err}")
+            walk(s["id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the span tree of one job or trace.")
+    parser.add_argument("key", help="job id or trace id")
+    parser.add_argument("--file", default=TRACE_FILE)
+    args = parser.parse_args()
+    spans = load_trace(args.key, args.file)
+    print(format_tree(spans))
+    sys.exit(0 if spans else 1)
+
+
+if __name__ == "__main__":
+    main()
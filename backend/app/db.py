@@ -1,10 +1,12 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, DateTime, Date, JSON
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, DateTime, Date, JSON, Text, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.config import settings
 from passlib.hash import bcrypt
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+# SQLite (local runs / load tests): sessions are used from FastAPI's threadpool
+_connect_args = {"check_same_thread": False} if settings.database_url.startswith("sqlite") else {}
+engine = create_engine(settings.database_url, pool_pre_ping=True, connect_args=_connect_args)
 metadata = MetaData()
 
 labels = Table(
@@ -41,13 +43,58 @@ class User(Base):
     role = Column(String, nullable=False)
     created_at = Column(DateTime, server_default=func.now())
 
+class Job(Base):
+    """One row per enqueued processing task; id is the Celery task id."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    batch_id = Column(String, index=True)         # set for jobs enqueued by /upload/videos
+    owner = Column(String, nullable=False)        # authenticated uploader
+    user = Column(String)                         # "user" form field (signer)
+    label = Column(String)
+    session_id = Column(String)
+    dialect = Column(String)
+    video_path = Column(String)
+    state = Column(String, nullable=False, default="QUEUED")  # QUEUED, STARTED, SUCCESS, FAILURE
+    stage = Column(String)
+    stage_timings = Column(JSON)
+    sample_ids = Column(JSON)
+    error = Column(Text)
+    duration = Column(Float)
+    profile_path = Column(String)                 # cProfile dump when the job was profiled
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_jobs_state_created", "state", "created_at"),
+        Index("ix_jobs_owner_created", "owner", "created_at"),
+        Index("ix_jobs_label_created", "label", "created_at"),
+        Index("ix_jobs_session", "session_id"),
+    )
+
 SessionLocal = sessionmaker(autoflush=False, autocommit=False, bind=engine)
 
 def init_db():
     metadata.create_all(engine)
     Base.metadata.create_all(engine) # type: ignore
+    add_missing_columns()
     create_default_admin()
 
+def add_missing_columns():
+    """create_all never alters existing tables; add nullable columns introduced after the table was created."""
+    from sqlalchemy import inspect
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(ddl)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,58 @@
+"""
+Opt-in cProfile capture for processing jobs.
+
+A job is profiled when it was enqueued with profile=True or, otherwise, with probability
+settings.profile_sample_rate. The pstats dump is written to dataset/profiles/<job_id>.pstats
+and its path stored on the jobs row, so GET /jobs/{job_id}/profile can serve it
+(raw pstats for snakeviz / `python -m pstats`, or a text summary).
+
+cProfile only sees the thread that runs the job. Work handed to other threads (S3
+transfer threads) shows up as time spent waiting on them.
+"""
+import io
+import os
+import random
+import pstats
+import cProfile
+from contextlib import contextmanager
+
+from app.config import settings
+
+PROFILE_DIR = settings.profile_dir or os.path.join(settings.dataset_root, "profiles")
+SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+
+def should_profile(requested: bool = False) -> bool:
+    return bool(requested) or (settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate)
+
+
+@contextmanager
+def profiled(job_id: str, enabled: bool):
+    """
+    Run the block under cProfile when enabled. Yields a dict whose "path" is set to the
+    written .pstats file on exit (also when the block raises).
+    """
+    out = {"path": None}
+    if not enabled:
+        yield out
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield out
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{job_id}.pstats")
+            profiler.dump_stats(path)
+            out["path"] = path
+        except OSError:
+            pass  # a failed dump must not fail the job
+
+
+def render_text(path: str, sort: str = "cumulative", limit: int = 60) -> str:
+    buf = io.StringIO()
+    stats = pstats.Stats(path, stream=buf)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return buf.getvalue()
@@ -0,0 +1,99 @@
+"""
+Job progress events over Redis pub/sub.
+
+Workers publish {stage, done, total, progress} to channel job-progress:<job_id> and keep
+the latest event under job-progress:last:<job_id>, so a client that subscribes late
+still gets the current state. The API relays the channel as server-sent events.
+"""
+import json
+import time
+
+import redis
+
+from app.config import settings
+
+CHANNEL = "job-progress:{}"
+LAST_KEY = "job-progress:last:{}"
+LAST_TTL = 24 * 3600
+TERMINAL_STAGES = ("done", "error")
+
+# stage -> (start, end) share of overall progress
+STAGE_SPAN = {
+    "queued": (0.0, 0.0),
+    "decoding": (0.0, 0.1),
+    "extracting": (0.1, 0.85),
+    "augmenting": (0.85, 0.9),
+    "saving": (0.9, 1.0),
+    "done": (1.0, 1.0),
+    "error": (1.0, 1.0),
+}
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.broker_url)
+    return _client
+
+
+def make_event(job_id: str, stage: str, done: int = None, total: int = None, **extra) -> dict:
+    lo, hi = STAGE_SPAN.get(stage, (0.0, 0.0))
+    frac = (done / total) if done is not None and total else 0.0
+    event = {"job_id": job_id, "stage": stage, "done": done, "total": total,
+             "progress": round(lo + (hi - lo) * min(frac, 1.0), 4), "ts": time.time()}
+    event.update(extra)
+    return event
+
+
+def publish(event: dict):
+    """Best effort: progress must never fail the job."""
+    try:
+        payload = json.dumps(event)
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.publish(CHANNEL.format(event["job_id"]), payload)
+        pipe.set(LAST_KEY.format(event["job_id"]), payload, ex=LAST_TTL)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def last_event(job_id: str):
+    try:
+        raw = get_redis().get(LAST_KEY.format(job_id))
+    except Exception:
+        return None
+    return json.loads(raw) if raw else None
+
+
+class ProgressReporter:
+    """
+    Callable handed to the pipeline: reporter(stage, done=None, total=None).
+    Publishes on every stage change and at most every `interval` seconds within a stage;
+    on_stage(stage) is called once per new stage (used to update the jobs row).
+    """
+
+    def __init__(self, job_id: str, interval: float = 0.5, on_stage=None):
+        self.job_id = job_id
+        self.interval = interval
+        self.on_stage = on_stage
+        self.stage = None
+        self._last = 0.0
+
+    def __call__(self, stage: str, done: int = None, total: int = None, **extra):
+        now = time.monotonic()
+        changed = stage != self.stage
+        finished = done is not None and total is not None and done >= total
+        if not changed and not finished and now - self._last < self.interval:
+            return
+        self._last = now
+        if changed:
+            self.stage = stage
+            if self.on_stage:
+                try:
+                    self.on_stage(stage)
+                except Exception:
+                    pass
+        publish(make_event(self.job_id, stage, done, total, **extra))
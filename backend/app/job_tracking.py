@@ -0,0 +1,111 @@
+"""
+Job tracking helpers shared by the API (insert on enqueue) and workers (state updates).
+Every write uses its own short session so workers never hold a connection during processing.
+"""
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.db import SessionLocal, Job
+
+FINISHED_STATES = ("SUCCESS", "FAILURE")
+
+
+def create_job(db, job_id: str, owner: str, **fields) -> Job:
+    job = Job(id=job_id, owner=owner, state="QUEUED", **fields)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def create_jobs(db, owner: str, items, batch_id: str = None):
+    """Insert many QUEUED jobs in one commit. items: iterable of (job_id, fields dict)."""
+    db.add_all([Job(id=job_id, owner=owner, batch_id=batch_id, state="QUEUED", **fields) for job_id, fields in items])
+    db.commit()
+
+
+def batch_summary(db, batch_id: str):
+    """Aggregate state counts of a batch, or None if it has no jobs."""
+    from sqlalchemy import func
+
+    rows = db.query(Job.state, func.count(Job.id)).filter(Job.batch_id == batch_id).group_by(Job.state).all()
+    if not rows:
+        return None
+    counts = dict(rows)
+    total = sum(counts.values())
+    finished = sum(counts.get(s, 0) for s in FINISHED_STATES)
+    owner = db.query(Job.owner).filter(Job.batch_id == batch_id).limit(1).scalar()
+    return {
+        "batch_id": batch_id,
+        "owner": owner,
+        "total": total,
+        "counts": counts,
+        "finished": finished,
+        "progress": round(finished / total, 4),
+        "done": finished == total,
+    }
+
+
+def update_job(job_id: str, **fields):
+    """Update a job row, inserting a minimal one if the task was enqueued outside the API."""
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        if job is None:
+            job = Job(id=job_id, owner=fields.pop("owner", ""), state="QUEUED")
+            db.add(job)
+        for key, value in fields.items():
+            setattr(job, key, value)
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_started(job_id: str, **fields):
+    update_job(job_id, state="STARTED", started_at=datetime.utcnow(), **fields)
+
+
+def stale_before() -> datetime:
+    """
+    STARTED rows older than this cannot still be running: Celery's hard time limit
+    (long_soft_time_limit + hard_time_limit_grace) has passed, plus one more grace period.
+    """
+    limit = settings.long_soft_time_limit + 2 * settings.hard_time_limit_grace
+    return datetime.utcnow() - timedelta(seconds=limit)
+
+
+def is_stale(job: Job) -> bool:
+    return job.state == "STARTED" and job.started_at is not None and job.started_at < stale_before()
+
+
+def mark_finished(job_id: str, state: str, **fields):
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        started = job.started_at if job is not None else None
+    finally:
+        db.close()
+    duration = (now - started).total_seconds() if started else None
+    update_job(job_id, state=state, finished_at=now, duration=duration, **fields)
+
+
+def job_to_dict(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "batch_id": job.batch_id,
+        "owner": job.owner,
+        "user": job.user,
+        "label": job.label,
+        "session_id": job.session_id,
+        "dialect": job.dialect,
+        "state": job.state,
+        "stage": job.stage,
+        "stage_timings": job.stage_timings or {},
+        "sample_ids": job.sample_ids or [],
+        "error": job.error,
+        "duration": job.duration,
+        "has_profile": bool(job.profile_path),
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -1,8 +1,10 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import os
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import dataset, upload, jobs, users, auth
 from app.db import init_db
+from app.core import metrics
 
 app = FastAPI(title="Sign Dataset Backend")
 
@@ -17,6 +19,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# per-route latency / in-flight metrics, exposed at /metrics
+app.add_middleware(metrics.MetricsMiddleware)
 
 # init DB tables (dev). In prod, use migrations (alembic).
 @app.on_event("startup")
@@ -27,4 +31,9 @@ app.include_router(dataset.router)
 app.include_router(upload.router)
 app.include_router(jobs.router)
 app.include_router(users.router)
-app.include_router(auth.router)
\ No newline at end of file
+app.include_router(auth.router)
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -5,11 +5,11 @@ Refactored augmentation functions
 """
 
 import numpy as np
-import cv2
 import random
 
 # -------- Stage A: Frame-level augment --------
 def flip_frames(frames):
+    import cv2  # frame-level augmentation only runs in workers
     return [cv2.flip(f, 1) for f in frames]
 
 def add_gaussian_noise(frames, mean=0, sigma=10):
@@ -21,6 +21,7 @@ def add_gaussian_noise(frames, mean=0, sigma=10):
     return noisy_frames
 
 def adjust_brightness(frames, factor=1.2):
+    import cv2
     return [cv2.convertScaleAbs(f, alpha=factor, beta=0) for f in frames]
 
 def stage_a_frame_level(frames):
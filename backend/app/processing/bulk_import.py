@@ -0,0 +1,197 @@
+"""
+Bulk import of pre-extracted samples from a tar (optionally gzip/bz2/xz) of npz + json pairs.
+
+The archive is read as a stream (tarfile mode "r|*"), so it is never spooled to a temp
+file or held in memory; members waiting for their pair are kept as raw (compressed) bytes,
+at most MAX_PENDING_BYTES of them. Pairs are matched by path stem, validated in chunks (shape and
+finiteness checks vectorised over all arrays of the same shape) and written through
+storage_utils.save_samples_batch, so each chunk is a single catalog commit.
+
+Label of a sample, first match wins: json "label" / "label_original", the archive's
+labels.csv (folder_name -> label_original, as written by /dataset/export), the
+top-level folder name, then the default label.
+
+CLI:  python -m app.processing.bulk_import archive.tar [--label L] [--user U] [--dim D]
+"""
+
+import io
+import os
+import csv
+import json
+import tarfile
+import argparse
+from typing import Optional
+
+import numpy as np
+
+from app.processing import storage_utils as su
+
+CHUNK_SIZE = 256
+MAX_PENDING_BYTES = 256 * 1024 * 1024  # raw bytes of unmatched members kept while waiting for their pair
+
+
+def _load_sequence(data: bytes):
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        if "sequence" in npz:
+            return npz["sequence"]
+        if "sequences" in npz:
+            return npz["sequences"]
+    raise ValueError("npz has no 'sequence' array")
+
+
+def _validate_chunk(chunk, expected_dim: Optional[int]):
+    """Split chunk into (ok, rejected). Checks run once per distinct shape on stacked arrays."""
+    ok, rejected = [], []
+    by_shape = {}
+    for item in chunk:
+        seq = item["sequence"]
+        if seq.ndim != 2 or seq.shape[0] == 0 or seq.shape[1] == 0:
+            rejected.append({"file": item["name"], "reason": f"bad shape {seq.shape}"})
+        elif expected_dim is not None and seq.shape[1] != expected_dim:
+            rejected.append({"file": item["name"], "reason": f"feature_dim_mismatch ({seq.shape[1]}!={expected_dim})"})
+        elif seq.dtype.kind not in "fiu":
+            rejected.append({"file": item["name"], "reason": f"non-numeric dtype {seq.dtype}"})
+        else:
+            by_shape.setdefault(seq.shape, []).append(item)
+    for group in by_shape.values():
+        stacked = np.stack([item["sequence"] for item in group]).astype(np.float32, copy=False)
+        finite = np.isfinite(stacked).all(axis=(1, 2))
+        for item, good in zip(group, finite):
+            if good:
+                ok.append(item)
+            else:
+                rejected.append({"file": item["name"], "reason": "non-finite values"})
+    return ok, rejected
+
+
+def _label_for(item, folder_labels, default_label):
+    meta = item["meta"]
+    for key in ("label", "label_original"):
+        if meta.get(key):
+            return meta[key]
+    folder = item["name"].split("/")[0] if "/" in item["name"] else ""
+    if folder in folder_labels:
+        return folder_labels[folder]
+    return folder or default_label
+
+
+def _commit(chunk, report, folder_labels, default_label, user, expected_dim):
+    ok, rejected = _validate_chunk(chunk, expected_dim)
+    report["rejected"].extend(rejected)
+    batch = []
+    for item in ok:
+        label = _label_for(item, folder_labels, default_label)
+        if not label:
+            report["rejected"].append({"file": item["name"], "reason": "no label"})
+            continue
+        class_idx, folder = su.register_label(label)
+        meta = item["meta"]
+        metadata = {
+            "user": user or meta.get("user", ""),
+            "session_id": meta.get("session_id", ""),
+            "frames": int(item["sequence"].shape[0]),
+            "duration": meta.get("duration", ""),
+            "source": meta.get("source") or "import",
+            "dialect": meta.get("dialect", ""),
+            "imported_from": item["name"],
+        }
+        batch.append((item["sequence"], class_idx, folder, metadata))
+    su.save_samples_batch(batch)
+    report["imported"] += len(batch)
+
+
+def import_tar(fileobj, default_label: str = "", user: str = "", expected_dim: Optional[int] = None,
+               chunk_size: int = CHUNK_SIZE) -> dict:
+    """Stream-import a tar of npz/json pairs. Returns {imported, rejected: [{file, reason}], skipped}."""
+    report = {"imported": 0, "rejected": [], "skipped": 0}
+    folder_labels = {}
+    pending = {}   # stem -> {"name", "npz"?: raw bytes, "meta"?, "bytes"}; decoded only when ready
+    pending_bytes = 0
+    chunk = []
+
+    def ready(stem):
+        nonlocal pending_bytes
+        entry = pending.pop(stem)
+        pending_bytes -= entry["bytes"]
+        try:
+            sequence = _load_sequence(entry["npz"])
+        except Exception as e:
+            report["rejected"].append({"file": entry["name"], "reason": f"unreadable: {e}"})
+            return
+        chunk.append({"name": entry["name"], "sequence": sequence, "meta": entry.get("meta", {})})
+        if len(chunk) >= chunk_size:
+            _commit(chunk, report, folder_labels, default_label, user, expected_dim)
+            chunk.clear()
+
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError as e:
+        raise ValueError(f"Not a tar archive: {e}")
+
+    with tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member.name[2:] if member.name.startswith("./") else member.name
+            name = os.path.normpath(name)
+            stem, ext = os.path.splitext(name)
+            data = tar.extractfile(member).read()
+
+            if os.path.basename(name) == "labels.csv":
+                for row in csv.DictReader(io.StringIO(data.decode("utf-8"))):
+                    if row.get("folder_name") and row.get("label_original"):
+                        folder_labels[row["folder_name"]] = row["label_original"]
+                continue
+            if ext not in (".npz", ".json"):
+                report["skipped"] += 1
+                continue
+
+            entry = pending.setdefault(stem, {"name": stem + ".npz", "bytes": 0})
+            if ext == ".npz":
+                entry["npz"] = data
+            else:
+                try:
+                    entry["meta"] = json.loads(data.decode("utf-8"))
+                except ValueError as e:
+                    if "npz" not in entry:
+                        pending.pop(stem)
+                    report["rejected"].append({"file": name, "reason": f"unreadable: {e}"})
+                    continue
+            entry["bytes"] += len(data)
+            pending_bytes += len(data)
+
+            if "npz" in entry and "meta" in entry:
+                ready(stem)
+            while pending_bytes > MAX_PENDING_BYTES:
+                # archive is not grouped by pair; import the oldest npz without its json
+                oldest = next((s for s, e in pending.items() if "npz" in e), None)
+                if oldest is None:
+                    break
+                ready(oldest)
+
+    for stem in list(pending):
+        if "npz" in pending[stem]:
+            ready(stem)  # npz without json: defaults only
+        else:
+            report["rejected"].append({"file": pending.pop(stem)["name"][:-4] + ".json", "reason": "json without npz"})
+    if chunk:
+        _commit(chunk, report, folder_labels, default_label, user, expected_dim)
+
+    report["rejected_count"] = len(report["rejected"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import npz/json samples from a tar archive")
+    parser.add_argument("archive")
+    parser.add_argument("--label", default="", help="label for samples that carry none")
+    parser.add_argument("--user", default="", help="override the user of every sample")
+    parser.add_argument("--dim", type=int, default=None, help="required feature dim (e.g. 1605)")
+    args = parser.parse_args()
+    with open(args.archive, "rb") as f:
+        report = import_tar(f, default_label=args.label, user=args.user, expected_dim=args.dim)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Incremental garbage collection of the dataset tree.
+
+One pass reconciles the catalog (samples.csv) with dataset/features and cleans up:
+- orphan files: .npz/.json that no catalog row references (a job died between writing the
+  files and appending its row), stale *.tmp files, and folders no label owns;
+- dangling rows: catalog rows whose npz is gone from this node and, with a remote blob
+  store, from the bucket too. They are dropped from samples.csv and reported to
+  dataset_stats.record_removed, their leftover .json is an orphan of the same pass, and
+  the similarity index is compacted with them;
+- raw videos of jobs that finished more than GC_RAW_VIDEO_DAYS ago, and spooled videos no
+  queued/running job references.
+
+Incremental: dataset/gc_state.json keeps the mtime of every feature folder seen by the
+previous pass (the watermark). Adding, removing or renaming a file changes its folder's
+mtime, so only changed folders are listed again; all other folders cost one stat. A
+folder holding unreferenced files younger than GC_GRACE_SECONDS (their catalog row may
+still be in flight) keeps its old watermark and is rescanned next time. Finished jobs are
+consumed by finished_at from the previous cutoff on.
+
+Orphans are moved to dataset/.quarantine/<run>/ (default) or deleted; quarantined runs
+older than GC_QUARANTINE_DAYS are purged. Dry runs report without touching anything and
+do not advance the watermark. Bytes of files still hard-linked into a dataset version
+are not counted as reclaimable.
+
+With a remote blob store (STORAGE_BACKEND=s3) the bucket objects of removed files are
+deleted together with the local file: right away in delete mode, when the quarantine
+run is purged otherwise (remote raw video keys are listed in the run's remote_keys.txt).
+
+CLI:  python -m app.processing.dataset_gc [--apply] [--delete] [--full]
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.processing import storage_utils as su
+
+GC_STATE_JSON = os.path.join(su.DATASET_ROOT, "gc_state.json")
+QUARANTINE_ROOT = os.path.join(su.DATASET_ROOT, ".quarantine")
+RAW_VIDEO_DIR = os.path.join(su.DATASET_ROOT, "raw_videos")
+MODES = ("quarantine", "delete")
+REMOTE_KEYS = "remote_keys.txt"  # per quarantine run: bucket objects to delete when it is purged
+REPORT_LIMIT = 100  # paths / ids listed per category; counts and bytes cover everything
+ROOT_KEY = "."
+
+
+def _read_state():
+    try:
+        with open(GC_STATE_JSON, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_state(state):
+    with su.atomic_open(GC_STATE_JSON, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def _reclaimable(st):
+    """Bytes freed by unlinking: nothing while a dataset version still links the inode."""
+    return st.st_size if st.st_nlink <= 1 else 0
+
+
+def _tree_usage(path):
+    """(bytes, reclaimable bytes, newest mtime) of a directory tree."""
+    size = reclaimable = 0
+    newest = os.stat(path).st_mtime
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            reclaimable += _reclaimable(st)
+            newest = max(newest, st.st_mtime)
+    return size, reclaimable, newest
+
+
+# ---- features reconciliation ----
+def _known_folders(rows):
+    """Feature folders (relative to FEATURE_ROOT) that belong to a label or hold catalog rows."""
+    labels = su.load_labels()
+    known = {r["folder_name"] for r in rows}
+    for r in labels.rows:
+        known.add(labels.resolve_folder(int(r["class_idx"]), r["folder_name"]))
+    parents = set()
+    for rel in known:
+        parts = rel.split("/")
+        parents.update("/".join(parts[:i]) for i in range(1, len(parts)))
+    return known, parents
+
+
+def _scan_folder(rel, files_by_name, known, parents, now, grace):
+    """
+    List one folder. Returns (orphans, dangling rows, has_young_orphans).
+    files_by_name: catalog rows of this folder keyed by npz file name.
+    """
+    path = su.FEATURE_ROOT if rel == ROOT_KEY else os.path.join(su.FEATURE_ROOT, rel)
+    orphans, present, young = [], set(), False
+    for entry in os.scandir(path):
+        child = entry.name if rel == ROOT_KEY else f"{rel}/{entry.name}"
+        if entry.is_dir(follow_symlinks=False):
+            if child in known or child in parents:
+                continue  # scanned on its own
+            size, reclaimable, newest = _tree_usage(entry.path)
+            if now - newest < grace:
+                young = True
+                continue
+            orphans.append({"path": os.path.relpath(entry.path, su.DATASET_ROOT), "kind": "dir",
+                            "bytes": size, "reclaimable": reclaimable})
+            continue
+        name = entry.name
+        present.add(name)
+        if name.endswith(".tmp"):
+            referenced = False
+        elif name.endswith(".npz"):
+            referenced = name in files_by_name
+        elif name.endswith(".json"):
+            referenced = name[:-len(".json")] + ".npz" in files_by_name
+        else:
+            continue  # not ours
+        if referenced:
+            continue
+        st = entry.stat(follow_symlinks=False)
+        if now - st.st_mtime < grace:
+            young = True
+            continue
+        orphans.append({"path": os.path.relpath(entry.path, su.DATASET_ROOT), "kind": "file",
+                        "bytes": st.st_size, "reclaimable": _reclaimable(st)})
+    dangling = [row for name, row in files_by_name.items() if name not in present]
+    return orphans, dangling, young
+
+
+def _reconcile_features(state, now, grace, full):
+    """Walk changed folders only. Returns (orphans, dangling rows, new folder watermarks, stats)."""
+    rows = su.list_samples()
+    by_folder = {}
+    for r in rows:
+        by_folder.setdefault(r["folder_name"], {})[r["file"]] = r
+    known, parents = _known_folders(rows)
+    seen = {} if full else state.get("folders", {})
+
+    orphans, dangling, watermarks = [], [], {}
+    scanned = skipped = 0
+    for rel in [ROOT_KEY] + sorted(known | parents):
+        path = su.FEATURE_ROOT if rel == ROOT_KEY else os.path.join(su.FEATURE_ROOT, rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns  # taken before listing: later changes trigger a rescan
+        except FileNotFoundError:
+            dangling.extend(by_folder.get(rel, {}).values())  # folder removed, e.g. by delete_label
+            continue
+        if seen.get(rel) == mtime:
+            watermarks[rel] = mtime
+            skipped += 1
+            continue
+        folder_orphans, folder_dangling, young = _scan_folder(rel, by_folder.get(rel, {}), known, parents, now, grace)
+        orphans.extend(folder_orphans)
+        dangling.extend(folder_dangling)
+        if young:
+            if rel in seen:
+                watermarks[rel] = seen[rel]
+        else:
+            watermarks[rel] = mtime
+        scanned += 1
+    return orphans, dangling, watermarks, {"scanned_folders": scanned, "skipped_folders": skipped}
+
+
+def _confirm_dangling(dangling, store):
+    """
+    Keep only rows whose npz exists nowhere. This node may simply not hold a copy when
+    samples live in a remote blob store; a store error keeps the row.
+    """
+    if not store.remote:
+        return dangling
+    confirmed = []
+    for row in dangling:
+        try:
+            if not store.exists(su.sample_key(row)):
+                confirmed.append(row)
+        except Exception:
+            continue
+    return confirmed
+
+
+def _leftover_json(dangling, known_paths):
+    """The .json files next to dropped rows' npz: orphans in the same pass."""
+    out = []
+    for row in dangling:
+        path = os.path.splitext(su.sample_path(row))[0] + ".json"
+        rel = os.path.relpath(path, su.DATASET_ROOT)
+        if rel in known_paths:
+            continue
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        out.append({"path": rel, "kind": "file", "bytes": st.st_size, "reclaimable": _reclaimable(st)})
+    return out
+
+
+def _drop_rows(dangling):
+    """Remove rows from samples.csv (one rewrite under the samples lock) and from the stats."""
+    from app.processing import dataset_stats
+
+    ids = {r["sample_id"] for r in dangling}
+    with su.file_lock("samples"):
+        index = su.load_samples()
+        kept = [r for r in index.rows if r["sample_id"] not in ids]
+        if len(kept) == len(index.rows):
+            return 0
+        su.write_csv(su.SAMPLES_CSV, kept, index.fieldnames or su.SAMPLE_FIELDS)
+        dataset_stats.record_removed(dangling)
+    return len(index.rows) - len(kept)
+
+
+# ---- raw videos ----
+def _raw_video_candidates(state, now, retention_days, remote):
+    """Videos of jobs finished before the cutoff (since the last cutoff) + unreferenced spooled files."""
+    from app.db import SessionLocal, Job
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    since = state.get("raw_videos_finished_before")
+    out, active = [], set()
+    db = SessionLocal()
+    try:
+        q = db.query(Job.video_path).filter(Job.state.in_(("SUCCESS", "FAILURE")), Job.video_path.isnot(None),
+                                            Job.finished_at < cutoff)
+        if since:
+            q = q.filter(Job.finished_at >= datetime.fromisoformat(since))
+        finished = {video_path for (video_path,) in q}
+        active = {video_path for (video_path,) in
+                  db.query(Job.video_path).filter(Job.state.in_(("QUEUED", "STARTED")), Job.video_path.isnot(None))}
+    finally:
+        db.close()
+
+    for video_path in sorted(finished - active):
+        if remote:  # object key; the API spool copy is already gone
+            out.append({"path": video_path, "remote": True, "bytes": 0, "reclaimable": 0})
+            continue
+        try:
+            st = os.stat(video_path)
+        except FileNotFoundError:
+            continue
+        out.append({"path": video_path, "remote": False, "bytes": st.st_size, "reclaimable": _reclaimable(st)})
+
+    listed = {c["path"] for c in out}
+    active_abs = {os.path.abspath(p) for p in active}
+    if os.path.isdir(RAW_VIDEO_DIR):
+        for entry in os.scandir(RAW_VIDEO_DIR):
+            if not entry.is_file(follow_symlinks=False) or entry.path in listed:
+                continue
+            st = entry.stat()
+            if now - st.st_mtime < retention_days * 86400 or os.path.abspath(entry.path) in active_abs:
+                continue
+            out.append({"path": entry.path, "remote": False, "bytes": st.st_size, "reclaimable": _reclaimable(st)})
+    return out, cutoff
+
+
+# ---- apply ----
+def _feature_blob_keys(abs_path, rel_path):
+    """
+    Blob keys of the sample files at rel_path ('features/...', a file or a directory).
+    Objects keep the key they were written under, features/<original folder>/<file>, and
+    merges only nest folders, so the original folder is the file's parent directory name.
+    """
+    if rel_path.split("/")[0] != "features":
+        return []
+    if os.path.isdir(abs_path):
+        rels = [os.path.relpath(os.path.join(dirpath, name), abs_path).replace(os.sep, "/")
+                for dirpath, _, names in os.walk(abs_path) for name in names]
+        rels = [f"{rel_path.rstrip('/')}/{rel}" for rel in rels]
+    else:
+        rels = [rel_path]
+    return ["/".join(["features"] + rel.split("/")[1:][-2:]) for rel in rels]
+
+
+def _delete_blobs(store, keys):
+    for key in keys:
+        try:
+            store.delete(key)
+        except Exception:  # store unreachable: the object is only leaked, the local cleanup stands
+            pass
+
+
+def _remove(abs_path, rel_path, mode, run_dir, store):
+    if mode == "quarantine":
+        dst = os.path.join(run_dir, rel_path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(abs_path, dst)
+        return
+    keys = _feature_blob_keys(abs_path, rel_path) if store.remote else []
+    if os.path.isdir(abs_path):
+        shutil.rmtree(abs_path)
+    else:
+        os.remove(abs_path)
+    _delete_blobs(store, keys)
+
+
+def _purge_quarantine(now, days, store):
+    """Delete quarantine runs older than `days`, with their bucket objects. Returns reclaimed bytes."""
+    if not os.path.isdir(QUARANTINE_ROOT):
+        return 0
+    reclaimed = 0
+    for entry in os.scandir(QUARANTINE_ROOT):
+        if entry.is_dir() and now - entry.stat().st_mtime > days * 86400:
+            if store.remote:
+                features = os.path.join(entry.path, "features")
+                keys = _feature_blob_keys(features, "features") if os.path.isdir(features) else []
+                try:
+                    with open(os.path.join(entry.path, REMOTE_KEYS), encoding="utf-8") as f:
+                        keys += [line.strip() for line in f if line.strip()]
+                except FileNotFoundError:
+                    pass
+                _delete_blobs(store, keys)
+            reclaimed += _tree_usage(entry.path)[1]
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return reclaimed
+
+
+def run(dry_run=True, mode="quarantine", full=False, grace_seconds=None, raw_video_days=None):
+    """One GC pass; returns a report. Only one pass runs at a time (gc file lock)."""
+    from app.processing import object_store, similarity
+
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    grace = settings.gc_grace_seconds if grace_seconds is None else grace_seconds
+    raw_video_days = settings.gc_raw_video_days if raw_video_days is None else raw_video_days
+    start = time.time()
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    run_dir = os.path.join(QUARANTINE_ROOT, run_id)
+
+    with su.file_lock("gc"):
+        previous = _read_state()
+        state = {} if full else previous
+        store = object_store.get_store()
+        orphans, dangling, watermarks, scan = _reconcile_features(state, start, grace, full)
+        dangling = _confirm_dangling(dangling, store)
+        orphans += _leftover_json(dangling, {o["path"] for o in orphans})
+        try:
+            raw_videos, raw_cutoff = _raw_video_candidates(state, start, raw_video_days, store.remote)
+            raw_error = None
+        except Exception as e:  # DB unreachable: features GC still runs
+            raw_videos, raw_cutoff, raw_error = [], None, str(e)
+
+        report = {
+            "run_id": run_id,
+            "dry_run": dry_run,
+            "mode": mode,
+            "full": full,
+            **scan,
+            "orphans": {"count": len(orphans), "bytes": sum(o["bytes"] for o in orphans),
+                        "paths": [o["path"] for o in orphans[:REPORT_LIMIT]]},
+            "dangling_rows": {"count": len(dangling), "sample_ids": [r["sample_id"] for r in dangling[:REPORT_LIMIT]]},
+            "raw_videos": {"count": len(raw_videos), "bytes": sum(v["bytes"] for v in raw_videos),
+                           "paths": [v["path"] for v in raw_videos[:REPORT_LIMIT]]},
+            "reclaimable_bytes": sum(o["reclaimable"] for o in orphans) + sum(v["reclaimable"] for v in raw_videos),
+            "reclaimed_bytes": 0,
+        }
+        if raw_error:
+            report["raw_videos"]["error"] = raw_error
+        if dry_run:
+            report["duration_s"] = round(time.time() - start, 3)
+            return report
+
+        reclaimed = 0
+        for o in orphans:
+            try:
+                _remove(os.path.join(su.DATASET_ROOT, o["path"]), o["path"], mode, run_dir, store)
+            except FileNotFoundError:
+                continue
+            if mode == "delete":
+                reclaimed += o["reclaimable"]
+        remote_keys = []
+        for v in raw_videos:
+            if v["remote"]:
+                remote_keys.append(v["path"])
+                continue
+            try:
+                _remove(v["path"], os.path.relpath(v["path"], su.DATASET_ROOT), mode, run_dir, store)
+            except FileNotFoundError:
+                continue
+            if mode == "delete":
+                reclaimed += v["reclaimable"]
+        if remote_keys and mode == "delete":
+            _delete_blobs(store, remote_keys)
+        elif remote_keys:  # no rename in the bucket: deleted when this quarantine run is purged
+            os.makedirs(run_dir, exist_ok=True)
+            with open(os.path.join(run_dir, REMOTE_KEYS), "a", encoding="utf-8") as f:
+                f.write("".join(key + "\n" for key in remote_keys))
+
+        report["dropped_rows"] = _drop_rows(dangling) if dangling else 0
+        report["embeddings_dropped"] = similarity.compact() if dangling or full else 0
+        reclaimed += _purge_quarantine(start, settings.gc_quarantine_days, store)
+        report["reclaimed_bytes"] = reclaimed
+        if mode == "quarantine" and (orphans or raw_videos):
+            report["quarantined_to"] = os.path.relpath(run_dir, su.DATASET_ROOT)
+
+        # watermarks are the mtimes seen before this pass changed anything, so folders
+        # touched by it (and by concurrent writers) are listed once more next time
+        state = {"folders": watermarks, "last_run": run_id, "last_report": {
+            k: report[k] for k in ("orphans", "dangling_rows", "raw_videos", "reclaimed_bytes")}}
+        if raw_cutoff is not None:
+            state["raw_videos_finished_before"] = raw_cutoff.isoformat()
+        elif "raw_videos_finished_before" in previous:
+            state["raw_videos_finished_before"] = previous["raw_videos_finished_before"]
+        _write_state(state)
+        report["duration_s"] = round(time.time() - start, 3)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Garbage-collect the dataset tree (dry run by default).")
+    parser.add_argument("--apply", action="store_true", help="actually move / delete (default: report only)")
+    parser.add_argument("--delete", action="store_true", help="delete orphans instead of quarantining them")
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and list every folder")
+    args = parser.parse_args()
+    report = run(dry_run=not args.apply, mode="delete" if args.delete else "quarantine", full=args.full)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
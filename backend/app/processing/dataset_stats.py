@@ -0,0 +1,134 @@
+"""
+Incrementally maintained dataset statistics (dataset/stats.json).
+
+Counters are updated by storage_utils under the samples lock whenever catalog rows are
+added, removed or re-labelled by a merge, so reading stats never scans samples.csv.
+If the file is missing it is rebuilt once from the catalog.
+"""
+
+import os
+import json
+import threading
+
+from app.processing import storage_utils as su
+
+STATS_JSON = os.path.join(su.DATASET_ROOT, "stats.json")
+FRAMES_BUCKET = 10
+GROUPS = (("by_label", "class_idx"), ("by_user", "user"), ("by_dialect", "dialect"),
+          ("by_source", "source"), ("by_day", "created_at"))
+
+_cache = {"stamp": None, "stats": None}
+_cache_lock = threading.Lock()
+
+
+def _empty():
+    stats = {"total": 0, "frames_histogram": {}, "updated_at": su.now_str()}
+    for group, _ in GROUPS:
+        stats[group] = {}
+    return stats
+
+
+def _key(group, row, field):
+    value = row.get(field) or ""
+    return value[:10] if group == "by_day" else str(value)
+
+
+def _frames_bucket(row):
+    try:
+        frames = int(float(row.get("frames") or 0))
+    except ValueError:
+        frames = 0
+    return str(frames // FRAMES_BUCKET * FRAMES_BUCKET)
+
+
+def _bump(counter, key, delta):
+    counter[key] = counter.get(key, 0) + delta
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _apply(stats, rows, sign):
+    for row in rows:
+        stats["total"] += sign
+        for group, field in GROUPS:
+            _bump(stats[group], _key(group, row, field), sign)
+        _bump(stats["frames_histogram"], _frames_bucket(row), sign)
+
+
+def _write(stats):
+    stats["updated_at"] = su.now_str()
+    tmp_path = f"{STATS_JSON}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(STATS_JSON), exist_ok=True)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False)
+    os.replace(tmp_path, STATS_JSON)
+
+
+def _read():
+    try:
+        with open(STATS_JSON, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def summarize(rows):
+    """Stats of an arbitrary set of catalog rows (e.g. one user's samples); nothing is stored."""
+    stats = _empty()
+    _apply(stats, rows, +1)
+    return stats
+
+
+def rebuild():
+    """Recount everything from the catalog. Caller should hold the samples lock."""
+    stats = summarize(su.list_samples())
+    _write(stats)
+    return stats
+
+
+# ---- hooks called by storage_utils (samples lock held) ----
+def record_added(rows):
+    stats = _read()
+    if stats is None:
+        rebuild()  # catalog already contains rows
+        return
+    _apply(stats, rows, +1)
+    _write(stats)
+
+
+def record_removed(rows):
+    stats = _read()
+    if stats is None:
+        rebuild()
+        return
+    _apply(stats, rows, -1)
+    _write(stats)
+
+
+def record_merged(pairs):
+    """Move by_label counts of each src onto its dst; nothing else changes on a merge."""
+    stats = _read()
+    if stats is None:
+        rebuild()
+        return
+    by_label = stats["by_label"]
+    for src, dst in pairs:
+        moved = by_label.pop(str(src), 0)
+        if moved:
+            by_label[str(dst)] = by_label.get(str(dst), 0) + moved
+    _write(stats)
+
+
+def load():
+    """Current stats, served from memory until stats.json changes."""
+    stamp = su.file_stamp(STATS_JSON)
+    if stamp is not None and stamp == _cache["stamp"]:
+        return _cache["stats"]
+    stats = _read()
+    if stats is None:
+        with su.file_lock("samples"):
+            stats = _read() or rebuild()
+        stamp = su.file_stamp(STATS_JSON)
+    with _cache_lock:
+        _cache["stamp"], _cache["stats"] = stamp, stats
+    return stats
@@ -0,0 +1,288 @@
+"""
+Streaming dataset export.
+
+An export is described up front as a list of byte segments (tar headers, file bodies,
+padding, stacked array rows) whose lengths are known before anything is read. That
+gives an exact Content-Length and lets any byte range be served by skipping whole
+segments, so downloads can resume without temp files and memory stays bounded by
+one sample / one read chunk.
+"""
+
+import io
+import os
+import csv
+import bisect
+import hashlib
+import tarfile
+import zipfile
+from typing import Callable, Iterator, List, Optional
+
+import numpy as np
+
+from app.processing import storage_utils as su
+from app.processing import versions
+
+CHUNK_SIZE = 1 << 20
+BLOCK = tarfile.BLOCKSIZE
+INDEX_FIELDS = su.SAMPLE_FIELDS
+
+
+class Segment:
+    def __init__(self, length: int, read: Callable[[int], Iterator[bytes]]):
+        self.length = length
+        self.read = read  # read(offset) yields the segment's bytes starting at offset
+
+
+def _bytes_segment(data: bytes) -> Segment:
+    return Segment(len(data), lambda offset: iter([data[offset:]]))
+
+
+def _file_segment(path: str, size: int) -> Segment:
+    def read(offset):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            remaining = size - offset
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"{path} shrank during export")
+                remaining -= len(chunk)
+                yield chunk
+    return Segment(size, read)
+
+
+class Archive:
+    def __init__(self, segments: List[Segment], etag: str, media_type: str, filename: str, missing=()):
+        self.segments = segments
+        self.missing = list(missing)  # sample_ids selected but found neither locally nor in the blob store
+        self.etag = etag
+        self.media_type = media_type
+        self.filename = filename
+        self.starts = []
+        total = 0
+        for seg in segments:
+            self.starts.append(total)
+            total += seg.length
+        self.size = total
+
+    def iter_bytes(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield bytes [start, end] (inclusive, like HTTP ranges)."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        remaining = end - start + 1
+        i = bisect.bisect_right(self.starts, start) - 1
+        offset = start - self.starts[i] if i >= 0 else 0
+        i = max(i, 0)
+        while remaining > 0 and i < len(self.segments):
+            for chunk in self.segments[i].read(offset):
+                if len(chunk) > remaining:
+                    chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+                if remaining <= 0:
+                    return
+            i += 1
+            offset = 0
+
+
+# ---- Selection ----
+def select_samples(label: str = "", user: str = "", dialect: str = "", date_from: str = "",
+                   date_to: str = "", version: str = "", source: str = ""):
+    """
+    Filter catalog rows. label matches class_idx or label_original; dates compare on created_at prefix.
+    version: the rows of that dataset version (snapshot) instead of the live catalog, each
+    with its frozen "path" (versions.version_rows); KeyError for unknown versions.
+    """
+    source_rows = versions.version_rows(version) if version else su.list_samples()
+    labels = su.load_labels()
+    label_idx = None
+    if label:
+        row = labels.by_idx.get(int(label)) if label.isdigit() else labels.by_name.get(label)
+        row = labels.resolve(int(row["class_idx"])) if row else None
+        if row is None:
+            return []
+        label_idx = row["class_idx"]
+
+    rows = []
+    for r in source_rows:
+        if label_idx is not None and r["class_idx"] != label_idx:
+            continue
+        if user and r.get("user") != user:
+            continue
+        if dialect and r.get("dialect") != dialect:
+            continue
+        if source and r.get("source") != source:
+            continue
+        day = r.get("created_at", "")[:10]
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        rows.append(r)
+    rows.sort(key=lambda r: (r.get("created_at", ""), r["sample_id"]))
+    return rows
+
+
+def _index_csv(rows) -> bytes:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=INDEX_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def _tar_member(name: str, size: int, mtime: float, body: Segment) -> List[Segment]:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    segments = [_bytes_segment(info.tobuf(format=tarfile.GNU_FORMAT)), body]
+    pad = (-size) % BLOCK
+    if pad:
+        segments.append(_bytes_segment(b"\0" * pad))
+    return segments
+
+
+def _etag(kind: str, params: dict, parts) -> str:
+    h = hashlib.sha1(kind.encode())
+    h.update(repr(sorted(params.items())).encode())
+    for p in parts:
+        h.update(repr(p).encode())
+    return f'"{h.hexdigest()}"'
+
+
+# ---- Tar of samples ----
+def _labels_csv(version: str = "") -> bytes:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=su.LABEL_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(versions.version_labels(version) if version else su.list_labels(include_merged=True))
+    return buf.getvalue().encode("utf-8")
+
+
+def _resolve(rows):
+    """
+    ([(row, local npz path)], [missing sample_ids]). Version rows carry their frozen "path";
+    live rows are resolved through the blob store (fetched into the local cache if needed).
+    """
+    found, missing = [], []
+    for r in rows:
+        path = r["path"] if "path" in r else su.local_sample_path(r)
+        if path and os.path.exists(path):
+            found.append((r, path))
+        else:
+            missing.append(r["sample_id"])
+    return found, missing
+
+
+def _meta_path(row, npz_path: str) -> Optional[str]:
+    if "path" in row:
+        return os.path.splitext(npz_path)[0] + ".json"
+    return su.local_sample_path(row, meta=True)
+
+
+def build_tar(rows, params: dict) -> Archive:
+    """
+    Tar with labels.csv and index.csv followed by <folder>/<sample>.npz and .json for every
+    row (the layout bulk_import reads back). With params["version"] labels.csv is the
+    version's label table. Samples whose file cannot be found are left out of the tar and
+    index.csv and listed in Archive.missing.
+    """
+    found, missing = _resolve(rows)
+    labels = _labels_csv(params.get("version", ""))
+    index = _index_csv([r for r, _ in found])
+    segments = _tar_member("labels.csv", len(labels), 0, _bytes_segment(labels))
+    segments += _tar_member("index.csv", len(index), 0, _bytes_segment(index))
+    stamps = []
+    for r, npz_path in found:
+        for path in (npz_path, _meta_path(r, npz_path)):
+            if path is None:  # no sidecar anywhere
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            name = f"{r['folder_name']}/{os.path.basename(path)}"
+            segments += _tar_member(name, st.st_size, st.st_mtime, _file_segment(path, st.st_size))
+            stamps.append((name, st.st_size, st.st_mtime_ns))
+    segments.append(_bytes_segment(b"\0" * (2 * BLOCK)))
+    stamps.append(hashlib.sha1(labels).hexdigest())
+    return Archive(segments, _etag("tar", params, stamps), "application/x-tar", "dataset.tar", missing)
+
+
+# ---- Stacked arrays ----
+def read_sequence_shape(path: str):
+    """Shape of 'sequence' in an npz by decoding only the .npy header, not the array."""
+    with zipfile.ZipFile(path) as zf:
+        with zf.open("sequence.npy") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, _ = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, _ = np.lib.format.read_array_header_2_0(f)
+    return shape
+
+
+def fit_sequence(seq: np.ndarray, frames: int) -> np.ndarray:
+    """Pad with zeros / truncate along time to exactly `frames` rows."""
+    seq = np.asarray(seq, dtype=np.float32)
+    if seq.shape[0] >= frames:
+        return seq[:frames]
+    out = np.zeros((frames, seq.shape[1]), dtype=np.float32)
+    out[: seq.shape[0]] = seq
+    return out
+
+
+def _npy_header(shape, dtype) -> bytes:
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buf, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                               "fortran_order": False, "shape": tuple(shape)})
+    return buf.getvalue()
+
+
+def _row_segment(path: str, frames: int, dim: int) -> Segment:
+    def read(offset):
+        with np.load(path, allow_pickle=False) as data:
+            seq = fit_sequence(data["sequence"], frames)
+        yield seq.tobytes()[offset:]
+    return Segment(frames * dim * 4, read)
+
+
+def build_stacked(rows, params: dict, frames: int = 60, dim: Optional[int] = None) -> Archive:
+    """
+    Tar with X.npy (N, frames, dim) float32, y.npy (N,) int64 class_idx and index.csv.
+    Only samples whose feature dim equals `dim` are included (default: the most common dim);
+    time is padded/truncated to `frames`. Shapes are read from npy headers only.
+    """
+    found, missing = _resolve(rows)
+    shapes = []
+    for r, path in found:
+        try:
+            shapes.append((r, path, read_sequence_shape(path), os.stat(path)))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            continue
+    shapes = [s for s in shapes if len(s[2]) == 2]
+    if dim is None:
+        dims = [s[2][1] for s in shapes]
+        dim = max(set(dims), key=dims.count) if dims else 0
+    kept = [s for s in shapes if s[2][1] == dim]
+
+    y = np.array([int(r["class_idx"]) for r, _, _, _ in kept], dtype=np.int64)
+    y_buf = io.BytesIO()
+    np.save(y_buf, y)
+    y_bytes = y_buf.getvalue()
+    index = _index_csv([r for r, _, _, _ in kept])
+
+    x_header = _npy_header((len(kept), frames, dim), np.float32)
+    x_body = [_bytes_segment(x_header)] + [_row_segment(path, frames, dim) for _, path, _, _ in kept]
+    x_size = sum(seg.length for seg in x_body)
+
+    segments = []
+    segments += _tar_member("index.csv", len(index), 0, _bytes_segment(index))
+    segments += _tar_member("y.npy", len(y_bytes), 0, _bytes_segment(y_bytes))
+    x_member = _tar_member("X.npy", x_size, 0, _bytes_segment(b""))
+    segments += [x_member[0]] + x_body + x_member[2:]
+    segments.append(_bytes_segment(b"\0" * (2 * BLOCK)))
+
+    stamps = [(r["sample_id"], st.st_size, st.st_mtime_ns) for r, _, _, st in kept]
+    params = dict(params, frames=frames, dim=dim)
+    return Archive(segments, _etag("npy", params, stamps), "application/x-tar", "dataset_stacked.tar", missing)
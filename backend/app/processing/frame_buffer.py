@@ -0,0 +1,48 @@
+"""
+Fixed-capacity ring buffer of per-frame landmark vectors for streamed camera captures.
+
+Rows are written into a preallocated float32 array as frames arrive, so finalising a
+capture is one copy instead of parsing the whole recording at the end. When more than
+`capacity` frames arrive the oldest are overwritten (only the last `capacity` are kept).
+"""
+
+import numpy as np
+
+
+class FrameRingBuffer:
+    def __init__(self, capacity: int, width: int = 0):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, width), dtype=np.float32)
+        self.count = 0   # frames ever appended
+        self.width = width
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        """Frames overwritten because the capture outgrew the buffer."""
+        return max(0, self.count - self.capacity)
+
+    def _grow(self, width: int):
+        grown = np.zeros((self.capacity, width), dtype=np.float32)
+        grown[:, : self.width] = self.data
+        self.data = grown
+        self.width = width
+
+    def append(self, vec):
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        if vec.size > self.width:
+            # same rule as /upload/camera: vectors are padded to the widest frame
+            self._grow(vec.size)
+        row = self.data[self.count % self.capacity]
+        row[: vec.size] = vec
+        row[vec.size:] = 0.0
+        self.count += 1
+
+    def to_array(self) -> np.ndarray:
+        """Frames in arrival order, shape (min(count, capacity), width)."""
+        if self.count <= self.capacity:
+            return self.data[: self.count].copy()
+        head = self.count % self.capacity
+        return np.concatenate([self.data[head:], self.data[:head]], axis=0)
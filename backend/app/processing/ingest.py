@@ -1,16 +1,20 @@
 import cv2, os
 from app.processing.utils import ensure_dir
 
-def sample_frames_from_video(video_path: str, target_fps: float = 5.0):
+def sample_frames_from_video(video_path: str, target_fps: float = 5.0, progress=None, max_frames: int = None):
     """
     Decode video and sample frames roughly at target_fps.
-    Returns list of BGR numpy arrays.
+    Returns list of BGR numpy arrays (at most max_frames; decoding stops there).
+    progress(stage, done, total) is called with decoded/total source frames if given.
     """
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise RuntimeError("Cannot open video file")
     video_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0) or None
     sample_rate = max(1, int(video_fps / target_fps))
+    if total and max_frames:
+        total = min(total, max_frames * sample_rate)
     frames = []
     idx = 0
     while True:
@@ -20,5 +24,9 @@ def sample_frames_from_video(video_path: str, target_fps: float = 5.0):
         if idx % sample_rate == 0:
             frames.append(frame)
         idx += 1
+        if progress:
+            progress("decoding", idx, total)
+        if max_frames and len(frames) >= max_frames:
+            break
     cap.release()
     return frames
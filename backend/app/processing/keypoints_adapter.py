@@ -6,18 +6,28 @@ Refactored keypoints extraction from collect_dataset.py
 
 from typing import List
 import numpy as np
-import mediapipe as mp
 
 # constants (giống file collect_dataset.py bạn gửi)
 N_POSE = 25   # upper body
 N_HAND = 21
 N_FACE = 468
 
-def extract_sequence_from_frames(frames: List[np.ndarray], config: dict = None):
+# column ranges of each component in the flattened (T, D) vector, same order as flatten_keypoints
+COMPONENT_SLICES = {}
+_offset = 0
+for _name, _n in (("pose", N_POSE), ("left_hand", N_HAND), ("right_hand", N_HAND), ("face", N_FACE)):
+    COMPONENT_SLICES[_name] = slice(_offset, _offset + _n * 3)
+    _offset += _n * 3
+FEATURE_DIM = _offset
+
+def extract_sequence_from_frames(frames: List[np.ndarray], config: dict = None, progress=None):
     """
     frames: list of BGR images
+    progress: optional callback progress(stage, done, total), called per frame
     return: np.ndarray shape (T, D)
     """
+    import mediapipe as mp  # heavy; only loaded where extraction actually runs
+
     mp_holistic = mp.solutions.holistic
     seq = []
     with mp_holistic.Holistic(
@@ -32,6 +42,8 @@ def extract_sequence_from_frames(frames: List[np.ndarray], config: dict = None):
             kp_dict = extract_keypoints_from_results(results)
             vec = flatten_keypoints(kp_dict)
             seq.append(vec)
+            if progress:
+                progress("extracting", len(seq), len(frames))
     if len(seq) == 0:
         return np.zeros((0, 0), dtype=np.float32)
     return np.stack(seq, axis=0)
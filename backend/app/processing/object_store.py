@@ -0,0 +1,259 @@
+"""
+Blob storage for raw videos and sample files.
+
+Objects are addressed by keys relative to the dataset root ("raw_videos/<name>",
+"features/<folder>/<file>"). Two backends:
+
+- LocalStore: the dataset directory itself (the bind-mount setup); no copies are made.
+- S3Store: any S3-compatible service (MinIO in docker-compose). Uploads use boto3's
+  managed transfer, i.e. parallel multipart above `s3_multipart_threshold`; reads either
+  stream the object body or materialise it in a size-bounded local read-through cache,
+  so a worker on another node downloads a video once and evicts least recently used
+  files when the cache outgrows `storage_cache_bytes`.
+
+Scope: only blobs move. The catalog CSVs (labels.csv, samples.csv), dataset versions and
+the flock locks that serialise catalog writes stay under the dataset root, so all API and
+worker nodes still need the same dataset directory mounted (a shared volume / NFS with
+working flock); the S3 backend takes the bulk data off that mount, not the mount itself.
+"""
+
+import os
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Iterator, Optional
+
+from app.config import settings
+
+CHUNK_SIZE = 1 << 20
+
+
+def key_for(path: str) -> str:
+    """Storage key of a path under the dataset root ('dataset/raw_videos/a.mp4' -> 'raw_videos/a.mp4')."""
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(settings.dataset_root))
+    if rel.startswith(".."):
+        raise ValueError(f"{path} is outside the dataset root")
+    return rel.replace(os.sep, "/")
+
+
+class LocalStore:
+    remote = False
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def put_file(self, local_path: str, key: str):
+        dest = self._path(key)
+        if os.path.abspath(dest) != os.path.abspath(local_path):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(local_path, dest)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def iter_bytes(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open(key) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> str:
+        return self._path(key)
+
+
+class S3Store:
+    remote = True
+
+    def __init__(self, bucket: str, endpoint_url: str = None, access_key: str = None, secret_key: str = None,
+                 cache_dir: str = None, cache_bytes: int = None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url, aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            config=Config(max_pool_connections=max(10, settings.s3_max_concurrency * 2),
+                          retries={"max_attempts": 5, "mode": "standard"}),
+        )
+        self.transfer = TransferConfig(
+            multipart_threshold=settings.s3_multipart_threshold,
+            multipart_chunksize=settings.s3_multipart_chunksize,
+            max_concurrency=settings.s3_max_concurrency,
+            use_threads=True,
+        )
+        self.cache_dir = cache_dir or settings.storage_cache_dir
+        self.cache_bytes = settings.storage_cache_bytes if cache_bytes is None else cache_bytes
+        # LRU index of the cache (path -> size, oldest first), built by one walk on first use
+        self._lru: "OrderedDict[str, int]" = None
+        self._lru_bytes = 0
+        self._lru_lock = threading.Lock()
+
+    def ensure_bucket(self):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except ClientError:
+            self.client.create_bucket(Bucket=self.bucket)
+
+    def put_file(self, local_path: str, key: str):
+        self.client.upload_file(local_path, self.bucket, key, Config=self.transfer)
+
+    def open(self, key: str) -> BinaryIO:
+        """Streaming body; read() pulls from the socket, nothing is buffered up front."""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def iter_bytes(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        body = self.open(key)
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    # ---- read-through cache ----
+    def local_path(self, key: str) -> str:
+        """
+        Local copy of the object, downloaded (ranged parts in parallel) on first use.
+        Concurrent fetches of the same key race harmlessly: each writes a temp file and
+        the last os.replace wins with identical content.
+        """
+        path = os.path.join(self.cache_dir, *key.split("/"))
+        if os.path.exists(path):
+            os.utime(path)  # mtime = last use, so the index rebuilt after a restart keeps the order
+            self._touch(path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            self.client.download_file(self.bucket, key, tmp_path, Config=self.transfer)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._evict(keep=path)
+        return path
+
+    def _load_lru(self):
+        """One walk of cache_dir (caller holds _lru_lock); afterwards the index is kept in memory."""
+        files = []
+        for dirpath, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, p, st.st_size))
+        self._lru = OrderedDict((p, size) for _, p, size in sorted(files))
+        self._lru_bytes = sum(self._lru.values())
+
+    def _touch(self, path: str):
+        with self._lru_lock:
+            if self._lru is None:
+                self._load_lru()
+            elif path in self._lru:
+                self._lru.move_to_end(path)
+            else:  # fetched by another process on this node
+                try:
+                    self._lru[path] = os.path.getsize(path)
+                    self._lru_bytes += self._lru[path]
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self, keep: str):
+        """Record the new file and drop least recently used ones until the cache fits cache_bytes."""
+        with self._lru_lock:
+            if self._lru is None:
+                self._load_lru()
+            try:
+                size = os.path.getsize(keep)
+            except FileNotFoundError:
+                size = None
+            if size is not None:
+                self._lru_bytes += size - self._lru.pop(keep, 0)
+                self._lru[keep] = size
+            if self.cache_bytes <= 0:
+                return
+            while self._lru_bytes > self.cache_bytes and len(self._lru) > 1:
+                p, old = next(iter(self._lru.items()))
+                if p == keep:
+                    self._lru.move_to_end(p)
+                    continue
+                del self._lru[p]
+                self._lru_bytes -= old
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide store selected by settings.storage_backend ('local' or 's3')."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if settings.storage_backend == "s3":
+                store = S3Store(settings.minio_bucket, settings.minio_endpoint,
+                                settings.minio_access_key, settings.minio_secret_key)
+                store.ensure_bucket()
+                _store = store
+            elif settings.storage_backend == "local":
+                _store = LocalStore(settings.dataset_root)
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND '{settings.storage_backend}'")
+        return _store
+
+
+def local_path(path_or_key: str) -> str:
+    """
+    Local file for a job's video_path / a sample path. Existing local files are used as is
+    (also rows written before the store existed); otherwise the key is fetched from the store.
+    """
+    if os.path.exists(path_or_key):
+        return path_or_key
+    in_dataset = os.path.isabs(path_or_key) or path_or_key.startswith(settings.dataset_root.rstrip("/") + "/")
+    return get_store().local_path(key_for(path_or_key) if in_dataset else path_or_key)
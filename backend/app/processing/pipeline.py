@@ -2,41 +2,77 @@ from app.processing.ingest import sample_frames_from_video
 from app.processing.keypoints_adapter import extract_sequence_from_frames
 from app.processing.augmenter import generate_augmented_sequences
 from app.processing import storage_utils as su
+from app.core import tracing
+from contextlib import contextmanager
 import numpy as np
+import time
 import os
 
-def process_video_job(video_path: str, user: str, label: str, session_id: str, dialect: str = ""):
+@contextmanager
+def _timed(timings: dict, stage: str):
+    start = time.perf_counter()
+    try:
+        with tracing.span(f"pipeline.{stage}"):
+            yield
+    finally:
+        timings[stage] = round(time.perf_counter() - start, 4)
+
+def _noop_progress(stage, done=None, total=None, **extra):
+    pass
+
+def process_video_job(video_path: str, user: str, label: str, session_id: str, dialect: str = "",
+                      timings: dict = None, progress=None):
     """
     Synchronous function to process video without Celery decorator.
     This is called by the Celery task in tasks.py
+    Per-stage wall times (seconds) are written into `timings` when given, also on failure.
+    progress(stage, done, total) receives decoding / extracting / augmenting / saving updates.
     """
+    timings = {} if timings is None else timings
+    progress = progress or _noop_progress
+    target_fps, target_T = 6.0, 60
     try:
-        frames = sample_frames_from_video(video_path, target_fps=6.0)
+        # only the first target_T sampled frames are kept, so decoding stops there; tracking
+        # only looks back, so the kept rows are the same as when extracting the whole video
+        with _timed(timings, "decode"):
+            frames = sample_frames_from_video(video_path, target_fps=target_fps, progress=progress,
+                                              max_frames=target_T)
         if not frames:
             raise RuntimeError("No frames extracted")
 
-        seq = extract_sequence_from_frames(frames)
+        with _timed(timings, "extract"):
+            seq = extract_sequence_from_frames(frames, progress=progress)
         if seq.size == 0:
             raise RuntimeError("No keypoints extracted")
 
-        T, D = seq.shape
-        target_T = 60
-        if T < target_T:
-            pad = np.zeros((target_T - T, D))
-            seq_padded = np.vstack([seq, pad])
-        else:
-            seq_padded = seq[:target_T]
+        progress("augmenting")
+        with _timed(timings, "augment"):
+            T, D = seq.shape
+            if T < target_T:
+                pad = np.zeros((target_T - T, D))
+                seq_padded = np.vstack([seq, pad])
+            else:
+                seq_padded = seq[:target_T]
 
-        augmented_seq_list = generate_augmented_sequences(seq_padded)
+            augmented_seq_list = generate_augmented_sequences(seq_padded)
 
-        class_idx, folder = su.register_label(label)
-        saved_paths = []
-        for aseq in augmented_seq_list:
-            meta = {"user": user, "session_id": session_id, "frames": target_T, "source": "video", "dialect": dialect}
-            path = su.save_sample(aseq, class_idx, folder, metadata=meta)
-            saved_paths.append(path)
+        with _timed(timings, "save"):
+            class_idx, folder = su.register_label(label)
+            saved_paths = []
+            sample_ids = []
+            bytes_written = 0
+            for i, aseq in enumerate(augmented_seq_list):
+                progress("saving", i, len(augmented_seq_list))
+                meta = {"user": user, "session_id": session_id, "frames": target_T, "source": "video", "dialect": dialect}
+                if sample_ids:
+                    meta["augmented_from"] = sample_ids[0]  # variants of the original are not near-duplicates
+                path = su.save_sample(aseq, class_idx, folder, metadata=meta)
+                saved_paths.append(path)
+                bytes_written += os.path.getsize(path) + os.path.getsize(os.path.splitext(path)[0] + ".json")
+                sample_ids.append(meta["sample_id"])
 
-        return {"status": "success", "saved": saved_paths}
+        return {"status": "success", "saved": saved_paths, "sample_ids": sample_ids,
+                "frames": len(frames), "bytes_written": bytes_written, "timings": timings}
 
     except Exception as e:
         raise Exception(f"Pipeline processing failed: {str(e)}")
@@ -0,0 +1,101 @@
+"""
+Compact keypoint previews for the frontend player.
+
+A preview is the stored (T, D) sequence, optionally downsampled in time and reduced to
+some components (pose / hands / face), cast to float16. Results are memoised per
+(file stamp, params) so hot samples are decompressed once per process, and the
+strong ETag lets clients revalidate with a 304 without touching the npz at all.
+"""
+
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.processing.keypoints_adapter import COMPONENT_SLICES, FEATURE_DIM
+
+CACHE_SIZE = 256
+
+_cache: "OrderedDict[tuple, Tuple[np.ndarray, dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def parse_parts(parts: str) -> Optional[Tuple[str, ...]]:
+    """'hands,pose' -> ('pose', 'left_hand', 'right_hand'); '' -> None (all columns)."""
+    if not parts:
+        return None
+    wanted = set()
+    for p in parts.split(","):
+        p = p.strip()
+        if p == "hands":
+            wanted.update(("left_hand", "right_hand"))
+        elif p in COMPONENT_SLICES:
+            wanted.add(p)
+        elif p:
+            raise ValueError(f"Unknown component '{p}'")
+    return tuple(name for name in COMPONENT_SLICES if name in wanted)
+
+
+def preview_etag(identity: str, stamp, step: int, parts: Optional[Sequence[str]], fmt: str) -> str:
+    """
+    identity: catalog metadata of the sample (id, blob key, created_at); stamp: file_stamp of
+    the local copy, or None when this node has none. Neither reads the sample itself.
+    """
+    key = f"{identity}|{stamp}|{step}|{','.join(parts or ())}|{fmt}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def build_preview(path: str, step: int = 1, parts: Optional[Sequence[str]] = None):
+    """Return (float16 array (T', D'), layout) where layout maps component -> [start, end) in D'."""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size, step, tuple(parts or ()))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit
+
+    with np.load(path, allow_pickle=False) as data:
+        seq = data["sequence"]
+    seq = seq[:: max(1, step)]
+
+    if parts:
+        if seq.shape[1] != FEATURE_DIM:
+            raise ValueError(f"Component filter needs D={FEATURE_DIM}, sample has D={seq.shape[1]}")
+        cols, layout, offset = [], {}, 0
+        for name in parts:
+            sl = COMPONENT_SLICES[name]
+            cols.append(seq[:, sl])
+            layout[name] = [offset, offset + sl.stop - sl.start]
+            offset += sl.stop - sl.start
+        seq = np.concatenate(cols, axis=1)
+    elif seq.shape[1] == FEATURE_DIM:
+        layout = {name: [sl.start, sl.stop] for name, sl in COMPONENT_SLICES.items()}
+    else:
+        layout = {}
+
+    result = (np.ascontiguousarray(seq, dtype=np.float16), layout)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def to_npy_bytes(arr: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, arr)
+    return buf.getvalue()
+
+
+def to_compact_json(arr: np.ndarray, layout: dict, decimals: int = 4) -> dict:
+    """Flat row-major values rounded to `decimals`; the client reshapes with `shape`."""
+    return {
+        "shape": list(arr.shape),
+        "layout": layout,
+        "data": np.round(arr.astype(np.float32), decimals).ravel().tolist(),
+    }
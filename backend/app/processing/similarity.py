@@ -0,0 +1,433 @@
+"""
+Similarity index over samples: near-duplicate flagging at ingest and "similar samples" lookup.
+
+Embedding: the signing part of the skeleton (shoulders/elbows/wrists of the pose and both
+hands, x/y only), centred on the shoulder midpoint and scaled by shoulder width per frame,
+resampled to EMBED_FRAMES frames, then projected with a fixed Gaussian matrix to
+EMBED_DIM values and L2-normalised. Cosine similarity of two embeddings is therefore
+invariant to where the signer stands, how far from the camera, and small speed changes.
+
+Index: random-hyperplane LSH (NUM_TABLES tables of NUM_BITS bits) queried with one-bit
+multi-probe, candidates re-ranked by exact cosine. Embeddings are appended as fixed-size
+records to dataset/similarity/embeddings.bin under a file lock; every process keeps an
+in-memory copy refreshed from the last consumed offset, like the samples.csv index.
+Flagged pairs are appended to dataset/similarity/duplicates.csv.
+
+Augmented variants (metadata "augmented_from") are neither flagged nor indexed: they are
+expected copies of their origin sample and would only clutter lookups.
+
+CLI:  python -m app.processing.similarity rebuild
+      python -m app.processing.similarity similar <sample_id> [-k 10]
+"""
+
+import os
+import io
+import csv
+import json
+import logging
+import argparse
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.core import tracing
+from app.processing import storage_utils as su
+from app.processing.keypoints_adapter import COMPONENT_SLICES, FEATURE_DIM, N_HAND
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_ROOT = os.path.join(su.DATASET_ROOT, "similarity")
+EMBEDDINGS_BIN = os.path.join(SIMILARITY_ROOT, "embeddings.bin")
+DUPLICATES_CSV = os.path.join(SIMILARITY_ROOT, "duplicates.csv")
+DUPLICATE_FIELDS = ["sample_id", "duplicate_of", "score", "user", "created_at"]
+
+POSE_POINTS = (11, 12, 13, 14, 15, 16)  # shoulders, elbows, wrists
+EMBED_FRAMES = 16
+EMBED_DIM = 128
+NUM_TABLES = 16
+NUM_BITS = 14
+SEED = 20240601
+BRUTE_FORCE_MAX = 2000  # below this many entries an exact scan is cheaper than probing
+ID_BYTES = 16
+
+RECORD = np.dtype([("id", f"S{ID_BYTES}"), ("vec", "<f4", (EMBED_DIM,))])
+
+
+def _random_matrices():
+    rng = np.random.default_rng(SEED)
+    n_in = EMBED_FRAMES * (len(POSE_POINTS) + 2 * N_HAND) * 2
+    projection = (rng.standard_normal((n_in, EMBED_DIM)) / np.sqrt(EMBED_DIM)).astype(np.float32)
+    planes = rng.standard_normal((EMBED_DIM, NUM_TABLES * NUM_BITS)).astype(np.float32)
+    return projection, planes
+
+_PROJECTION, _PLANES = _random_matrices()
+_BIT_WEIGHTS = (1 << np.arange(NUM_BITS)).astype(np.int64)
+
+
+# ---- embedding ----
+def embed(sequence: np.ndarray) -> Optional[np.ndarray]:
+    """(T, FEATURE_DIM) keypoint sequence -> unit (EMBED_DIM,) float32, or None if unusable."""
+    seq = np.asarray(sequence, dtype=np.float32)
+    if seq.ndim != 2 or seq.shape[1] != FEATURE_DIM or seq.shape[0] == 0:
+        return None
+    T = seq.shape[0]
+    pose = seq[:, COMPONENT_SLICES["pose"]].reshape(T, -1, 3)[:, :, :2]
+    left = seq[:, COMPONENT_SLICES["left_hand"]].reshape(T, -1, 3)[:, :, :2]
+    right = seq[:, COMPONENT_SLICES["right_hand"]].reshape(T, -1, 3)[:, :, :2]
+    points = np.concatenate([pose[:, POSE_POINTS], left, right], axis=1)  # (T, P, 2)
+
+    # padded / undetected frames carry no pose; drop them before resampling
+    shoulders = pose[:, [11, 12]]
+    valid = np.abs(shoulders).sum(axis=(1, 2)) > 0
+    if not valid.any():
+        return None
+    points, shoulders = points[valid], shoulders[valid]
+
+    centre = shoulders.mean(axis=1, keepdims=True)
+    width = np.linalg.norm(shoulders[:, 0] - shoulders[:, 1], axis=-1)[:, None, None]
+    missing = np.abs(points).sum(axis=-1, keepdims=True) == 0  # hand not detected
+    points = np.where(missing, 0.0, (points - centre) / np.maximum(width, 1e-3))
+
+    # linear resampling in time to EMBED_FRAMES frames
+    flat = points.reshape(points.shape[0], -1)
+    pos = np.linspace(0.0, flat.shape[0] - 1, EMBED_FRAMES)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, flat.shape[0] - 1)
+    w = (pos - lo)[:, None]
+    resampled = flat[lo] * (1 - w) + flat[hi] * w
+
+    vec = resampled.reshape(-1).astype(np.float32) @ _PROJECTION
+    norm = np.linalg.norm(vec)
+    if not np.isfinite(norm) or norm == 0:
+        return None
+    return vec / norm
+
+
+def _bucket_keys(vectors: np.ndarray) -> np.ndarray:
+    """(N, EMBED_DIM) -> (N, NUM_TABLES) integer bucket keys."""
+    bits = (vectors @ _PLANES > 0).reshape(len(vectors), NUM_TABLES, NUM_BITS)
+    return bits.astype(np.int64) @ _BIT_WEIGHTS
+
+
+# ---- index ----
+class _SimilarityIndex:
+    """
+    In-memory copy of embeddings.bin; appended records are read from the last offset and a
+    rewrite (compact / rebuild, detected by su.continues) triggers a full reload into a new
+    instance, so a query still holding the old one never sees it emptied under its feet.
+    """
+
+    def __init__(self):
+        self.stamp = None
+        self.inode = None
+        self.offset = 0
+        self.tail = b""
+        self.ids: List[str] = []
+        self.position = {}
+        self.vectors = np.zeros((0, EMBED_DIM), dtype=np.float32)
+        self.count = 0
+        self.tables = [dict() for _ in range(NUM_TABLES)]
+
+    def refresh(self, path) -> "_SimilarityIndex":
+        """This index with newly appended records added, or a fresh one if the file was rewritten or removed."""
+        stamp = su.file_stamp(path)
+        if stamp is None:
+            return self if self.stamp is None else _SimilarityIndex()
+        if stamp == self.stamp:
+            return self
+        index = self
+        with open(path, "rb") as f:
+            if not su.continues(f, self.inode, self.offset, self.tail):
+                index = _SimilarityIndex()
+                index.inode = os.fstat(f.fileno()).st_ino
+            f.seek(index.offset)
+            chunk = f.read()
+        index.stamp = stamp
+        chunk = chunk[:len(chunk) // RECORD.itemsize * RECORD.itemsize]  # ignore a record still being written
+        if not chunk:
+            return index
+        index.offset += len(chunk)
+        index.tail = chunk[-RECORD.itemsize:]
+        records = np.frombuffer(chunk, dtype=RECORD)
+        index._add(records["id"], records["vec"])
+        return index
+
+    def _add(self, raw_ids, vectors):
+        n = len(vectors)
+        if self.count + n > len(self.vectors):
+            grown = np.zeros((max(2 * len(self.vectors), self.count + n, 1024), EMBED_DIM), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+        self.vectors[self.count:self.count + n] = vectors
+        for offset, (raw_id, keys) in enumerate(zip(raw_ids, _bucket_keys(vectors))):
+            pos = self.count + offset
+            sample_id = raw_id.decode("ascii")
+            self.ids.append(sample_id)
+            self.position[sample_id] = pos  # a re-indexed id points at its latest record
+            for table, key in zip(self.tables, keys):
+                table.setdefault(int(key), []).append(pos)
+        self.count += n
+
+    def vector(self, sample_id) -> Optional[np.ndarray]:
+        pos = self.position.get(sample_id)
+        return None if pos is None else self.vectors[pos]
+
+    def candidates(self, vector) -> np.ndarray:
+        if self.count <= BRUTE_FORCE_MAX:
+            return np.arange(self.count)
+        keys = _bucket_keys(vector[None, :])[0]
+        found = set()
+        for table, key in zip(self.tables, keys):
+            key = int(key)
+            found.update(table.get(key, ()))
+            for bit in range(NUM_BITS):  # multi-probe: neighbouring buckets one bit away
+                found.update(table.get(key ^ (1 << bit), ()))
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+_index = _SimilarityIndex()
+_index_lock = threading.Lock()
+
+def load_index():
+    """Current index; after a rewrite the module reference is swapped to the reloaded copy."""
+    global _index
+    with _index_lock:
+        _index = _index.refresh(EMBEDDINGS_BIN)
+        return _index
+
+
+def query(vector: np.ndarray, k: int = 10, exclude: str = None, min_score: float = None) -> List[Tuple[str, float]]:
+    """Top-k (sample_id, cosine) for an embedding, restricted to samples still in the catalog."""
+    index = load_index()
+    candidates = index.candidates(vector)
+    if len(candidates) == 0:
+        return []
+    scores = index.vectors[candidates] @ vector
+    live = su.load_samples().by_id
+    out, seen = [], set()
+    for i in np.argsort(-scores):
+        if min_score is not None and scores[i] < min_score:
+            break
+        pos = int(candidates[i])
+        sample_id = index.ids[pos]
+        if sample_id == exclude or sample_id in seen or index.position[sample_id] != pos or sample_id not in live:
+            continue
+        seen.add(sample_id)
+        out.append((sample_id, round(float(scores[i]), 4)))
+        if len(out) >= k:
+            break
+    return out
+
+
+def append_embeddings(items):
+    """Append (sample_id, embedding) pairs to embeddings.bin in one write."""
+    items = [(sid, vec) for sid, vec in items if vec is not None]
+    if not items:
+        return
+    records = _records(items)
+    with su.file_lock("similarity"):
+        os.makedirs(SIMILARITY_ROOT, exist_ok=True)
+        with open(EMBEDDINGS_BIN, "ab") as f:
+            f.write(records.tobytes())
+
+
+# ---- hooks called by storage_utils ----
+def flag_duplicate(sequence, metadata, pending=None) -> Optional[np.ndarray]:
+    """
+    Embed a sample about to be written and, if an indexed sample is at least
+    settings.duplicate_threshold similar, record it in metadata as near_duplicate_of /
+    duplicate_score. pending: (sample_id, embedding) of samples written earlier in the
+    same batch, not indexed yet; they are candidates too. Returns the embedding to index
+    (None: do not index). Never raises.
+    """
+    if not settings.similarity_enabled or metadata.get("augmented_from"):
+        return None
+    try:
+        with tracing.span("similarity.check") as check_span:
+            vector = embed(sequence)
+            if vector is None:
+                return None
+            best = query(vector, k=1, min_score=settings.duplicate_threshold)
+            if pending:
+                scores = np.stack([vec for _, vec in pending]) @ vector
+                i = int(np.argmax(scores))
+                if scores[i] >= settings.duplicate_threshold and (not best or scores[i] > best[0][1]):
+                    best = [(pending[i][0], round(float(scores[i]), 4))]
+            if best:
+                metadata["near_duplicate_of"], metadata["duplicate_score"] = best[0]
+                check_span.tag(duplicate_of=best[0][0], score=best[0][1])
+            return vector
+    except Exception:
+        logger.exception("Similarity check failed")
+        return None
+
+
+def record_saved(rows, vectors, metadatas):
+    """Index saved samples and log the flagged ones. Never raises."""
+    try:
+        append_embeddings([(row["sample_id"], vec) for row, vec in zip(rows, vectors)])
+        flagged = [{"sample_id": row["sample_id"], "duplicate_of": meta["near_duplicate_of"],
+                    "score": meta["duplicate_score"], "user": row.get("user", ""), "created_at": row["created_at"]}
+                   for row, meta in zip(rows, metadatas) if meta.get("near_duplicate_of")]
+        if flagged:
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=DUPLICATE_FIELDS)
+            with su.file_lock("similarity"):
+                if not os.path.exists(DUPLICATES_CSV) or os.path.getsize(DUPLICATES_CSV) == 0:
+                    writer.writeheader()
+                writer.writerows(flagged)
+                with open(DUPLICATES_CSV, "a", newline="", encoding="utf-8") as f:
+                    f.write(buf.getvalue())
+    except Exception:
+        logger.exception("Failed to index samples %s", [row["sample_id"] for row in rows])
+
+
+# ---- lookups ----
+def _sample_vector(sample) -> Optional[np.ndarray]:
+    vector = load_index().vector(sample["sample_id"])
+    if vector is not None:
+        return vector
+    path = su.local_sample_path(sample)  # not indexed (augmented variant / before the index existed)
+    if path is None:
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return embed(data["sequence"])
+
+
+def similar_samples(sample_id: str, k: int = 10, min_score: float = None):
+    """Catalog rows of the k samples most similar to sample_id, each with a "score". KeyError if unknown."""
+    sample = su.get_sample(sample_id)
+    if sample is None:
+        raise KeyError(sample_id)
+    vector = _sample_vector(sample)
+    if vector is None:
+        return []
+    out = []
+    for other_id, score in query(vector, k=k, exclude=sample_id, min_score=min_score):
+        row = su.get_sample(other_id)
+        if row:
+            out.append({**row, "score": score})
+    return out
+
+
+def list_duplicates():
+    """Flagged pairs whose samples are both still in the catalog."""
+    live = su.load_samples().by_id
+    return [r for r in su.read_csv(DUPLICATES_CSV) if r["sample_id"] in live and r["duplicate_of"] in live]
+
+
+def rebuild(batch_size: int = 512):
+    """
+    Re-embed every catalog sample into a fresh embeddings.bin (atomic swap). Returns the count.
+    The scan runs without the lock; records appended meanwhile by record_saved (samples not
+    in the catalog when the scan started) are carried over into the new file at the swap.
+    """
+    os.makedirs(SIMILARITY_ROOT, exist_ok=True)
+    tmp_path = f"{EMBEDDINGS_BIN}.{os.getpid()}.tmp"
+    rows = su.list_samples()
+    scanned = {row["sample_id"].encode("ascii")[:ID_BYTES] for row in rows}
+    try:
+        with open(tmp_path, "wb") as out:
+            indexed = _embed_rows(rows, out, batch_size)
+        with su.file_lock("similarity"):
+            try:
+                with open(EMBEDDINGS_BIN, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b""
+            records = np.frombuffer(data[:len(data) // RECORD.itemsize * RECORD.itemsize], dtype=RECORD)
+            added = records[~np.isin(records["id"], np.array(sorted(scanned), dtype=RECORD["id"]))]
+            if len(added):
+                with open(tmp_path, "ab") as out:
+                    out.write(added.tobytes())
+            os.replace(tmp_path, EMBEDDINGS_BIN)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return indexed
+
+
+def _embed_rows(rows, out, batch_size):
+    """Write embedding records of rows to out in batches. Returns the number written."""
+    indexed, pending = 0, []
+    for row in rows:
+        path = su.local_sample_path(row)
+        if path is None or _is_augmented(path):
+            continue
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                vector = embed(data["sequence"])
+        except Exception:
+            logger.warning("Skipping unreadable sample %s", path)
+            continue
+        if vector is not None:
+            pending.append((row["sample_id"], vector))
+        if len(pending) >= batch_size:
+            out.write(_records(pending).tobytes())
+            indexed += len(pending)
+            pending = []
+    if pending:
+        out.write(_records(pending).tobytes())
+        indexed += len(pending)
+    return indexed
+
+
+def compact(live_ids=None):
+    """
+    Rewrite embeddings.bin keeping the latest record of each sample still in the catalog
+    (or in live_ids). Returns the number of records dropped.
+    """
+    live = set(su.load_samples().by_id if live_ids is None else live_ids)
+    with su.file_lock("similarity"):
+        try:
+            with open(EMBEDDINGS_BIN, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        records = np.frombuffer(data[:len(data) // RECORD.itemsize * RECORD.itemsize], dtype=RECORD)
+        latest = {}
+        for pos, raw_id in enumerate(records["id"]):
+            latest[raw_id.decode("ascii")] = pos
+        keep = sorted(pos for sample_id, pos in latest.items() if sample_id in live)
+        if len(keep) == len(records):
+            return 0
+        tmp_path = f"{EMBEDDINGS_BIN}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(records[keep].tobytes())
+        os.replace(tmp_path, EMBEDDINGS_BIN)
+    return len(records) - len(keep)
+
+
+def _is_augmented(npz_path):
+    try:
+        with open(os.path.splitext(npz_path)[0] + ".json", encoding="utf-8") as f:
+            return bool(json.load(f).get("augmented_from"))
+    except (OSError, ValueError):
+        return False
+
+
+def _records(items):
+    records = np.zeros(len(items), dtype=RECORD)
+    records["id"] = [sid.encode("ascii")[:ID_BYTES] for sid, _ in items]
+    records["vec"] = np.stack([vec for _, vec in items])
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample similarity index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="re-embed the whole catalog")
+    similar = sub.add_parser("similar", help="print the samples most similar to one sample")
+    similar.add_argument("sample_id")
+    similar.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        print(f"indexed {rebuild()} samples")
+    else:
+        for row in similar_samples(args.sample_id, k=args.k):
+            print(f"{row['score']:.4f}  {row['sample_id']}  class={row['class_idx']}  user={row['user']}  {row['file']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,30 @@ Designed to be production-ready with CSV as source of truth (DB-ready in future)
 """
 
 import os
+import io
 import csv
 import uuid
 import unicodedata
 import re
 import json
 import shutil
+import fcntl
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from app.config import settings
+from app.core import tracing
 
 # ---- Config paths ----
-DATASET_ROOT = "dataset"
+DATASET_ROOT = settings.dataset_root
 FEATURE_ROOT = os.path.join(DATASET_ROOT, "features")
 LABELS_CSV = os.path.join(DATASET_ROOT, "labels.csv")
 SAMPLES_CSV = os.path.join(DATASET_ROOT, "samples.csv")
+LOCK_DIR = os.path.join(DATASET_ROOT, ".locks")
+
+LABEL_FIELDS = ["class_idx","label_original","slug","folder_name","created_at","dataset_version","notes","merged_into"]
+SAMPLE_FIELDS = ["sample_id","class_idx","folder_name","file","user","session_id","frames","duration","source","dialect","created_at"]
 
 # ---- Utils ----
 def slugify(text: str, maxlen: int = 20) -> str:
@@ -42,76 +53,462 @@ def read_csv(csv_path):
         return list(csv.DictReader(f))
 
 def write_csv(csv_path, rows, fieldnames):
+    """Rewrite csv_path atomically (temp file + rename) so readers never see a partial file."""
     os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-    with open(csv_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
         writer.writeheader()
         writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
+
+@contextmanager
+def atomic_open(path, mode="wb", **kwargs):
+    """
+    Write through a temp file renamed over path on success. The old inode is never
+    modified, so hard-linked copies (dataset versions) and concurrent readers keep
+    seeing the previous content.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def file_stamp(path):
+    """(mtime_ns, size, inode) of path, or None if missing. Changes whenever the file is rewritten."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+@contextmanager
+def file_lock(name):
+    """
+    Exclusive lock shared by every process using the same dataset root (API + Celery workers).
+    flock is bound to the open file description, so threads of one process exclude each other too.
+    """
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LOCK_DIR, f"{name}.lock"), "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
 # ---- Label management ----
+class _LabelIndex:
+    """In-memory view of labels.csv, rebuilt only when the file stamp changes."""
+
+    def __init__(self, rows, stamp):
+        self.stamp = stamp
+        self.rows = rows
+        self.by_idx = {int(r["class_idx"]): r for r in rows}
+        self.by_name = {r["label_original"]: self.resolve(int(r["class_idx"])) for r in rows}
+        self.next_idx = max(self.by_idx, default=0) + 1
+
+    def resolve(self, class_idx):
+        """Follow merged_into aliases to the label that currently owns class_idx."""
+        row = self.by_idx.get(class_idx)
+        seen = set()
+        while row and row.get("merged_into") and class_idx not in seen:
+            seen.add(class_idx)
+            class_idx = int(row["merged_into"])
+            row = self.by_idx.get(class_idx)
+        return row
+
+    def resolve_folder(self, class_idx, folder_name):
+        """
+        Path (relative to FEATURE_ROOT) of a folder after merges. Merging moves the
+        whole src folder inside the dst folder, so each hop prefixes the dst folder.
+        """
+        row = self.by_idx.get(class_idx)
+        seen = set()
+        while row and row.get("merged_into") and class_idx not in seen:
+            seen.add(class_idx)
+            class_idx = int(row["merged_into"])
+            row = self.by_idx.get(class_idx)
+            if row:
+                folder_name = f"{row['folder_name']}/{folder_name}"
+        return folder_name
+
+_label_index = _LabelIndex([], None)
+_label_index_lock = threading.Lock()
+
+def load_labels():
+    """Return the cached label index, re-reading labels.csv only if it changed on disk."""
+    global _label_index
+    stamp = file_stamp(LABELS_CSV)
+    index = _label_index
+    if stamp is not None and stamp == index.stamp:
+        return index
+    with _label_index_lock:
+        if _label_index.stamp != stamp or stamp is None:
+            _label_index = _LabelIndex(read_csv(LABELS_CSV), stamp)
+        return _label_index
+
+def list_labels(include_merged=False):
+    rows = load_labels().rows
+    return [dict(r) for r in rows if include_merged or not r.get("merged_into")]
+
+def get_label(class_idx, resolve=True):
+    index = load_labels()
+    row = index.resolve(int(class_idx)) if resolve else index.by_idx.get(int(class_idx))
+    return dict(row) if row else None
+
 def register_label(label_original, notes="", dataset_version="v1"):
-    """Register new label or return existing one. Returns (class_idx, folder_name)."""
-    rows = read_csv(LABELS_CSV)
-    for r in rows:
-        if r["label_original"] == label_original:
-            return int(r["class_idx"]), r["folder_name"]
-
-    next_idx = max([int(r["class_idx"]) for r in rows], default=0) + 1
-    slug = slugify(label_original, maxlen=20)
-    folder_name = f"class_{next_idx:04d}_{slug}"
-    created_at = now_str()
-
-    new_row = {
-        "class_idx": str(next_idx),
-        "label_original": label_original,
-        "slug": slug,
-        "folder_name": folder_name,
-        "created_at": created_at,
-        "dataset_version": dataset_version,
-        "notes": notes,
-    }
-    rows.append(new_row)
-    fieldnames = ["class_idx","label_original","slug","folder_name","created_at","dataset_version","notes"]
-    write_csv(LABELS_CSV, rows, fieldnames)
+    """
+    Register new label or return existing one. Returns (class_idx, folder_name).
+    Lookups are served from the in-memory index; allocation runs under the labels
+    file lock so concurrent API/worker processes never hand out the same class_idx.
+    A label that was merged away resolves to the label it was merged into.
+    """
+    row = load_labels().by_name.get(label_original)
+    if row:
+        return int(row["class_idx"]), row["folder_name"]
+
+    with file_lock("labels"):
+        index = load_labels()
+        row = index.by_name.get(label_original)
+        if row:
+            return int(row["class_idx"]), row["folder_name"]
+
+        next_idx = index.next_idx
+        slug = slugify(label_original, maxlen=20)
+        folder_name = f"class_{next_idx:04d}_{slug}"
+        new_row = {
+            "class_idx": str(next_idx),
+            "label_original": label_original,
+            "slug": slug,
+            "folder_name": folder_name,
+            "created_at": now_str(),
+            "dataset_version": dataset_version,
+            "notes": notes,
+            "merged_into": "",
+        }
+        os.makedirs(os.path.join(FEATURE_ROOT, folder_name), exist_ok=True)
+        write_csv(LABELS_CSV, index.rows + [new_row], LABEL_FIELDS)
 
-    os.makedirs(os.path.join(FEATURE_ROOT, folder_name), exist_ok=True)
     return next_idx, folder_name
 
+def rename_label(class_idx, label_original=None, notes=None):
+    """
+    Update label_original/slug/notes of one label. folder_name and class_idx never change,
+    so no sample row or file is touched. Raises KeyError / ValueError.
+    """
+    with file_lock("labels"):
+        index = load_labels()
+        row = index.by_idx.get(int(class_idx))
+        if row is None or row.get("merged_into"):
+            raise KeyError(class_idx)
+        rows = [dict(r) for r in index.rows]
+        target = next(r for r in rows if int(r["class_idx"]) == int(class_idx))
+        if label_original is not None and label_original != target["label_original"]:
+            if label_original in index.by_name:
+                raise ValueError(f"Label '{label_original}' already exists")
+            target["label_original"] = label_original
+            target["slug"] = slugify(label_original, maxlen=20)
+        if notes is not None:
+            target["notes"] = notes
+        write_csv(LABELS_CSV, rows, LABEL_FIELDS)
+    return target
+
+def delete_label(class_idx):
+    """
+    Delete a label that owns no samples (including samples merged into it).
+    Aliases pointing at it are dropped too. Raises KeyError / ValueError.
+    """
+    from app.processing import dataset_stats
+
+    with file_lock("labels"):
+        index = load_labels()
+        row = index.by_idx.get(int(class_idx))
+        if row is None or row.get("merged_into"):
+            raise KeyError(class_idx)
+        in_use = dataset_stats.load()["by_label"].get(str(class_idx), 0)
+        if in_use:
+            raise ValueError(f"Cannot delete label. {in_use} samples are using this label")
+        dropped = {int(class_idx)} | {
+            idx for idx in index.by_idx if idx != int(class_idx) and index.resolve(idx) is row
+        }
+        rows = [r for r in index.rows if int(r["class_idx"]) not in dropped]
+        write_csv(LABELS_CSV, rows, LABEL_FIELDS)
+
+    shutil.rmtree(os.path.join(FEATURE_ROOT, row["folder_name"]), ignore_errors=True)
+    return dict(row)
+
+# ---- Label merge ----
+def merge_labels_bulk(pairs):
+    """
+    Merge many (src_class_idx, dst_class_idx) pairs in one pass.
+
+    Each merge is O(1) on the dataset: the src folder is moved inside the dst folder with
+    a single rename and the src label row is marked merged_into=dst. Sample rows keep their
+    original class_idx/folder_name and are resolved through the alias on read, so
+    samples.csv is never rewritten. labels.csv is written once for the whole batch.
+    Blob store objects stay where they are (see sample_key).
+    Raises KeyError for unknown labels and ValueError for self-merges.
+    """
+    from app.processing import dataset_stats
+
+    with file_lock("labels"):
+        index = load_labels()
+        rows = [dict(r) for r in index.rows]
+        by_idx = {int(r["class_idx"]): r for r in rows}
+
+        def active(class_idx):
+            row = by_idx.get(int(class_idx))
+            while row and row.get("merged_into"):
+                row = by_idx.get(int(row["merged_into"]))
+            if row is None:
+                raise KeyError(class_idx)
+            return row
+
+        moves = []
+        for src_class_idx, dst_class_idx in pairs:
+            src_label, dst_label = active(src_class_idx), active(dst_class_idx)
+            if src_label is dst_label:
+                raise ValueError(f"Cannot merge label {src_class_idx} into itself")
+            src_label["merged_into"] = dst_label["class_idx"]
+            moves.append((src_label["folder_name"], dst_label["folder_name"],
+                          src_label["class_idx"], dst_label["class_idx"]))
+
+        # labels.csv still points at the old folders until it is written below: if any move
+        # (or the write) fails, the folders already moved are put back so no sample is lost.
+        done = []
+        try:
+            for src_folder, dst_folder, _, _ in moves:
+                src_path = os.path.join(FEATURE_ROOT, src_folder)
+                dst_path = os.path.join(FEATURE_ROOT, dst_folder)
+                os.makedirs(dst_path, exist_ok=True)
+                if os.path.isdir(src_path):
+                    moved_path = os.path.join(dst_path, src_folder)
+                    os.replace(src_path, moved_path)
+                    done.append((src_path, moved_path))
+
+            with file_lock("samples"):
+                write_csv(LABELS_CSV, rows, LABEL_FIELDS)
+                dataset_stats.record_merged([(src, dst) for _, _, src, dst in moves])
+        except BaseException:
+            if load_labels().stamp == index.stamp:  # labels.csv not rewritten: undo the moves
+                for src_path, moved_path in reversed(done):
+                    os.replace(moved_path, src_path)
+            raise
+    return True
+
+def merge_labels(src_class_idx, dst_class_idx):
+    """Merge all samples from src into dst."""
+    return merge_labels_bulk([(src_class_idx, dst_class_idx)])
+
 # ---- Sample management ----
-def save_sample(sequence_array, class_idx, folder_name, metadata=None):
+def continues(f, inode, offset, tail):
     """
-    Save npz + json metadata in the correct folder.
-    Returns file path.
+    True if the open file f is the file an incremental reader consumed up to `offset`,
+    `tail` being the last unit (line / record) it read, i.e. only appends happened since.
+    Rewrites (temp file + rename) can reuse the old inode, so besides the inode the bytes
+    before offset must still end with tail. Rewriters only drop units or rewrite them
+    deterministically (dataset GC, similarity compact / rebuild), so an unchanged last
+    consumed unit at the same offset means an unchanged prefix.
+    """
+    st = os.fstat(f.fileno())
+    if st.st_ino != inode or st.st_size < offset:
+        return False
+    if not tail:
+        return offset == 0
+    f.seek(offset - len(tail))
+    return f.read(len(tail)) == tail
+
+class _SampleIndex:
+    """
+    In-memory view of samples.csv. Appends are parsed incrementally from the last
+    consumed offset; a rewrite (see continues) triggers a full reload.
     """
+
+    def __init__(self):
+        self.stamp = None
+        self.inode = None
+        self.offset = 0
+        self.tail = b""
+        self.fieldnames = None
+        self.rows = []
+        self.by_id = {}
+
+    def refresh(self, path):
+        stamp = file_stamp(path)
+        if stamp is None:
+            self.__init__()
+            return self
+        if stamp == self.stamp:
+            return self
+        with open(path, "rb") as f:
+            if not continues(f, self.inode, self.offset, self.tail):
+                self.__init__()
+                self.inode = os.fstat(f.fileno()).st_ino
+            f.seek(self.offset)
+            chunk = f.read()
+        self.stamp = stamp
+        end = chunk.rfind(b"\n") + 1  # ignore a trailing line still being written
+        if end == 0:
+            return self
+        self.offset += end
+        self.tail = chunk[chunk.rfind(b"\n", 0, end - 1) + 1:end]
+        reader = csv.DictReader(io.StringIO(chunk[:end].decode("utf-8"), newline=""), fieldnames=self.fieldnames)
+        new_rows = list(reader)
+        if self.fieldnames is None:
+            self.fieldnames = reader.fieldnames
+        self.rows.extend(new_rows)
+        for r in new_rows:
+            self.by_id[r["sample_id"]] = r
+        return self
+
+_sample_index = _SampleIndex()
+_sample_index_lock = threading.Lock()
+
+def load_samples():
+    with _sample_index_lock:
+        return _sample_index.refresh(SAMPLES_CSV)
+
+def _resolved(row, labels):
+    class_idx = int(row["class_idx"])
+    owner = labels.resolve(class_idx)
+    if owner is None or int(owner["class_idx"]) == class_idx:
+        return dict(row)
+    out = dict(row)
+    out["class_idx"] = owner["class_idx"]
+    out["folder_name"] = labels.resolve_folder(class_idx, row["folder_name"])
+    return out
+
+def list_samples():
+    """All sample rows with class_idx/folder_name resolved through label merges."""
+    labels = load_labels()
+    return [_resolved(r, labels) for r in load_samples().rows]
+
+def get_sample(sample_id):
+    row = load_samples().by_id.get(sample_id)
+    return _resolved(row, load_labels()) if row else None
+
+def sample_path(row):
+    return os.path.join(FEATURE_ROOT, row["folder_name"], row["file"])
+
+def _publish_blobs(*paths):
+    """Copy freshly written sample files to a remote blob store (no-op with the local backend)."""
+    from app.processing import object_store
+
+    store = object_store.get_store()
+    if store.remote:
+        for path in paths:
+            store.put_file(path, object_store.key_for(path))
+
+def sample_key(row):
+    """
+    Blob store key of a sample's npz: the path it was written to, i.e. the folder_name of
+    the catalog row as stored. Label merges move local folders but never blob keys, so
+    the key of a sample does not change after it is saved.
+    """
+    stored = load_samples().by_id.get(row["sample_id"]) or row
+    return f"features/{stored['folder_name']}/{stored['file']}"
+
+def local_sample_path(row, meta=False):
+    """
+    sample_path(row) if this node has the file, else a copy fetched from the blob store
+    into the local cache. None when the sample exists nowhere. meta=True resolves the
+    .json sidecar instead of the npz.
+    """
+    from app.processing import object_store
+
+    path, key = sample_path(row), sample_key(row)
+    if meta:
+        path, key = os.path.splitext(path)[0] + ".json", os.path.splitext(key)[0] + ".json"
+    if os.path.exists(path):
+        return path
+    try:
+        path = object_store.get_store().local_path(key)
+    except Exception:  # missing object or store unreachable
+        return None
+    return path if os.path.exists(path) else None
+
+def _write_sample_files(sequence_array, class_idx, folder_name, metadata=None, pending=None):
+    """
+    Write npz + json for one sample and return (npz_path, catalog row, embedding).
+    metadata gets sample_id etc., plus near_duplicate_of / duplicate_score when the
+    similarity index (or a not yet indexed sample of the same batch, see
+    similarity.flag_duplicate) is a near-duplicate.
+    """
+    from app.processing import similarity
+
+    embedding = similarity.flag_duplicate(sequence_array, metadata, pending)
     sample_uuid = uuid.uuid4().hex[:8]
     fname = f"sample_{class_idx:04d}_{sample_uuid}"
     npz_path = os.path.join(FEATURE_ROOT, folder_name, fname + ".npz")
     json_path = os.path.join(FEATURE_ROOT, folder_name, fname + ".json")
+    os.makedirs(os.path.dirname(npz_path), exist_ok=True)
 
     # Save npz
     import numpy as np
-    np.savez_compressed(npz_path, sequence=sequence_array.astype("float32"))
+    with atomic_open(npz_path) as f:
+        np.savez_compressed(f, sequence=sequence_array.astype("float32"))
 
     # Save metadata
-    metadata = metadata or {}
     metadata.update({
+        "sample_id": uuid.uuid4().hex[:8],
         "class_idx": class_idx,
         "folder_name": folder_name,
         "sample_uuid": sample_uuid,
         "created_at": now_str(),
     })
-    with open(json_path, "w", encoding="utf-8") as f:
+    with atomic_open(json_path, "w", encoding="utf-8") as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
+    _publish_blobs(npz_path, json_path)
+
+    return npz_path, _sample_row(fname + ".npz", class_idx, folder_name, metadata), embedding
+
+def save_sample(sequence_array, class_idx, folder_name, metadata=None):
+    """
+    Save npz + json metadata in the correct folder.
+    Returns file path.
+    """
+    from app.processing import similarity
+
+    metadata = metadata if metadata is not None else {}
+    with tracing.span("storage.save_sample", class_idx=class_idx):
+        with tracing.span("storage.write_files"):
+            npz_path, row, embedding = _write_sample_files(sequence_array, class_idx, folder_name, metadata)
 
-    # Record in samples.csv
-    add_sample_record(fname + ".npz", class_idx, folder_name, metadata)
+        # Record in samples.csv
+        append_sample_records([row])
+        similarity.record_saved([row], [embedding], [metadata])
 
     return npz_path
 
-def add_sample_record(filename, class_idx, folder_name, metadata):
-    rows = read_csv(SAMPLES_CSV)
-    new_row = {
-        "sample_id": uuid.uuid4().hex[:8],
+def save_samples_batch(items):
+    """
+    Save many samples with a single catalog commit (one samples.csv append, one stats update).
+    items: iterable of (sequence_array, class_idx, folder_name, metadata). Returns npz paths.
+    """
+    from app.processing import similarity
+
+    paths, rows, embeddings, metadatas = [], [], [], []
+    pending = []  # (sample_id, embedding) of this batch: duplicates within one import are flagged too
+    for sequence_array, class_idx, folder_name, metadata in items:
+        metadata = metadata if metadata is not None else {}
+        npz_path, row, embedding = _write_sample_files(sequence_array, class_idx, folder_name, metadata, pending)
+        if embedding is not None:
+            pending.append((row["sample_id"], embedding))
+        paths.append(npz_path)
+        rows.append(row)
+        embeddings.append(embedding)
+        metadatas.append(metadata)
+    append_sample_records(rows)
+    similarity.record_saved(rows, embeddings, metadatas)
+    return paths
+
+def _sample_row(filename, class_idx, folder_name, metadata):
+    return {
+        "sample_id": metadata.get("sample_id") or uuid.uuid4().hex[:8],
         "class_idx": str(class_idx),
         "folder_name": folder_name,
         "file": filename,
@@ -123,43 +520,30 @@ def add_sample_record(filename, class_idx, folder_name, metadata):
         "dialect": metadata.get("dialect", ""),
         "created_at": metadata.get("created_at", now_str()),
     }
-    rows.append(new_row)
-    fieldnames = ["sample_id","class_idx","folder_name","file","user","session_id","frames","duration","source","dialect","created_at"]
-    write_csv(SAMPLES_CSV, rows, fieldnames)
 
-# ---- Label merge ----
-def merge_labels(src_class_idx, dst_class_idx):
+def add_sample_record(filename, class_idx, folder_name, metadata):
+    new_row = _sample_row(filename, class_idx, folder_name, metadata)
+    append_sample_records([new_row])
+    return new_row["sample_id"]
+
+def append_sample_records(rows):
     """
-    Merge all samples from src into dst. Update samples.csv and move files.
+    Append rows to samples.csv in one write and update dataset stats, under the samples lock.
+    Appending (instead of rewriting) keeps concurrent writers from losing rows and lets
+    the sample index parse only the new tail.
     """
-    label_rows = read_csv(LABELS_CSV)
-    samples = read_csv(SAMPLES_CSV)
-
-    # Find folder names
-    src_label = next(r for r in label_rows if int(r["class_idx"]) == src_class_idx)
-    dst_label = next(r for r in label_rows if int(r["class_idx"]) == dst_class_idx)
-    src_folder = os.path.join(FEATURE_ROOT, src_label["folder_name"])
-    dst_folder = os.path.join(FEATURE_ROOT, dst_label["folder_name"])
-
-    # Move files
-    if os.path.exists(src_folder):
-        for fname in os.listdir(src_folder):
-            shutil.move(os.path.join(src_folder, fname), os.path.join(dst_folder, fname))
+    from app.processing import dataset_stats
 
-    # Update samples.csv
-    for row in samples:
-        if int(row["class_idx"]) == src_class_idx:
-            row["class_idx"] = str(dst_class_idx)
-            row["folder_name"] = dst_label["folder_name"]
-
-    write_csv(SAMPLES_CSV, samples, samples[0].keys())
-
-    # Remove src label from labels.csv
-    label_rows = [r for r in label_rows if int(r["class_idx"]) != src_class_idx]
-    write_csv(LABELS_CSV, label_rows, label_rows[0].keys())
-
-    # Cleanup
-    if os.path.exists(src_folder):
-        shutil.rmtree(src_folder, ignore_errors=True)
-
-    return True
+    if not rows:
+        return
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=SAMPLE_FIELDS, extrasaction="ignore")
+    with tracing.span("storage.catalog_append", rows=len(rows)) as append_span, file_lock("samples"):
+        append_span.tag(lock_wait_ms=round((time.time() - append_span.start) * 1000, 2))
+        if not os.path.exists(SAMPLES_CSV) or os.path.getsize(SAMPLES_CSV) == 0:
+            writer.writeheader()
+        writer.writerows(rows)
+        os.makedirs(os.path.dirname(SAMPLES_CSV), exist_ok=True)
+        with open(SAMPLES_CSV, "a", newline="", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+        dataset_stats.record_added(rows)
@@ -4,6 +4,8 @@ import json
 import logging
 from typing import Tuple, Dict, Any, List
 
+from app.processing import storage_utils as su
+
 logger = logging.getLogger(__name__)
 
 
@@ -103,8 +105,10 @@ def validate_samples(base_dir: Path, expected_T: int = None, expected_D: int = N
                 else:
                     seq2 = seq[:target_T]
 
-                # overwrite npz (only store sequence in the npz)
-                np.savez_compressed(fpath, sequence=seq2.astype(np.float32))
+                # replace npz (only store sequence in the npz); never rewrite in place,
+                # the old inode may be hard-linked into a dataset version
+                with su.atomic_open(fpath) as f:
+                    np.savez_compressed(f, sequence=seq2.astype(np.float32))
                 # update meta frames (external .json)
                 meta_path = fpath.with_suffix('.json')
                 if meta_path.exists():
@@ -115,7 +119,8 @@ def validate_samples(base_dir: Path, expected_T: int = None, expected_D: int = N
                 else:
                     meta_obj = {}
                 meta_obj['frames'] = int(target_T)
-                meta_path.write_text(json.dumps(meta_obj, ensure_ascii=False), encoding='utf-8')
+                with su.atomic_open(meta_path, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(meta_obj, ensure_ascii=False))
                 fixed.append(str(fpath))
             except Exception as e:
                 cannot_fix.append({"file": str(fpath), "reason": str(e)})
@@ -0,0 +1,296 @@
+"""
+Immutable dataset versions (snapshots).
+
+A version is a directory dataset/versions/<name>/ holding
+- version.json: name, notes, who/when, sample count, bytes, manifest checksum
+- samples.csv: the catalog rows at snapshot time plus sha256 / size of every npz
+- labels.csv: the label table at snapshot time
+- features/<folder_name>/<file>.npz|.json: hard links to the live files ("materialised"),
+  absent for reference-only versions
+
+Hard links cost no data blocks and no copying, so creating a version takes one link per
+file. They stay valid because sample files are never modified in place: every writer goes
+through storage_utils.atomic_open (temp file + rename), so a later fix, merge or delete
+changes the live path but not the inode a version points at. Reference-only versions
+resolve each sample to its live file and are readable only while it still exists;
+verify() tells.
+
+Checksums are cached in dataset/versions/.checksums.csv keyed by (device, inode, mtime,
+size), so only files added since the previous snapshot are hashed.
+
+CLI:  python -m app.processing.versions create <name> [--notes N] [--reference-only]
+      python -m app.processing.versions list
+      python -m app.processing.versions verify <name>
+"""
+
+import io
+import os
+import re
+import csv
+import json
+import errno
+import shutil
+import hashlib
+import argparse
+import threading
+
+from app.processing import storage_utils as su
+
+VERSIONS_ROOT = os.path.join(su.DATASET_ROOT, "versions")
+CHECKSUMS_CSV = os.path.join(VERSIONS_ROOT, ".checksums.csv")
+CHECKSUM_FIELDS = ["dev", "ino", "mtime_ns", "size", "sha256"]
+MANIFEST_FIELDS = su.SAMPLE_FIELDS + ["sha256", "size"]
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+HASH_CHUNK = 1 << 20
+
+_checksums = {"stamp": None, "by_key": {}}
+_checksums_lock = threading.Lock()
+
+
+def _version_dir(name):
+    if not NAME_RE.match(name or ""):
+        raise ValueError("Version name must be 1-64 chars of letters, digits, '.', '_' or '-'")
+    return os.path.join(VERSIONS_ROOT, name)
+
+
+# ---- checksum cache ----
+def _stat_key(st):
+    return f"{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+def _load_checksums():
+    stamp = su.file_stamp(CHECKSUMS_CSV)
+    with _checksums_lock:
+        if stamp != _checksums["stamp"]:
+            _checksums["by_key"] = {f"{r['dev']}:{r['ino']}:{r['mtime_ns']}:{r['size']}": r["sha256"]
+                                    for r in su.read_csv(CHECKSUMS_CSV)}
+            _checksums["stamp"] = stamp
+        return _checksums["by_key"]
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def checksums(paths):
+    """{path: (sha256, size)} for existing paths; unseen files are hashed and added to the cache."""
+    cache = _load_checksums()
+    out, new_rows = {}, []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        key = _stat_key(st)
+        digest = cache.get(key)
+        if digest is None:
+            try:
+                digest = _sha256(path)
+            except FileNotFoundError:  # deleted since the stat
+                continue
+            new_rows.append({"dev": st.st_dev, "ino": st.st_ino, "mtime_ns": st.st_mtime_ns,
+                             "size": st.st_size, "sha256": digest})
+        out[path] = (digest, st.st_size)
+    if new_rows:
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=CHECKSUM_FIELDS)
+        with su.file_lock("versions"):
+            os.makedirs(VERSIONS_ROOT, exist_ok=True)
+            if not os.path.exists(CHECKSUMS_CSV) or os.path.getsize(CHECKSUMS_CSV) == 0:
+                writer.writeheader()
+            writer.writerows(new_rows)
+            with open(CHECKSUMS_CSV, "a", newline="", encoding="utf-8") as f:
+                f.write(buf.getvalue())
+    return out
+
+
+# ---- create ----
+def _link(src, dst):
+    """Hard link; copy when the filesystem cannot link (other device, no link support)."""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copy2(src, dst)
+
+
+def create_version(name, notes="", created_by="", materialize=True):
+    """
+    Snapshot the current catalog as version `name`. Samples appended while the snapshot
+    runs are simply not part of it; samples deleted while it runs are listed in "skipped".
+    Raises ValueError for bad or existing names.
+    """
+    final_dir = _version_dir(name)
+    if os.path.exists(final_dir):
+        raise ValueError(f"Version '{name}' already exists")
+
+    rows = su.list_samples()
+    labels = su.list_labels(include_merged=True)
+
+    os.makedirs(VERSIONS_ROOT, exist_ok=True)
+    tmp_dir = os.path.join(VERSIONS_ROOT, f".tmp-{name}-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    manifest, total_bytes, skipped = [], 0, []
+    try:
+        # Materialised versions link first and hash the link: it pins the inode, so the
+        # checksum is of exactly the file the version keeps even if the live one changes.
+        paths = {}
+        for r in rows:
+            path = su.local_sample_path(r)
+            if path is None:
+                continue
+            if materialize:
+                dst = os.path.join(tmp_dir, "features", r["folder_name"], r["file"])
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                try:
+                    _link(path, dst)
+                except FileNotFoundError:  # deleted since the catalog was read
+                    continue
+                meta_path = su.local_sample_path(r, meta=True)
+                if meta_path is not None:
+                    try:
+                        _link(meta_path, os.path.splitext(dst)[0] + ".json")
+                    except FileNotFoundError:
+                        pass
+                path = dst
+            paths[r["sample_id"]] = path
+        sums = checksums(paths.values())
+
+        for r in rows:
+            path = paths.get(r["sample_id"])
+            if path is None or path not in sums:
+                skipped.append(r["sample_id"])
+                continue
+            digest, size = sums[path]
+            manifest.append({**r, "sha256": digest, "size": size})
+            total_bytes += size
+
+        su.write_csv(os.path.join(tmp_dir, "samples.csv"), manifest, MANIFEST_FIELDS)
+        su.write_csv(os.path.join(tmp_dir, "labels.csv"), labels, su.LABEL_FIELDS)
+        info = {
+            "name": name,
+            "notes": notes,
+            "created_by": created_by,
+            "created_at": su.now_str(),
+            "materialized": bool(materialize),
+            "sample_count": len(manifest),
+            "label_count": len({r["class_idx"] for r in manifest}),
+            "total_bytes": total_bytes,
+            "skipped": skipped,
+            "manifest_sha256": _sha256(os.path.join(tmp_dir, "samples.csv")),
+        }
+        with open(os.path.join(tmp_dir, "version.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+
+        with su.file_lock("versions"):
+            if os.path.exists(final_dir):
+                raise ValueError(f"Version '{name}' already exists")
+            os.rename(tmp_dir, final_dir)  # the version appears complete or not at all
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return info
+
+
+# ---- read ----
+def get_version(name):
+    """version.json of a version, or None."""
+    if not NAME_RE.match(name or ""):
+        return None
+    try:
+        with open(os.path.join(_version_dir(name), "version.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def list_versions():
+    if not os.path.isdir(VERSIONS_ROOT):
+        return []
+    out = []
+    for name in sorted(os.listdir(VERSIONS_ROOT)):
+        if name.startswith(".") or not NAME_RE.match(name):
+            continue
+        info = get_version(name)
+        if info:
+            out.append(info)
+    return sorted(out, key=lambda v: v["created_at"])
+
+
+def version_rows(name):
+    """
+    Manifest rows of a version, each with "path": the frozen hard link, or for
+    reference-only versions the sample's current live file (None if it is gone).
+    Raises KeyError for unknown versions.
+    """
+    info = get_version(name)
+    if info is None:
+        raise KeyError(name)
+    base = _version_dir(name)
+    rows = su.read_csv(os.path.join(base, "samples.csv"))
+    for r in rows:
+        if info["materialized"]:
+            r["path"] = os.path.join(base, "features", r["folder_name"], r["file"])
+        else:
+            live = su.get_sample(r["sample_id"])
+            r["path"] = su.local_sample_path(live) if live else None
+    return rows
+
+
+def version_labels(name):
+    """Label table of a version at snapshot time. Raises KeyError for unknown versions."""
+    if get_version(name) is None:
+        raise KeyError(name)
+    return su.read_csv(os.path.join(_version_dir(name), "labels.csv"))
+
+
+def verify(name):
+    """Re-hash every file of a version against its manifest."""
+    rows = version_rows(name)
+    missing, mismatched = [], []
+    for r in rows:
+        if not r["path"] or not os.path.exists(r["path"]):
+            missing.append(r["sample_id"])
+        elif _sha256(r["path"]) != r["sha256"]:
+            mismatched.append(r["sample_id"])
+    return {"name": name, "ok": not missing and not mismatched, "checked": len(rows),
+            "missing": missing, "mismatched": mismatched}
+
+
+def delete_version(name):
+    """Remove a version. Live samples are untouched (only links are dropped). KeyError if unknown."""
+    if get_version(name) is None:
+        raise KeyError(name)
+    path = _version_dir(name)
+    trash = os.path.join(VERSIONS_ROOT, f".deleted-{name}-{os.getpid()}")
+    with su.file_lock("versions"):
+        os.rename(path, trash)
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset versions.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    create = sub.add_parser("create")
+    create.add_argument("name")
+    create.add_argument("--notes", default="")
+    create.add_argument("--reference-only", action="store_true", help="manifest only, no hard links")
+    sub.add_parser("list")
+    check = sub.add_parser("verify")
+    check.add_argument("name")
+    args = parser.parse_args()
+    if args.command == "create":
+        result = create_version(args.name, notes=args.notes, created_by="cli", materialize=not args.reference_only)
+    elif args.command == "list":
+        result = list_versions()
+    else:
+        result = verify(args.name)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
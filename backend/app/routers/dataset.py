@@ -1,21 +1,25 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request, BackgroundTasks
 from pydantic import BaseModel
 from typing import List
 import numpy as np
-import os
-import shutil
 from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
-import pandas as pd
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse
 from pathlib import Path
 
 
 from app.processing import storage_utils as su
+from app.processing import exporter
+from app.processing import preview as pv
+from app.processing import dataset_stats
+from app.processing import bulk_import
+from app.processing import similarity
+from app.processing import versions
+from app.processing import dataset_gc
 from ..core.oauth2 import get_current_user, get_current_admin, check_resource_owner
 from ..db import get_db, User
 
 router = APIRouter(prefix="/dataset", tags=["dataset"])
-DATASET_PATH = Path("dataset/features")
+DATASET_PATH = Path(su.FEATURE_ROOT)
 
 # ---- Models ----
 class LabelOut(BaseModel):
@@ -39,6 +43,13 @@ class SampleOut(BaseModel):
     source: str
     created_at: str
 
+class MergePair(BaseModel):
+    src_class_idx: int
+    dst_class_idx: int
+
+class MergeBatchRequest(BaseModel):
+    pairs: List[MergePair]
+
 
 # ---- Endpoints ----
 
@@ -51,61 +62,50 @@ def create_label(label: str = Form(...),
                  version: str = Form("v1"),
                  admin_user: User = Depends(get_current_admin)): 
     class_idx, folder = su.register_label(label, notes=notes, dataset_version=version)
-    labels = su.read_csv(su.LABELS_CSV)
-    new_label = next(r for r in labels if int(r["class_idx"]) == class_idx)
-    return new_label
+    return su.get_label(class_idx)
 
 
 # admin, user
 @router.get("/labels", response_model=List[LabelOut])
 def list_labels(current_user: User = Depends(get_current_user)):
-    return su.read_csv(su.LABELS_CSV)
+    return su.list_labels()
 
 #admin
 @router.post("/labels/merge")
 def merge_labels(src_class_idx: int = Form(...), dst_class_idx: int = Form(...),  admin_user: User = Depends(get_current_admin)):
-    ok = su.merge_labels(src_class_idx, dst_class_idx)
+    try:
+        ok = su.merge_labels(src_class_idx, dst_class_idx)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Label not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"status": "success" if ok else "failed"}
 
+# admin - Gộp nhiều label trong một lần
+@router.post("/labels/merge/batch")
+def merge_labels_batch(request: MergeBatchRequest, admin_user: User = Depends(get_current_admin)):
+    try:
+        ok = su.merge_labels_bulk([(p.src_class_idx, p.dst_class_idx) for p in request.pairs])
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Label {e.args[0]} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success" if ok else "failed", "merged": len(request.pairs)}
+
 # admin - Xóa label
 @router.delete("/labels/{class_idx}")
 def delete_label(class_idx: int, admin_user: User = Depends(get_current_admin)):
     """
     Xóa label theo class_idx.
-    Lưu ý: Nên kiểm tra xem có samples nào đang dùng label này không.
+    Không cho xóa nếu còn samples (kể cả samples đã merge vào label này).
     """
-    labels = su.read_csv(su.LABELS_CSV)
-    label = next((r for r in labels if int(r["class_idx"]) == class_idx), None)
-    
-    if not label:
+    try:
+        su.delete_label(class_idx)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Label not found")
-    
-    # Kiểm tra xem có samples nào đang dùng label này không
-    samples = su.read_csv(su.SAMPLES_CSV)
-    samples_with_label = [s for s in samples if int(s.get("class_idx", -1)) == class_idx]
-    
-    if samples_with_label:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Cannot delete label. {len(samples_with_label)} samples are using this label"
-        )
-    
-    # Xóa label khỏi CSV
-    labels = [r for r in labels if int(r["class_idx"]) != class_idx]
-    
-    # Ghi lại file CSV
-    import csv
-    with open(su.LABELS_CSV, 'w', newline='', encoding='utf-8') as f:
-        if labels:
-            writer = csv.DictWriter(f, fieldnames=labels[0].keys())
-            writer.writeheader()
-            writer.writerows(labels)
-    
-    # Xóa thư mục nếu tồn tại
-    folder_path = os.path.join("dataset/features", label["folder_name"])
-    if os.path.exists(folder_path):
-        shutil.rmtree(folder_path)
-    
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     return {"status": "success", "message": f"Label {class_idx} deleted"}
 
 # admin - Sửa label
@@ -120,33 +120,31 @@ def update_label(
     Cập nhật thông tin label.
     Chỉ cho phép sửa label_original và notes, không sửa class_idx.
     """
-    labels = su.read_csv(su.LABELS_CSV)
-    label_index = next((i for i, r in enumerate(labels) if int(r["class_idx"]) == class_idx), None)
-    
-    if label_index is None:
+    try:
+        return su.rename_label(class_idx, label_original=label, notes=notes)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Label not found")
-    
-    # Cập nhật các trường được cho phép
-    if label is not None:
-        labels[label_index]["label_original"] = label
-        # Cập nhật slug nếu label thay đổi
-        import re
-        new_slug = re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
-        labels[label_index]["slug"] = new_slug
-    
-    if notes is not None:
-        labels[label_index]["notes"] = notes
-    
-    # Ghi lại file CSV
-    import csv
-    with open(su.LABELS_CSV, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=labels[0].keys())
-        writer.writeheader()
-        writer.writerows(labels)
-    
-    return labels[label_index]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 
 
+# admin - thống kê toàn bộ dataset (không quét samples.csv)
+# user - chỉ thống kê trên samples của mình, giống các endpoint dataset khác
+@router.get("/stats")
+def get_dataset_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role == "admin":
+        stats = dict(dataset_stats.load())
+    else:
+        own = [s for s in su.list_samples() if s.get("user") == current_user.username]
+        stats = dataset_stats.summarize(own)
+    labels = su.load_labels()
+    stats["by_label"] = [
+        {"class_idx": int(idx), "label_original": (labels.by_idx.get(int(idx)) or {}).get("label_original", ""), "count": n}
+        for idx, n in stats["by_label"].items()
+    ]
+    return stats
 
 
 # User chỉ xem, xóa của mình
@@ -156,7 +154,7 @@ def list_samples(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)):
     
-    samples = su.read_csv(su.SAMPLES_CSV)
+    samples = su.list_samples()
 
     if current_user.role != "admin":
         samples = [s for s in samples if s.get("user") == current_user.username]
@@ -167,8 +165,7 @@ def list_samples(
 @router.get("/samples/{sample_id}/data")
 def get_sample_data(sample_id: str, current_user: User = Depends(get_current_user)):
    
-    samples = su.read_csv(su.SAMPLES_CSV)
-    sample = next((s for s in samples if s["sample_id"] == sample_id), None)
+    sample = su.get_sample(sample_id)
    
     if not sample:
         raise HTTPException(status_code=404, detail="Sample not found")
@@ -176,22 +173,91 @@ def get_sample_data(sample_id: str, current_user: User = Depends(get_current_use
     # Kiểm tra quyền
     check_resource_owner(sample["user"], current_user)
 
+    # Trả về file npz của sample_id (tải từ object store nếu node này chưa có)
+    file_path = su.local_sample_path(sample)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Sample file not found")
+    return FileResponse(file_path, media_type="application/octet-stream", filename=sample["file"])
+
+# User chỉ xem của mình - keypoints rút gọn cho SamplePreview
+@router.get("/samples/{sample_id}/preview")
+def get_sample_preview(
+    sample_id: str,
+    request: Request,
+    step: int = 1,
+    parts: str = "",
+    format: str = "json",
+    current_user: User = Depends(get_current_user),
+):
     """
-    Trả về file npz/json của sample_id
+    Downsampled (every `step`-th frame) and component-filtered (parts=hands,pose,face)
+    float16 keypoints, as compact JSON or .npy bytes (format=npy). Sends a strong ETag;
+    If-None-Match hits return 304 without reading the sample.
     """
-    base_dir = "dataset/features"
-    # giả sử trong samples.csv có file_path, bạn sẽ lookup từ đó
-    import csv
-    samples_file = os.path.join(base_dir, "samples.csv")
+    sample = su.get_sample(sample_id)
+    if not sample:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    check_resource_owner(sample["user"], current_user)
+    if format not in ("json", "npy"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'npy'")
+    if step <= 0:
+        raise HTTPException(status_code=400, detail="step must be >= 1")
+    try:
+        components = pv.parse_parts(parts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # ETag từ metadata trong catalog (+ stamp của file local nếu có): 304 không cần tải blob
+    identity = f"{sample_id}|{su.sample_key(sample)}|{sample.get('created_at', '')}"
+    etag = pv.preview_etag(identity, su.file_stamp(su.sample_path(sample)), step, components, format)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    file_path = su.local_sample_path(sample)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Sample file not found")
+    try:
+        arr, layout = pv.build_preview(file_path, step=step, parts=components)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "npy":
+        return Response(pv.to_npy_bytes(arr), media_type="application/octet-stream", headers=headers)
+    body = pv.to_compact_json(arr, layout)
+    body.update({"sample_id": sample_id, "step": step})
+    return JSONResponse(body, headers=headers)
 
-    with open(samples_file, newline='', encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["sample_id"] == sample_id:
-                file_path = row["file_path"]
-                return FileResponse(file_path, media_type="application/octet-stream")
+# User chỉ xem sample của mình, kết quả cũng chỉ gồm sample của mình; admin xem tất cả
+@router.get("/samples/{sample_id}/similar")
+def get_similar_samples(
+    sample_id: str,
+    k: int = 10,
+    min_score: float = None,
+    current_user: User = Depends(get_current_user),
+):
+    """Nearest samples by keypoint-trajectory embedding (approximate index, exact cosine scores)."""
+    sample = su.get_sample(sample_id)
+    if not sample:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    check_resource_owner(sample["user"], current_user)
+    if not 1 <= k <= 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+
+    # user thường: lấy dư rồi lọc theo owner
+    fetch = k if current_user.role == "admin" else k * 5
+    try:
+        rows = similarity.similar_samples(sample_id, k=fetch, min_score=min_score)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Sample not found")
+    if current_user.role != "admin":
+        rows = [r for r in rows if r.get("user") == current_user.username]
+    return {"sample_id": sample_id, "similar": rows[:k]}
 
-    return {"error": "Sample not found"}
+# admin - các cặp near-duplicate đã bị gắn cờ khi ingest
+@router.get("/duplicates")
+def list_duplicates(admin_user: User = Depends(get_current_admin)):
+    return similarity.list_duplicates()
 
 # user, admin
 @router.post("/samples/add")
@@ -206,30 +272,121 @@ def add_sample(
     current_user: User = Depends(get_current_user)
 ):
     # tìm folder theo class_idx
-    labels = su.read_csv(su.LABELS_CSV)
-    label = next((r for r in labels if int(r["class_idx"]) == class_idx), None)
+    label = su.get_label(class_idx)
     if not label:
         return {"status": "failed", "reason": "label not found"}
     folder = label["folder_name"]
 
-    # lưu file upload tạm thời
-    tmp_path = f"/tmp/{file.filename}"
-    with open(tmp_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
-    # đọc npz nếu cần, hoặc giả định file đã là npz chuẩn
-    if file.filename.endswith(".npz"):
-        seq = np.load(tmp_path)["sequence"]
-    else:
-        # fallback: random (chỉ demo)
-        seq = np.random.rand(60, 1605)
-
-    os.remove(tmp_path)
+    # đọc npz trực tiếp từ upload (không copy ra /tmp); chỉ chấp nhận npz có 'sequence' (T, D)
+    if not file.filename.endswith(".npz"):
+        raise HTTPException(status_code=400, detail="Only .npz files are accepted")
+    try:
+        with np.load(file.file, allow_pickle=False) as data:
+            seq = data["sequence"]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid npz: {e}")
+    if seq.ndim != 2:
+        raise HTTPException(status_code=400, detail=f"sequence must be 2D (T, D), got shape {seq.shape}")
 
     # save sample
     metadata = {"user": user, "session_id": session_id, "frames": frames, "duration": duration, "source": source}
-    path = su.save_sample(seq, class_idx, folder, metadata=metadata)
-    return {"status": "ok", "path": path}
+    path = su.save_sample(seq, int(label["class_idx"]), folder, metadata=metadata)
+    return {"status": "ok", "path": path, "sample_id": metadata["sample_id"],
+            "near_duplicate_of": metadata.get("near_duplicate_of")}
+
+# admin - import hàng loạt từ tar (npz + json)
+@router.post("/samples/import")
+def import_samples(
+    file: UploadFile = File(...),
+    label: str = Form(""),
+    user: str = Form(""),
+    dim: int = Form(None),
+    admin_user: User = Depends(get_current_admin),
+):
+    """
+    Stream-import a tar / tar.gz of npz+json pairs in one pass.
+    Returns counts and the list of rejected files with reasons.
+    """
+    try:
+        report = bulk_import.import_tar(file.file, default_label=label, user=user, expected_dim=dim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok", **report}
+# admin - snapshot bất biến của dataset (hard link, không copy)
+def _create_version_background(name: str, **kwargs):
+    try:
+        versions.create_version(name, **kwargs)
+    except Exception as e:
+        print(f"[ERROR] Creating version '{name}' failed: {e}")
+
+@router.post("/versions")
+def create_version(
+    background_tasks: BackgroundTasks,
+    name: str = Form(...),
+    notes: str = Form(""),
+    materialize: bool = Form(True),
+    background: bool = Form(False),
+    admin_user: User = Depends(get_current_admin),
+):
+    """
+    Snapshot the catalog. Plain def: hashing new files runs in the threadpool. With
+    background=true it answers 202 at once and the version appears at GET /versions/{name}
+    when done (large datasets, where hashing outlasts HTTP timeouts).
+    """
+    if versions.get_version(name) is not None:
+        raise HTTPException(status_code=409, detail=f"Version '{name}' already exists")
+    if not versions.NAME_RE.match(name):
+        raise HTTPException(status_code=400, detail="Version name must be 1-64 chars of letters, digits, '.', '_' or '-'")
+    kwargs = dict(notes=notes, created_by=admin_user.username, materialize=materialize)
+    if background:
+        background_tasks.add_task(_create_version_background, name, **kwargs)
+        return JSONResponse(status_code=202, content={"status": "creating", "name": name})
+    try:
+        return versions.create_version(name, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# admin, user
+@router.get("/versions")
+def list_versions(current_user: User = Depends(get_current_user)):
+    return versions.list_versions()
+
+@router.get("/versions/{name}")
+def get_version(name: str, current_user: User = Depends(get_current_user)):
+    info = versions.get_version(name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return info
+
+# admin - kiểm tra checksum của toàn bộ file trong version
+@router.get("/versions/{name}/verify")
+def verify_version(name: str, admin_user: User = Depends(get_current_admin)):
+    try:
+        return versions.verify(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+@router.delete("/versions/{name}")
+def delete_version(name: str, admin_user: User = Depends(get_current_admin)):
+    try:
+        versions.delete_version(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return {"status": "deleted", "name": name}
+
+# admin - dọn file mồ côi, dòng catalog hỏng, raw video cũ (mặc định chỉ báo cáo)
+@router.post("/gc")
+def run_gc(
+    dry_run: bool = Form(True),
+    mode: str = Form("quarantine"),
+    full: bool = Form(False),
+    admin_user: User = Depends(get_current_admin),
+):
+    try:
+        return dataset_gc.run(dry_run=dry_run, mode=mode, full=full)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ...existing code...
 
 @router.get("/sessions")
@@ -244,48 +401,124 @@ def list_sessions(
     """
     try:
         # Đọc samples.csv
-        samples = su.read_csv(su.SAMPLES_CSV)
+        samples = su.list_samples()
         
         if not samples:
             return []
         
-        # Convert sang DataFrame
-        df = pd.DataFrame(samples)
-        
-        # User chỉ xem của mình
+        # User chỉ xem của mình; admin có thể filter theo user
         if current_user.role != "admin":
-            df = df[df["user"] == current_user.username]
-        else:
-            # Admin có thể filter theo user
-            if user:
-                df = df[df["user"] == user]
-        
-        # Filter theo label (dùng class_idx hoặc folder_name)
-        if label:
-            df = df[df["folder_name"].str.contains(label, case=False, na=False)]
-        
-        # Filter theo date (dùng created_at)
-        if date:
-            df = df[df["created_at"].str.startswith(date, na=False)]
-        
-        # Group theo session_id
+            user = current_user.username
+        label = label.lower()
+
+        # Group theo session_id (một lượt duyệt, không cần pandas)
+        groups = {}
+        for s in samples:
+            if user and s.get("user") != user:
+                continue
+            # Filter theo label (dùng folder_name)
+            if label and label not in (s.get("folder_name") or "").lower():
+                continue
+            # Filter theo date (dùng created_at)
+            if date and not (s.get("created_at") or "").startswith(date):
+                continue
+            groups.setdefault(s.get("session_id", ""), []).append(s)
+
         sessions = []
-        if "session_id" in df.columns:
-            for sid, group in df.groupby("session_id"):
-                # Lấy thông tin labels từ folder_name hoặc class_idx
-                labels = list(group["folder_name"].unique()) if "folder_name" in group.columns else []
-                
-                sessions.append({
-                    "session_id": sid,
-                    "user": group["user"].iloc[0] if "user" in group.columns else "",
-                    "labels": labels,
-                    "samples_count": len(group),
-                    "created_at": group["created_at"].iloc[0] if "created_at" in group.columns else "",
-                })
-        
+        for sid in sorted(groups):
+            group = groups[sid]
+            sessions.append({
+                "session_id": sid,
+                "user": group[0].get("user", ""),
+                "labels": list(dict.fromkeys(s.get("folder_name", "") for s in group)),
+                "samples_count": len(group),
+                "created_at": group[0].get("created_at", ""),
+            })
+
         return sessions
         
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="samples.csv not found")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading sessions: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error reading sessions: {str(e)}")
+
+
+def _parse_range(header: str, size: int):
+    """Parse a single 'bytes=a-b' / 'bytes=a-' / 'bytes=-n' range. Returns (start, end) or None."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+# admin - Xuất dataset dạng stream (tar các sample hoặc X.npy/y.npy xếp chồng)
+@router.get("/export")
+def export_dataset(
+    request: Request,
+    format: str = "tar",
+    label: str = "",
+    user: str = "",
+    dialect: str = "",
+    source: str = "",
+    date_from: str = "",
+    date_to: str = "",
+    version: str = "",
+    frames: int = 60,
+    dim: int = None,
+    admin_user: User = Depends(get_current_admin),
+):
+    """
+    Stream a filtered subset of the dataset without temp files.
+    - format=tar: index.csv + <folder>/<sample>.npz/.json
+    - format=npy: index.csv + y.npy (N,) + X.npy (N, frames, dim)
+    version=<name> exports that dataset version (POST /dataset/versions) instead of the live catalog.
+    Samples whose file is gone everywhere are left out; X-Missing-Samples carries their count.
+    Supports Range / If-Range so interrupted downloads can resume.
+    """
+    if format not in ("tar", "npy"):
+        raise HTTPException(status_code=400, detail="format must be 'tar' or 'npy'")
+    params = {"label": label, "user": user, "dialect": dialect, "source": source,
+              "date_from": date_from, "date_to": date_to, "version": version}
+    try:
+        rows = exporter.select_samples(**params)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Version not found")
+    if format == "tar":
+        archive = exporter.build_tar(rows, params)
+    else:
+        archive = exporter.build_stacked(rows, params, frames=frames, dim=dim)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": archive.etag,
+        "Content-Disposition": f'attachment; filename="{archive.filename}"',
+    }
+    if archive.missing:
+        # sample có trong catalog nhưng không còn file (local lẫn blob store): báo cho client
+        headers["X-Missing-Samples"] = str(len(archive.missing))
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == archive.etag):
+        try:
+            byte_range = _parse_range(range_header, archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(archive.iter_bytes(start, end), status_code=206,
+                                     media_type=archive.media_type, headers=headers)
+
+    headers["Content-Length"] = str(archive.size)
+    return StreamingResponse(archive.iter_bytes(), media_type=archive.media_type, headers=headers)
@@ -1,34 +1,199 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
 from typing import Optional
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
 from app.worker import celery_app
-from ..core.oauth2 import get_current_admin
-from ..db import User
+from app.config import settings
+from app.job_tracking import job_to_dict, batch_summary, is_stale, FINISHED_STATES
+from app import job_progress, job_profiling
+from ..core.oauth2 import get_current_admin, get_current_user, get_current_user_stream, check_resource_owner
+from ..db import User, Job, get_db
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
 
 
+@router.get("/summary")
+def jobs_summary(window_minutes: int = 60, admin_user: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Backlog by state plus throughput / mean duration of jobs finished in the last window."""
+    by_state = dict(db.query(Job.state, func.count(Job.id)).group_by(Job.state).all())
+    since = datetime.utcnow() - timedelta(minutes=window_minutes)
+    finished, avg_duration = db.query(func.count(Job.id), func.avg(Job.duration)) \
+        .filter(Job.finished_at >= since).one()
+    return {
+        "by_state": by_state,
+        "window_minutes": window_minutes,
+        "finished": finished,
+        "jobs_per_minute": round(finished / max(window_minutes, 1), 3),
+        "avg_duration": float(avg_duration) if avg_duration is not None else None,
+    }
+
+
+@router.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str, items: bool = False, current_user: User = Depends(get_current_user),
+                     db: Session = Depends(get_db)):
+    """Aggregate progress of a batch upload (owner or admin); items=true adds the per-job rows."""
+    summary = batch_summary(db, batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    check_resource_owner(summary["owner"], current_user)
+    if items:
+        jobs = db.query(Job).filter(Job.batch_id == batch_id).order_by(Job.created_at).all()
+        summary["items"] = [job_to_dict(j) for j in jobs]
+    return summary
+
+
 @router.get("/{job_id}")
-def get_job_status(job_id: str, admin_user: User = Depends(get_current_admin)):
+def get_job_status(job_id: str, admin_user: User = Depends(get_current_admin), db: Session = Depends(get_db)):
     """
-    Query job status from Celery
+    Job status from the jobs table; Celery is only asked while the job is still running
+    (Celery results expire, the table does not).
     """
+    job = db.get(Job, job_id)
+    if job is not None and job.state in FINISHED_STATES:
+        return {
+            "job_id": job_id,
+            "status": job.state,
+            "result": {"status": "done", "sample_ids": job.sample_ids or []} if job.state == "SUCCESS" else None,
+            "traceback": job.error,
+            "job": job_to_dict(job),
+        }
+
     from celery.result import AsyncResult
     result = AsyncResult(job_id, app=celery_app)
+    if job is None and result.status == "PENDING":
+        raise HTTPException(status_code=404, detail="Job not found")
 
     response = {
         "job_id": job_id,
         "status": result.status,   # PENDING, STARTED, SUCCESS, FAILURE, RETRY
         "result": result.result if result.successful() else None,
-        "traceback": str(result.traceback) if result.failed() else None
+        "traceback": str(result.traceback) if result.failed() else None,
+        "job": job_to_dict(job) if job is not None else None,
     }
     return response
 
 
 @router.get("/")
-def list_jobs(limit: int = 10, admin_user: User = Depends(get_current_admin)):
+def list_jobs(
+    limit: int = 10,
+    offset: int = 0,
+    state: Optional[str] = None,
+    owner: Optional[str] = None,
+    label: Optional[str] = None,
+    session_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    admin_user: User = Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    """
+    Paginated job history, newest first. Filters map onto the (state|owner|label, created_at)
+    indexes; counts per state give a quick view of backlog.
+    """
+    limit = max(1, min(limit, 500))
+    query = db.query(Job)
+    if state:
+        query = query.filter(Job.state == state.upper())
+    if owner:
+        query = query.filter(Job.owner == owner)
+    if label:
+        query = query.filter(Job.label == label)
+    if session_id:
+        query = query.filter(Job.session_id == session_id)
+    if since:
+        query = query.filter(Job.created_at >= since)
+
+    total = query.count()
+    jobs = query.order_by(Job.created_at.desc()).offset(offset).limit(limit).all()
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "items": [job_to_dict(j) for j in jobs],
+    }
+
+
+@router.get("/{job_id}/profile")
+def get_job_profile(job_id: str, format: str = "text", sort: str = "cumulative", limit: int = 60,
+                    admin_user: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """
+    cProfile capture of a profiled job: format=pstats downloads the raw dump (snakeviz,
+    python -m pstats), format=text returns the top `limit` functions sorted by `sort`.
     """
-    ⚠️ Celery không lưu job history mặc định.
-    Để list nhiều job, bạn cần kết hợp Redis backend hoặc DB backend.
-    Ở đây chỉ demo nên chỉ trả thông báo.
+    job = db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.profile_path or not os.path.exists(job.profile_path):
+        raise HTTPException(status_code=404, detail="Job was not profiled")
+    if format == "pstats":
+        return FileResponse(job.profile_path, media_type="application/octet-stream", filename=f"{job_id}.pstats")
+    if format != "text":
+        raise HTTPException(status_code=400, detail="format must be 'text' or 'pstats'")
+    if sort not in job_profiling.SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(job_profiling.SORT_KEYS)}")
+    return PlainTextResponse(job_profiling.render_text(job.profile_path, sort, max(1, min(limit, 500))))
+
+
+def _sse(event: dict) -> str:
+    return f"event: progress\ndata: {json.dumps(event)}\n\n"
+
+
+@router.get("/{job_id}/events")
+def job_events(job_id: str, request: Request, current_user: User = Depends(get_current_user_stream),
+               db: Session = Depends(get_db)):
     """
-    return {"message": f"Listing last {limit} jobs not implemented (use DB backend)."}
\ No newline at end of file
+    Server-sent events with stage progress for one job (owner or admin).
+    The current state is sent first; the stream ends after the 'done' / 'error' event.
+    Token may be passed as ?access_token= for EventSource clients.
+    """
+    job = db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    check_resource_owner(job.owner, current_user)
+
+    if job.state in FINISHED_STATES or is_stale(job):
+        final = job_progress.make_event(job_id, "done" if job.state == "SUCCESS" else "error",
+                                        sample_ids=job.sample_ids or [],
+                                        error=job.error or ("worker lost" if job.state == "STARTED" else None))
+        return StreamingResponse(iter([_sse(final)]), media_type="text/event-stream")
+
+    async def stream():
+        import redis.asyncio as aioredis
+
+        client = aioredis.Redis.from_url(settings.broker_url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(job_progress.CHANNEL.format(job_id))
+            # read the snapshot after subscribing so no transition falls in between
+            snapshot = await client.get(job_progress.LAST_KEY.format(job_id))
+            if snapshot:
+                event = json.loads(snapshot)
+                yield _sse(event)
+                if event["stage"] in job_progress.TERMINAL_STAGES:
+                    return
+            idle = 0.0
+            while not await request.is_disconnected():
+                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if msg is None:
+                    idle += 1.0
+                    if idle >= 15:
+                        idle = 0.0
+                        yield ": keepalive\n\n"
+                    await asyncio.sleep(0)
+                    continue
+                idle = 0.0
+                event = json.loads(msg["data"])
+                yield _sse(event)
+                if event["stage"] in job_progress.TERMINAL_STAGES:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+            await client.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,48 +1,274 @@
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, UploadFile, File, Form, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.concurrency import run_in_threadpool
 import shutil
 import os
+import json
 import uuid
+import zipfile
+from typing import List
 
 from app.processing import storage_utils as su
-from app.tasks import enqueue_process_video
+from app.processing import object_store
+from celery import group
+from app.worker import celery_app, route_for_video, PROCESS_VIDEO_TASK
 from fastapi import Body, Depends
+from sqlalchemy.orm import Session
 import numpy as np
 from ..core.oauth2 import get_current_user
-from ..db import User
+from ..db import User, get_db, SessionLocal
+from app.config import settings
+from app.processing.frame_buffer import FrameRingBuffer
+from app.core.admission import check_video_admission, check_disk
+from app.core import tracing
+from app import job_tracking, job_progress
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
-UPLOAD_DIR = "dataset/raw_videos"
+UPLOAD_DIR = os.path.join(su.DATASET_ROOT, "raw_videos")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".avi", ".mkv", ".m4v")
+
+
+def _store_video(fileobj, user: str, label: str, filename: str):
+    """
+    Spool the upload to UPLOAD_DIR and hand it to the blob store. Returns (video_path, size):
+    the local path with the local backend, the object key ("raw_videos/...") with S3, where
+    the spooled copy is removed once the (multipart) upload has finished.
+    """
+    save_name = f"{user}_{label}_{uuid.uuid4().hex[:8]}_{os.path.basename(filename)}"
+    file_path = os.path.join(UPLOAD_DIR, save_name)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(fileobj, f)
+    size = os.path.getsize(file_path)
+    store = object_store.get_store()
+    if not store.remote:
+        return file_path, size
+    key = object_store.key_for(file_path)
+    try:
+        store.put_file(file_path, key)
+    finally:
+        os.remove(file_path)
+    return key, size
+
+
+def _discard_video(video_path: str):
+    store = object_store.get_store()
+    if store.remote:
+        store.delete(video_path)
+    elif os.path.exists(video_path):
+        os.remove(video_path)
 
 
 @router.post("/video")
-async def upload_video(
+def upload_video(
     file: UploadFile = File(...),
     user: str = Form(""),
     label: str = Form(...),
     dialect: str = Form(""),
     session_id: str = Form(None),
-    current_user: User = Depends(get_current_user)
+    profile: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
 ):
+    """
+    Plain def: the spool copy, (S3) multipart upload, DB and broker calls all block, so
+    FastAPI runs the whole handler in the threadpool.
+    """
     if not session_id:
         session_id = uuid.uuid4().hex
+    job_id = uuid.uuid4().hex
+    # profile=true chạy job dưới cProfile (chỉ admin); kết quả tải ở GET /jobs/{job_id}/profile
+    profile = profile and current_user.role == "admin"
+    with tracing.span("upload.video", kind="SERVER", job_id=job_id, owner=current_user.username, label=label):
+        check_video_admission(db, current_user.username, 1, path=UPLOAD_DIR)
 
-    class_idx, folder = su.register_label(label)
+        class_idx, folder = su.register_label(label)
 
-    save_name = f"{user}_{label}_{uuid.uuid4().hex[:8]}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, save_name)
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+        with tracing.span("upload.store_video") as store_span:
+            video_path, size = _store_video(file.file, user, label, file.filename)
+            store_span.tag(bytes=size)
 
-    # Gửi task tới Celery
-    job = enqueue_process_video.delay(video_path=file_path, user=user, label=label, session_id=session_id, dialect=dialect)
+        # Ghi job vào DB trước rồi mới gửi task tới Celery (worker chỉ cập nhật row đã có)
+        try:
+            job_tracking.create_job(db, job_id, owner=current_user.username, user=user, label=label,
+                                    session_id=session_id, dialect=dialect, video_path=video_path)
+        except Exception:
+            _discard_video(video_path)
+            raise
+        try:
+            with tracing.span("celery.enqueue", kind="PRODUCER", job_id=job_id):
+                # gửi task theo tên: API không import app.tasks (pipeline, OpenCV, MediaPipe)
+                celery_app.send_task(
+                    PROCESS_VIDEO_TASK,
+                    kwargs=dict(video_path=video_path, user=user, label=label, session_id=session_id, dialect=dialect,
+                                profile=profile),
+                    task_id=job_id,
+                    headers=tracing.celery_headers(),
+                    **route_for_video(size),
+                )
+        except Exception as e:
+            # không worker nào sẽ đọc file này nữa
+            _discard_video(video_path)
+            job_tracking.mark_finished(job_id, "FAILURE", error=f"enqueue failed: {e}")
+            raise
+        job_progress.publish(job_progress.make_event(job_id, "queued"))
 
     # Normalize response to frontend UploadResult shape
-    return {"success": True, "id": job.id, "session_id": session_id, "message": "queued"}
+    return {"success": True, "id": job_id, "session_id": session_id, "message": "queued"}
+
+
+@router.post("/videos")
+def upload_videos(
+    files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    user: str = Form(""),
+    label: str = Form(""),
+    labels: str = Form(""),
+    dialect: str = Form(""),
+    session_id: str = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Batch upload: many `files` and/or one zip `archive`, enqueued as one Celery group.
+    Label per file: `labels` (comma-separated, same order as files) or the shared `label`;
+    for zip entries the top-level folder name is the label (falls back to `label`); hidden
+    entries and __MACOSX/ are ignored and the uncompressed total is capped by BATCH_MAX_BYTES.
+    Returns a batch id; aggregate progress is at GET /jobs/batches/{batch_id}.
+    Plain def: zip inflation, file copies, DB and Redis calls run in the threadpool.
+    """
+    if not session_id:
+        session_id = uuid.uuid4().hex
+    per_file_labels = [l.strip() for l in labels.split(",")] if labels else []
+    files = files or []
+    if per_file_labels and len(per_file_labels) != len(files):
+        raise HTTPException(status_code=400, detail="labels must have one entry per file")
+
+    # Kiểm tra label, số lượng file và admission trước khi ghi bất kỳ file nào xuống đĩa
+    planned = []  # (label, filename, file object or zip entry)
+    for i, f in enumerate(files):
+        file_label = per_file_labels[i] if per_file_labels else label
+        if not file_label:
+            raise HTTPException(status_code=400, detail=f"Missing label for {f.filename}")
+        planned.append((file_label, f.filename, f.file))
+
+    zf = None
+    if archive is not None:
+        try:
+            zf = zipfile.ZipFile(archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive is not a zip file")
+        archive_bytes = 0
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            name = info.filename[2:] if info.filename.startswith("./") else info.filename
+            parts = name.split("/")
+            # bỏ metadata của macOS (__MACOSX/, ._file) và file/thư mục ẩn
+            if parts[0] == "__MACOSX" or any(p.startswith(".") for p in parts):
+                continue
+            archive_bytes += info.file_size
+            entry_label = parts[0] if len(parts) > 1 else label
+            if not entry_label:
+                zf.close()
+                raise HTTPException(status_code=400, detail=f"Missing label for {info.filename}")
+            planned.append((entry_label, parts[-1], info))
+
+    items = []  # (label, video_path, size)
+    try:
+        if not planned:
+            raise HTTPException(status_code=400, detail="No video files in request")
+        if len(planned) > settings.batch_max_files:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {settings.batch_max_files} videos")
+        if zf is not None and archive_bytes > settings.batch_max_bytes:
+            raise HTTPException(status_code=413, detail=f"Archive videos exceed {settings.batch_max_bytes} bytes uncompressed")
+        check_video_admission(db, current_user.username, len(planned), path=UPLOAD_DIR)
+
+        for item_label, filename, source in planned:
+            if isinstance(source, zipfile.ZipInfo):
+                with zf.open(source) as src:
+                    items.append((item_label, *_store_video(src, user, item_label, filename)))
+            else:
+                items.append((item_label, *_store_video(source, user, item_label, filename)))
+    except BaseException:
+        for _, video_path, _ in items:
+            _discard_video(video_path)
+        raise
+    finally:
+        if zf is not None:
+            zf.close()
+
+    # Mỗi label chỉ đăng ký một lần cho cả batch
+    for distinct_label in dict.fromkeys(l for l, _, _ in items):
+        su.register_label(distinct_label)
+
+    batch_id = uuid.uuid4().hex
+    jobs = []
+    sizes = {}
+    for item_label, video_path, size in items:
+        kwargs = dict(video_path=video_path, user=user, label=item_label, session_id=session_id, dialect=dialect)
+        job_id = uuid.uuid4().hex
+        jobs.append((job_id, kwargs))
+        sizes[job_id] = size
+    job_tracking.create_jobs(db, current_user.username, [(job_id, dict(kw)) for job_id, kw in jobs], batch_id=batch_id)
+
+    try:
+        with tracing.span("upload.videos.enqueue", kind="PRODUCER", batch_id=batch_id, count=len(jobs)):
+            group([
+                celery_app.signature(PROCESS_VIDEO_TASK, kwargs=kw).set(
+                    task_id=job_id, headers=tracing.celery_headers(), **route_for_video(sizes[job_id]))
+                for job_id, kw in jobs
+            ]).apply_async(task_id=batch_id)
+    except Exception as e:
+        for job_id, _ in jobs:
+            job_tracking.mark_finished(job_id, "FAILURE", error=f"enqueue failed: {e}")
+        raise
+    for job_id, _ in jobs:
+        job_progress.publish(job_progress.make_event(job_id, "queued", batch_id=batch_id))
+
+    return {"success": True, "id": batch_id, "batch_id": batch_id, "session_id": session_id,
+            "job_ids": [job_id for job_id, _ in jobs], "count": len(jobs), "message": "queued"}
+
+
+# helper: convert a MediaPipe-like dict into a flat numeric vector
+def flatten_landmarks(ld):
+    # If already a list/array of numbers, return as-is
+    if ld is None:
+        return None
+    if isinstance(ld, (list, tuple, np.ndarray)):
+        return np.asarray(ld)
+
+    # If dict (MediaPipe style) with keys like 'pose','face','left_hand','right_hand'
+    if isinstance(ld, dict):
+        parts = []
+        # order matters to keep consistent vector size
+        for key in ("pose", "face", "left_hand", "right_hand"):
+            elems = ld.get(key, [])
+            # each elem is expected to be dict with x,y,z and optionally visibility
+            for p in elems:
+                if p is None:
+                    # missing point -> pad zeros
+                    parts.extend([0.0, 0.0, 0.0, 0.0])
+                    continue
+                x = p.get("x") if isinstance(p, dict) else None
+                y = p.get("y") if isinstance(p, dict) else None
+                z = p.get("z") if isinstance(p, dict) else None
+                v = p.get("visibility") if isinstance(p, dict) else 1.0
+                # replace None with 0.0
+                parts.extend([
+                    float(x) if x is not None else 0.0,
+                    float(y) if y is not None else 0.0,
+                    float(z) if z is not None else 0.0,
+                    float(v) if v is not None else 0.0,
+                ])
+        return np.array(parts, dtype="float32")
+
+    # Unknown format -> attempt to coerce
+    return np.asarray(ld)
 
 
 @router.post("/camera")
+@tracing.traced("upload.camera", kind="SERVER")
 async def upload_camera(payload: dict = Body(...), current_user: User = Depends(get_current_user) ):
     """
     Accept frames (array of arrays) and metadata, save as npz via storage_utils.save_sample
@@ -56,6 +282,7 @@ async def upload_camera(payload: dict = Body(...), current_user: User = Depends(
 
     if not label or not frames:
         return {"success": False, "message": "Missing label or frames"}
+    check_disk(su.DATASET_ROOT)
 
     # Ensure label exists
     class_idx, folder = su.register_label(label)
@@ -63,42 +290,6 @@ async def upload_camera(payload: dict = Body(...), current_user: User = Depends(
     # Convert frames (list of {timestamp, landmarks}) into numpy array
     # We expect landmarks arrays per frame; stack into (T, N) array
     try:
-        # helper: convert a MediaPipe-like dict into a flat numeric vector
-        def flatten_landmarks(ld):
-            # If already a list/array of numbers, return as-is
-            if ld is None:
-                return None
-            if isinstance(ld, (list, tuple, np.ndarray)):
-                return np.asarray(ld)
-
-            # If dict (MediaPipe style) with keys like 'pose','face','left_hand','right_hand'
-            if isinstance(ld, dict):
-                parts = []
-                # order matters to keep consistent vector size
-                for key in ("pose", "face", "left_hand", "right_hand"):
-                    elems = ld.get(key, [])
-                    # each elem is expected to be dict with x,y,z and optionally visibility
-                    for p in elems:
-                        if p is None:
-                            # missing point -> pad zeros
-                            parts.extend([0.0, 0.0, 0.0, 0.0])
-                            continue
-                        x = p.get("x") if isinstance(p, dict) else None
-                        y = p.get("y") if isinstance(p, dict) else None
-                        z = p.get("z") if isinstance(p, dict) else None
-                        v = p.get("visibility") if isinstance(p, dict) else 1.0
-                        # replace None with 0.0
-                        parts.extend([
-                            float(x) if x is not None else 0.0,
-                            float(y) if y is not None else 0.0,
-                            float(z) if z is not None else 0.0,
-                            float(v) if v is not None else 0.0,
-                        ])
-                return np.array(parts, dtype="float32")
-
-            # Unknown format -> attempt to coerce
-            return np.asarray(ld)
-
         landmarks_seq = []
         for f in frames:
             raw = f.get("landmarks")
@@ -180,4 +371,112 @@ async def upload_camera(payload: dict = Body(...), current_user: User = Depends(
 
     path = su.save_sample(seq, class_idx, folder, metadata=metadata)
     # Normalize to UploadResult shape: return session id as id and include saved path
-    return {"success": True, "id": session_id, "path": path, "message": "saved"}
+    return {"success": True, "id": session_id, "path": path, "message": "saved",
+            "near_duplicate_of": metadata.get("near_duplicate_of")}
+
+
+def _authenticate_ws(token: str):
+    db = SessionLocal()
+    try:
+        return get_current_user(token, db)
+    finally:
+        db.close()
+
+
+@router.websocket("/camera/ws")
+async def upload_camera_ws(websocket: WebSocket, access_token: str = ""):
+    """
+    Streamed camera capture. Connect with ?access_token=<jwt>, then send JSON messages:
+      {"type": "start", "label", "user", "session_id", "dialect"}
+      {"type": "frame", "landmarks": ...} or {"type": "frames", "frames": [{"landmarks": ...}, ...]}
+      {"type": "stop"}  -> {"type": "saved", "success", "id", "path", "frames", "truncated", "dropped_frames"}
+      {"type": "cancel"}
+    Frames are flattened into a per-capture ring buffer as they arrive; several captures
+    can be recorded over one connection. A capture keeps only its last CAMERA_WS_MAX_FRAMES
+    frames ("truncated" tells the client). Malformed messages get an error reply and the
+    connection stays open.
+    """
+    try:
+        current_user = await run_in_threadpool(_authenticate_ws, access_token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    capture = None
+    try:
+        while True:
+            try:
+                msg = json.loads(await websocket.receive_text())
+            except (ValueError, TypeError, KeyError):  # not JSON, or a binary message
+                await websocket.send_json({"type": "error", "message": "Message is not valid JSON"})
+                continue
+            if not isinstance(msg, dict):
+                await websocket.send_json({"type": "error", "message": "Message must be a JSON object"})
+                continue
+            kind = msg.get("type")
+
+            if kind == "start":
+                try:
+                    check_disk(su.DATASET_ROOT)
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "status": 429, "message": e.detail})
+                    continue
+                label = msg.get("label")
+                if not label or not isinstance(label, str):
+                    await websocket.send_json({"type": "error", "message": "Missing label"})
+                    continue
+                class_idx, folder = await run_in_threadpool(su.register_label, label)
+                capture = {
+                    "class_idx": class_idx,
+                    "folder": folder,
+                    "user": msg.get("user", ""),
+                    "dialect": msg.get("dialect", ""),
+                    "session_id": msg.get("session_id") or uuid.uuid4().hex,
+                    "buffer": FrameRingBuffer(settings.camera_ws_max_frames),
+                }
+                await websocket.send_json({"type": "started", "session_id": capture["session_id"]})
+
+            elif kind in ("frame", "frames"):
+                if capture is None:
+                    await websocket.send_json({"type": "error", "message": "Send 'start' first"})
+                    continue
+                frames = msg.get("frames") if kind == "frames" else [msg]
+                if not isinstance(frames, list):
+                    await websocket.send_json({"type": "error", "message": "Invalid frame: 'frames' must be a list"})
+                    continue
+                try:
+                    for f in frames:
+                        if not isinstance(f, dict):
+                            raise ValueError("frame must be a JSON object")
+                        flat = flatten_landmarks(f.get("landmarks"))
+                        if flat is None:
+                            raise ValueError("frame missing landmarks")
+                        capture["buffer"].append(flat)
+                except (ValueError, TypeError) as e:
+                    await websocket.send_json({"type": "error", "message": f"Invalid frame: {e}"})
+
+            elif kind == "stop":
+                if capture is None or not len(capture["buffer"]):
+                    await websocket.send_json({"type": "saved", "success": False, "message": "No frames captured"})
+                    capture = None
+                    continue
+                seq = capture["buffer"].to_array()
+                metadata = {"user": capture["user"], "session_id": capture["session_id"], "frames": len(seq),
+                            "source": "camera", "dialect": capture["dialect"]}
+                path = await run_in_threadpool(su.save_sample, seq, capture["class_idx"], capture["folder"], metadata)
+                dropped = capture["buffer"].dropped
+                await websocket.send_json({"type": "saved", "success": True, "id": capture["session_id"],
+                                           "sample_id": metadata["sample_id"], "path": path, "frames": len(seq),
+                                           "truncated": dropped > 0, "dropped_frames": dropped,
+                                           "near_duplicate_of": metadata.get("near_duplicate_of")})
+                capture = None
+
+            elif kind == "cancel":
+                capture = None
+                await websocket.send_json({"type": "cancelled"})
+
+            else:
+                await websocket.send_json({"type": "error", "message": f"Unknown message type '{kind}'"})
+    except WebSocketDisconnect:
+        pass
@@ -5,7 +5,7 @@ from typing import List
 from datetime import date, datetime
 
 from ..db import get_db, User
-from ..core.oauth2 import get_current_user, get_current_admin
+from ..core.oauth2 import get_current_user, get_current_admin, invalidate_user
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -20,6 +20,12 @@ class UserCreate(BaseModel):
     birthdate: date | None = None
     role: str = "user"
 
+class UserUpdate(BaseModel):
+    email: EmailStr | None = None
+    gender: str | None = None
+    birthdate: date | None = None
+    role: str | None = None
+
 class UserOut(BaseModel):
     id: int
     username: str
@@ -50,9 +56,23 @@ def create_user(user: UserCreate, db = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    invalidate_user(new_user.username)
     
     return new_user
 
+@router.put("/{user_id}", response_model=UserOut)
+def update_user(user_id: int, changes: UserUpdate, admin_user = Depends(get_current_admin), db = Depends(get_db)):
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    for field, value in changes.dict(exclude_unset=True).items():
+        setattr(user, field, value)
+    db.commit()
+    db.refresh(user)
+    # role/profile đổi -> bỏ cache auth của user này
+    invalidate_user(user.username)
+    return user
+
 @router.get("/", response_model=List[UserOut])
 def get_all_users(admin_user = Depends(get_current_admin), db = Depends(get_db)):
     return db.query(User).all()
@@ -1,13 +1,69 @@
-from app.worker import celery_app
+from celery.signals import task_failure
+from celery.worker.request import Request
+
+from app.worker import celery_app, PROCESS_VIDEO_TASK
 from app.processing.pipeline import process_video_job
+from app.processing import object_store
+from app import job_tracking, job_profiling
+from app.job_progress import ProgressReporter, make_event, publish
+from app.core import metrics, tracing
+from app.db import SessionLocal, Job
+
+def _fail_unfinished(job_id: str, error: str):
+    """Record a failure the task body could not record itself (killed child, crash outside its try)."""
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        finished = job is not None and job.state in job_tracking.FINISHED_STATES
+    finally:
+        db.close()
+    if finished:
+        return
+    job_tracking.mark_finished(job_id, "FAILURE", stage="error", error=error)
+    publish(make_event(job_id, "error", error=error))  # ends the job's SSE stream
+
+
+class VideoRequest(Request):
+    # Hard time limit: the pool kills the child, and Celery neither runs the task's except
+    # block nor sends task_failure, so the main worker process records it here.
+    def on_timeout(self, soft, timeout):
+        super().on_timeout(soft, timeout)
+        if not soft:
+            _fail_unfinished(self.id, f"Hard time limit ({timeout}s) exceeded")
 
-@celery_app.task(bind=True)
-def enqueue_process_video(self, video_path: str, user: str, label: str, session_id: str, dialect: str = ""):
+
+@task_failure.connect
+def _on_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if sender is not None and sender.name == PROCESS_VIDEO_TASK:
+        _fail_unfinished(task_id, str(exception))
+
+
+@celery_app.task(bind=True, Request=VideoRequest)
+def enqueue_process_video(self, video_path: str, user: str, label: str, session_id: str, dialect: str = "",
+                          profile: bool = False):
     # This wrapper calls processing.pipeline (synchronous heavy processing)
     # Use try/except to capture failure and push status
-    try:
-        result = process_video_job(video_path, user, label, session_id, dialect)
-        return {"status": "done", "result": result}
-    except Exception as e:
-        # you can log here and rethrow or return failure
-        return {"status": "error", "error": str(e)}
+    job_id = self.request.id
+    with tracing.task_span("celery.process_video", self.request, job_id=job_id) as task_span:
+        job_tracking.mark_started(job_id, user=user, label=label, session_id=session_id, video_path=video_path)
+        timings = {}
+        progress = ProgressReporter(job_id, on_stage=lambda stage: job_tracking.update_job(job_id, stage=stage))
+        capture = {"path": None}
+        try:
+            with tracing.span("storage.fetch_video"):
+                local_video = object_store.local_path(video_path)  # read-through cache with the S3 backend
+            with job_profiling.profiled(job_id, job_profiling.should_profile(profile)) as capture:
+                result = process_video_job(local_video, user, label, session_id, dialect, timings=timings, progress=progress)
+            job_tracking.mark_finished(job_id, "SUCCESS", stage="done", stage_timings=timings,
+                                       sample_ids=result["sample_ids"], profile_path=capture["path"])
+            metrics.record_pipeline(timings, "success", frames=result["frames"], bytes_written=result["bytes_written"])
+            publish(make_event(job_id, "done", sample_ids=result["sample_ids"]))
+            return {"status": "done", "result": result}
+        except Exception as e:
+            # you can log here and rethrow or return failure
+            job_tracking.mark_finished(job_id, "FAILURE", stage="error", stage_timings=timings, error=str(e),
+                                       profile_path=capture["path"])
+            metrics.record_pipeline(timings, "failure")
+            task_span.tag(error=str(e)[:500])
+            publish(make_event(job_id, "error", error=str(e)))
+            return {"status": "error", "error": str(e)}
@@ -1,9 +1,16 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from app.config import settings
+from app.core import tracing
 
 # dùng Redis làm broker & backend từ environment variables
+PROCESS_VIDEO_TASK = "app.tasks.enqueue_process_video"
+
+# tasks are registered only in worker processes (include=); the API enqueues them by
+# name, so it never imports the pipeline and its OpenCV / MediaPipe dependencies
 celery_app = Celery(
     "sign_dataset",
+    include=["app.tasks"],
     broker=settings.broker_url or "redis://redis:6379/0",
     backend=settings.result_backend or "redis://redis:6379/0",
 )
@@ -15,7 +22,33 @@ celery_app.conf.update(
     result_expires=3600,
     timezone="Asia/Ho_Chi_Minh",
     enable_utc=True,
+    # short and long videos are consumed by separate workers (-Q video_short / -Q video_long)
+    task_default_queue=settings.celery_short_queue,
+    task_routes={PROCESS_VIDEO_TASK: {"queue": settings.celery_short_queue}},
+    # fair scheduling: a child reserves one task at a time and acks it only when done,
+    # so a long video never holds queued short jobs in its prefetch buffer
+    worker_prefetch_multiplier=settings.worker_prefetch_multiplier,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # recycle prefork children to bound MediaPipe/OpenCV memory growth
+    worker_max_tasks_per_child=settings.worker_max_tasks_per_child,
+    worker_max_memory_per_child=settings.worker_max_memory_per_child_kb,
+    task_soft_time_limit=settings.long_soft_time_limit,
+    task_time_limit=settings.long_soft_time_limit + settings.hard_time_limit_grace,
+    # with the Redis transport a LOWER number is served first (0 = highest priority)
+    broker_transport_options={"priority_steps": list(range(10)), "sep": ":", "queue_order_strategy": "priority"},
 )
 
-# Import tasks to register them with Celery
-from app import tasks
+
+def route_for_video(size_bytes: int) -> dict:
+    """apply_async options (queue, time limits, priority) for a video of the given size."""
+    if size_bytes >= settings.long_video_bytes:
+        queue, soft, priority = settings.celery_long_queue, settings.long_soft_time_limit, settings.long_priority
+    else:
+        queue, soft, priority = settings.celery_short_queue, settings.short_soft_time_limit, settings.short_priority
+    return {"queue": queue, "soft_time_limit": soft,
+            "time_limit": soft + settings.hard_time_limit_grace, "priority": priority}
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    tracing.set_service("signbridge-worker")
@@ -0,0 +1,239 @@
+"""
+Offline CPU micro-benchmarks for the processing pipeline stages.
+
+Runs without Redis, Postgres or a real MediaPipe model: videos are synthesised with
+cv2.VideoWriter and `mediapipe` is replaced by a stub Holistic that returns synthetic
+landmarks, so only our own code (decode/sampling, keypoint flattening, augmentation,
+sample writes, catalog reads, validation) is timed.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pipeline --out bench.json
+    python -m benchmarks.bench_pipeline --sizes 1000,10000 --baseline bench.json --tolerance 0.25
+
+Results are JSON ({"meta": ..., "results": {name: {p50, mean, min, max, n}}}). With
+--baseline, any benchmark whose p50 is more than `tolerance` slower than the baseline is
+reported and the process exits with status 1.
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+
+import numpy as np
+
+N_HAND, N_FACE = 21, 468
+
+
+# ---- stub MediaPipe ----
+class _Landmark:
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+class _LandmarkList:
+    def __init__(self, n, rng):
+        self.landmark = [_Landmark(*rng.random(3)) for _ in range(n)]
+
+
+class _Results:
+    def __init__(self, rng):
+        self.pose_landmarks = _LandmarkList(33, rng)
+        self.left_hand_landmarks = _LandmarkList(N_HAND, rng)
+        self.right_hand_landmarks = _LandmarkList(N_HAND, rng) if rng.random() > 0.3 else None
+        self.face_landmarks = _LandmarkList(N_FACE, rng)
+
+
+class _StubHolistic:
+    def __init__(self, **kwargs):
+        self._rng = np.random.default_rng(0)
+        self._results = [_Results(self._rng) for _ in range(8)]
+        self._i = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def process(self, image):
+        self._i += 1
+        return self._results[self._i % len(self._results)]
+
+
+def install_stub_mediapipe():
+    mp = types.ModuleType("mediapipe")
+    mp.solutions = types.SimpleNamespace(holistic=types.SimpleNamespace(Holistic=_StubHolistic))
+    sys.modules["mediapipe"] = mp
+
+
+# ---- fixtures ----
+def make_video(path, n_frames=300, fps=30.0, size=(640, 480)):
+    import cv2
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    for i in range(n_frames):
+        frame[:] = 30
+        x = (i * 7) % (size[0] - 80)
+        frame[100:180, x:x + 80] = (0, 200, 255)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def make_sequence(rng, T=60, D=1605, valid=40):
+    """Realistic sample: `valid` frames of keypoints followed by zero padding."""
+    seq = np.zeros((T, D), dtype=np.float32)
+    seq[:valid] = rng.random((valid, D), dtype=np.float32)
+    return seq
+
+
+def make_dataset(root, n_samples, n_labels=50, seed=0):
+    """Write n_samples npz/json pairs plus catalog rows directly (fast path, no per-sample locking)."""
+    from app.processing import storage_utils as su
+
+    marker = os.path.join(root, f".generated_{n_samples}")
+    if os.path.exists(marker):
+        return
+    shutil.rmtree(root, ignore_errors=True)
+    rng = np.random.default_rng(seed)
+    base = make_sequence(rng)
+    labels = [su.register_label(f"label-{i}") for i in range(n_labels)]
+    rows = []
+    for i in range(n_samples):
+        class_idx, folder = labels[i % n_labels]
+        fname = f"sample_{class_idx:04d}_{i:08x}"
+        path = os.path.join(su.FEATURE_ROOT, folder, fname)
+        np.savez_compressed(path + ".npz", sequence=base)
+        meta = {"sample_id": f"{i:08x}", "class_idx": class_idx, "folder_name": folder, "frames": 60,
+                "user": f"user{i % 20}", "source": "video", "created_at": su.now_str()}
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        rows.append(su._sample_row(fname + ".npz", class_idx, folder, meta))
+    su.append_sample_records(rows)
+    open(marker, "w").close()
+
+
+# ---- timing ----
+def timeit(fn, repeat=5, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"p50": statistics.median(times), "mean": statistics.fmean(times),
+            "min": min(times), "max": max(times), "n": repeat, "unit": "s"}
+
+
+def run(sizes, workdir, repeat):
+    from app.processing import storage_utils as su
+    from app.processing.ingest import sample_frames_from_video
+    from app.processing import keypoints_adapter as ka
+    from app.processing.augmenter import generate_augmented_sequences
+    from app.processing.validator import validate_samples
+    from pathlib import Path
+
+    results = {}
+    rng = np.random.default_rng(1)
+
+    video = make_video(os.path.join(workdir, "synthetic.mp4"))
+    results["sample_frames_from_video[300f@30fps->6fps]"] = timeit(
+        lambda: sample_frames_from_video(video, target_fps=6.0), repeat)
+
+    stub_results = _Results(np.random.default_rng(2))
+    results["extract_keypoints+flatten[x100 frames]"] = timeit(
+        lambda: [ka.flatten_keypoints(ka.extract_keypoints_from_results(stub_results)) for _ in range(100)], repeat)
+
+    frames = [np.zeros((480, 640, 3), dtype=np.uint8)] * 60
+    results["extract_sequence_from_frames[60 frames, stub holistic]"] = timeit(
+        lambda: ka.extract_sequence_from_frames(frames), repeat)
+
+    seq = make_sequence(rng)
+    results["generate_augmented_sequences[60x1605]"] = timeit(
+        lambda: generate_augmented_sequences(seq), repeat * 4)
+
+    class_idx, folder = su.register_label("bench-save")
+    results["save_sample[60x1605]"] = timeit(
+        lambda: su.save_sample(seq, class_idx, folder, metadata={"user": "bench", "frames": 60}), repeat * 4)
+
+    for n in sizes:
+        make_dataset(su.DATASET_ROOT, n)
+        su._sample_index.__init__()  # cold catalog cache
+        results[f"load_samples[cold,{n}]"] = timeit(
+            lambda: (su._sample_index.__init__(), su.list_samples()), repeat, warmup=0)
+        results[f"validate_samples[{n}]"] = timeit(
+            lambda: validate_samples(Path(su.FEATURE_ROOT), expected_T=60, expected_D=1605),
+            max(1, repeat // 2) if n >= 10000 else repeat, warmup=0)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        ratio = cur["p50"] / base["p50"] if base["p50"] else float("inf")
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:60s} {base['p50']*1e3:10.2f}ms -> {cur['p50']*1e3:10.2f}ms  x{ratio:5.2f} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="dataset sizes for catalog/validation benches")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workdir", default=None, help="reuse generated datasets between runs")
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="compare against a previous results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p50 slowdown ratio")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="signbridge-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["DATASET_ROOT"] = os.path.join(workdir, "dataset")
+    install_stub_mediapipe()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = run(sizes, workdir, args.repeat)
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                 "python": platform.python_version(), "numpy": np.__version__,
+                 "machine": platform.machine(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    for name, r in results.items():
+        print(f"{name:60s} p50={r['p50']*1e3:10.2f}ms  min={r['min']*1e3:10.2f}ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed beyond {args.tolerance:.0%}")
+            sys.exit(1)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time budget for the API process.
+
+Imports app.main in a fresh interpreter and fails (exit 1) when a heavy, worker-only
+module is loaded, or when cold import time / RSS exceed the budget. Run it in CI next to
+the benchmarks so an innocent top-level import cannot bring MediaPipe, OpenCV or pandas
+back into every uvicorn worker.
+
+Usage (from backend/):
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --max-seconds 3 --max-rss-mb 250 --top 15
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+FORBIDDEN = ("mediapipe", "cv2", "pandas", "tensorflow", "jax", "matplotlib", "sklearn", "scipy",
+             "albumentations", "app.tasks", "app.processing.pipeline", "app.processing.ingest")
+
+PROBE = r"""
+import json, resource, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_kb / 1024, "modules": sorted(sys.modules)}))
+"""
+
+
+def _import_times(stderr: str, top: int):
+    """Slowest modules by cumulative time from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="cold import budget for app.main")
+    parser.add_argument("--max-rss-mb", type=float, default=300.0, help="peak RSS budget after import")
+    parser.add_argument("--top", type=int, default=10, help="print the N slowest imports")
+    args = parser.parse_args()
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    # the API imports the DB module; no connection is made at import time
+    env.setdefault("DATABASE_URL", "sqlite://")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=backend_dir, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr[-4000:])
+        sys.exit(proc.returncode)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    loaded = set(result["modules"])
+    heavy = sorted(m for m in FORBIDDEN if m in loaded)
+    print(f"app.main import: {result['seconds']:.2f}s, peak RSS {result['rss_mb']:.0f} MB, {len(loaded)} modules")
+    print("slowest imports (cumulative):")
+    for us, name in _import_times(proc.stderr, args.top):
+        print(f"  {us / 1000:9.1f} ms  {name}")
+
+    failures = []
+    if heavy:
+        failures.append(f"worker-only modules imported by the API: {', '.join(heavy)}")
+    if result["seconds"] > args.max_seconds:
+        failures.append(f"import took {result['seconds']:.2f}s > {args.max_seconds}s")
+    if result["rss_mb"] > args.max_rss_mb:
+        failures.append(f"RSS {result['rss_mb']:.0f} MB > {args.max_rss_mb} MB")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+End-to-end API load test with local stand-ins.
+
+Boots the real FastAPI app under uvicorn against a scratch environment:
+  * database: SQLite file in the work dir (or --database-url, e.g. a local Postgres)
+  * Celery: in-memory broker/result backend, so nothing needs Redis
+  * dataset: temporary DATASET_ROOT seeded with catalog rows
+
+Concurrent clients then replay a mixed workload (label list, sample list, sessions,
+camera uploads, job polls) for a fixed duration at each dataset size, and p50/p95/p99
+latency per endpoint is reported. The dataset grows between rounds, so the cost of the
+CSV-backed paths can be read off as a function of catalog size.
+
+Usage (from backend/):
+    python -m loadtest.run --sizes 1000,10000,50000 --concurrency 32 --duration 20 --out load.json
+    python -m loadtest.run --mix labels=1,samples=1 --concurrency 8
+
+Video uploads are not part of the mix: with an in-process worker their MediaPipe time
+would dominate every number. Job polls hit seeded rows in the jobs table instead.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import uuid
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+
+DEFAULT_MIX = "labels=30,samples=20,sessions=15,camera=10,job=25"
+N_LABELS = 50
+FEATURE_DIM = 1605
+
+
+def prepare_env(workdir, database_url):
+    env = {
+        "DATABASE_URL": database_url or f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "DATASET_ROOT": os.path.join(workdir, "dataset"),
+        "CELERY_BROKER_URL": "memory://",
+        "CELERY_RESULT_BACKEND": "cache+memory://",
+        "MIN_FREE_DISK_BYTES": "0",  # scratch disks are small; disk admission is not under test
+        "CORS_ORIGINS": "",
+    }
+    os.environ.update(env)
+    return dict(os.environ, **env)
+
+
+# ---- seeding (same DATASET_ROOT / DB as the server; catalog writes are cross-process locked) ----
+def seed_users(n_users, password):
+    from passlib.hash import bcrypt
+    from app.db import init_db, SessionLocal, User
+
+    init_db()
+    db = SessionLocal()
+    try:
+        existing = {u for (u,) in db.query(User.username)}
+        hashed = bcrypt.hash(password)
+        db.add_all([
+            User(username=f"lt_user{i}", email=f"lt_user{i}@example.com", password=hashed, role="user", gender="unknown")
+            for i in range(n_users) if f"lt_user{i}" not in existing
+        ])
+        db.commit()
+    finally:
+        db.close()
+    return [f"lt_user{i}" for i in range(n_users)]
+
+
+def seed_jobs(n_jobs, usernames, labels):
+    from app.db import SessionLocal, Job
+
+    now = datetime.utcnow()
+    db = SessionLocal()
+    jobs, job_ids = [], []
+    try:
+        for i in range(n_jobs):
+            state = random.choices(("SUCCESS", "FAILURE", "QUEUED", "STARTED"), (80, 5, 10, 5))[0]
+            created = now - timedelta(minutes=i)
+            job = Job(id=uuid.uuid4().hex, owner=random.choice(usernames), user="signer", label=random.choice(labels),
+                      session_id=f"lt-session-{i // 5}", state=state, created_at=created,
+                      stage="done" if state == "SUCCESS" else None, sample_ids=[f"{i:08x}"] if state == "SUCCESS" else None)
+            if state in ("SUCCESS", "FAILURE"):
+                job.started_at, job.finished_at, job.duration = created, created + timedelta(seconds=20), 20.0
+            jobs.append(job)
+            job_ids.append(job.id)
+        db.add_all(jobs)
+        db.commit()
+    finally:
+        db.close()
+    return job_ids
+
+
+def seed_labels():
+    from app.processing import storage_utils as su
+
+    return [su.register_label(f"lt-label-{i}")[0] for i in range(N_LABELS)]
+
+
+def grow_dataset(target, usernames, chunk=10000):
+    """
+    Append catalog rows until samples.csv holds `target` rows. Only rows are written: the
+    endpoints under test read the catalog, never the npz files.
+    """
+    from app.processing import storage_utils as su
+
+    labels = su.list_labels()
+    have = len(su.load_samples().rows)
+    start = datetime.utcnow() - timedelta(days=90)
+    while have < target:
+        rows = []
+        for i in range(have, min(target, have + chunk)):
+            label = labels[i % len(labels)]
+            meta = {"sample_id": f"{i:08x}", "user": usernames[i % len(usernames)],
+                    "session_id": f"lt-session-{i // 10}", "frames": 60, "source": "video",
+                    "dialect": ("north", "central", "south")[i % 3],
+                    "created_at": (start + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S")}
+            fname = f"sample_{int(label['class_idx']):04d}_{i:08x}.npz"
+            rows.append(su._sample_row(fname, int(label["class_idx"]), label["folder_name"], meta))
+        su.append_sample_records(rows)
+        have += len(rows)
+    return have
+
+
+# ---- server ----
+def start_server(env, port, workers, workdir):
+    log = open(os.path.join(workdir, "server.log"), "ab")
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.Popen(cmd, cwd=backend_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc
+
+
+async def wait_ready(client, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup, see server.log")
+        try:
+            if (await client.get("/openapi.json")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("server did not become ready")
+
+
+async def login(client, username, password):
+    r = await client.post("/auth/login", json={"username": username, "password": password})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+# ---- workload ----
+def camera_payload(n_frames):
+    rng = np.random.default_rng(0)
+    frames = [{"timestamp": i / 30, "landmarks": np.round(rng.random(FEATURE_DIM), 4).tolist()} for i in range(n_frames)]
+    return frames
+
+
+def make_requests(ctx):
+    """name -> coroutine factory(client, rng) returning the response."""
+    frames = ctx["frames"]
+
+    def as_user(rng):
+        # a fifth of the traffic comes from the admin (full, unfiltered views)
+        return ctx["admin"] if rng.random() < 0.2 else rng.choice(ctx["user_headers"])
+
+    return {
+        "labels": lambda c, rng: c.get("/dataset/labels", headers=as_user(rng)),
+        "samples": lambda c, rng: c.get("/dataset/samples", headers=as_user(rng)),
+        "sessions": lambda c, rng: c.get("/dataset/sessions", headers=as_user(rng)),
+        "camera": lambda c, rng: c.post("/upload/camera", headers=as_user(rng), json={
+            "user": "signer", "label": f"lt-label-{rng.randrange(N_LABELS)}", "session_id": f"lt-cam-{rng.randrange(1000)}",
+            "dialect": "north", "frames": frames}),
+        "job": lambda c, rng: c.get(f"/jobs/{rng.choice(ctx['job_ids'])}", headers=ctx["admin"]),
+    }
+
+
+async def client_loop(client, requests, names, weights, deadline, warmup_until, samples, seed):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            r = await requests[name](client, rng)
+            ok = r.status_code < 400
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        if time.monotonic() >= warmup_until:
+            samples.setdefault(name, []).append((elapsed, ok))
+
+
+def summarize(samples, duration):
+    out = {}
+    for name, recs in sorted(samples.items()):
+        lat = np.array([t for t, _ in recs]) * 1e3
+        errors = sum(1 for _, ok in recs if not ok)
+        out[name] = {"n": len(recs), "errors": errors, "rps": round(len(recs) / duration, 2),
+                     "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+                     "p99_ms": float(np.percentile(lat, 99)), "max_ms": float(lat.max())}
+    return out
+
+
+async def run_round(base_url, ctx, mix, concurrency, duration, warmup):
+    import httpx
+
+    names, weights = zip(*mix.items())
+    samples = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        requests = make_requests(ctx)
+        now = time.monotonic()
+        await asyncio.gather(*(
+            client_loop(client, requests, names, weights, now + warmup + duration, now + warmup, samples, seed)
+            for seed in range(concurrency)
+        ))
+    return summarize(samples, duration)
+
+
+def print_round(size, stats):
+    print(f"\n== dataset size {size} ==")
+    print(f"{'endpoint':10s} {'n':>7s} {'err':>5s} {'rps':>8s} {'p50ms':>9s} {'p95ms':>9s} {'p99ms':>9s} {'maxms':>9s}")
+    for name, s in stats.items():
+        print(f"{name:10s} {s['n']:7d} {s['errors']:5d} {s['rps']:8.1f} {s['p50_ms']:9.1f} "
+              f"{s['p95_ms']:9.1f} {s['p99_ms']:9.1f} {s['max_ms']:9.1f}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return {k: v for k, v in mix.items() if v > 0}
+
+
+async def main_async(args):
+    import httpx
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="signbridge-load-")
+    os.makedirs(workdir, exist_ok=True)
+    env = prepare_env(workdir, args.database_url)
+
+    usernames = seed_users(args.users, args.password)
+    labels = seed_labels()
+    job_ids = seed_jobs(args.jobs, usernames, [str(l) for l in labels])
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    proc = start_server(env, args.port, args.workers, workdir)
+    report = {"meta": {"concurrency": args.concurrency, "duration": args.duration, "workers": args.workers,
+                       "database": env["DATABASE_URL"].split(":")[0], "mix": args.mix}, "rounds": []}
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+            await wait_ready(client, proc)
+            ctx = {
+                "admin": await login(client, "admin", "123456"),
+                "user_headers": [await login(client, u, args.password) for u in usernames],
+                "job_ids": job_ids,
+                "frames": camera_payload(args.frames),
+            }
+        mix = parse_mix(args.mix)
+        unknown = set(mix) - set(make_requests(ctx))
+        if unknown:
+            raise SystemExit(f"unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+        for size in args.sizes:
+            actual = grow_dataset(size, usernames)
+            stats = await run_round(base_url, ctx, mix, args.concurrency, args.duration, args.warmup)
+            print_round(actual, stats)
+            report["rounds"].append({"dataset_size": actual, "endpoints": stats})
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000",
+                        type=lambda s: sorted(int(x) for x in s.split(",") if x),
+                        help="catalog sizes to measure at (ascending; the dataset only grows)")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured per size")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds discarded at the start of each round")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. labels=3,samples=1")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=30, help="frames per camera upload")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--database-url", default=None, help="default: SQLite file in the work dir")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workdir", default=None, help="keep DB, dataset and server.log here")
+    parser.add_argument("--out", default=None, help="write the report JSON here")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,3 +7,31 @@ export const getJobStatus = async (jobId: string): Promise<Result<JobStatus>> =>
   const res = await axiosClient.get(`/jobs/${jobId}`);
   return validateJobStatus(res.data);
 };
+
+export type JobProgressEvent = {
+  job_id: string;
+  stage: string;
+  done: number | null;
+  total: number | null;
+  progress: number;
+  ts: number;
+  [k: string]: unknown;
+};
+
+// Push-based progress (SSE). Returns a function that closes the stream.
+export const subscribeJobProgress = (
+  jobId: string,
+  onEvent: (event: JobProgressEvent) => void
+): (() => void) => {
+  const base = import.meta.env.VITE_API_URL || "http://localhost:8000";
+  const token = localStorage.getItem("access_token") ?? "";
+  const source = new EventSource(
+    `${base}/jobs/${jobId}/events?access_token=${encodeURIComponent(token)}`
+  );
+  source.addEventListener("progress", (msg) => {
+    const event = JSON.parse((msg as MessageEvent).data) as JobProgressEvent;
+    onEvent(event);
+    if (event.stage === "done" || event.stage === "error") source.close();
+  });
+  return () => source.close();
+};